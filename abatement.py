@@ -0,0 +1,288 @@
+'''
+Marginal abatement cost curves for the PT projects and the lever options.
+
+Costs are optional. A PT project's come from capex and opex columns in pt_details.csv, and a
+lever option's from lever_costs.csv, with one row per option:
+
+    lever,value,capex,opex,lifetime
+    bus_electrification_included,2025,150000000,-2000000,15
+    car_electrification_included,50,400000000,0,
+
+capex is the up front cost ($), opex the change in yearly running costs ($ per year, negative for
+a saving) and lifetime (optional, default_lifetime otherwise) the years the capex is spread over.
+Each intervention's yearly cost is its capex annualised at the discount rate plus its opex, and
+its abatement is the cut in 2030 emissions (t CO2-e per year) from emissions_2030_baseline.
+Interventions without costs are still evaluated, but are left off the curve.
+
+standalone() evaluates every intervention on its own, in one batch. Interventions interact,
+though: PT projects draw their riders from the same pkt, and a lever option counts for less once
+others have cut the emissions it acts on. curve() therefore builds the curve step by step. Each
+step evaluates every remaining intervention on top of those already chosen, as one batch, and
+takes the one with the lowest cost per tonne of the abatement it still adds. A lever option
+replaces the lever's current option, so its cost and abatement are relative to that.
+
+Usage:
+    python abatement.py                                  # print the curve
+    python abatement.py --html macc.html --csv macc.csv  # and save it as a chart and a table
+'''
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import engine
+
+
+default_discount_rate = 0.05
+default_lifetime = 30
+
+
+def load_lever_costs(path='lever_costs.csv'):
+    '''
+    This function reads the cost of each lever option (returns None if there is no file)
+
+    Outputs:
+        dataframe with lever, value, capex, opex and lifetime columns
+    '''
+    try:
+        costs = pd.read_csv(path)
+    except FileNotFoundError:
+        return None
+
+    for column in ['capex', 'opex', 'lifetime']:
+        if column not in costs:
+            costs[column] = np.nan
+    for lever, value in zip(costs.lever, costs.value):
+        if lever not in engine.lever_options:
+            raise ValueError('Unknown lever {} in {}'.format(lever, path))
+        options = engine.lever_options[lever]
+        allowed = options[0] <= value <= options[1] if isinstance(options, tuple) else value in options
+        if not allowed:
+            raise ValueError('{} is not an option of {} in {}'.format(value, lever, path))
+    return costs[['lever', 'value', 'capex', 'opex', 'lifetime']]
+
+
+def interventions(pt_details, lever_costs=None):
+    '''
+    This function lists the interventions for the curve: every PT project, and every lever option with costs
+
+    Inputs:
+        pt_details - dataframe of PT projects, with optional capex, opex and lifetime columns
+        lever_costs - optional dataframe from load_lever_costs
+
+    Outputs:
+        dataframe with one row per intervention of name, lever, value (the project, for PT projects),
+        capex, opex and lifetime
+    '''
+    rows = []
+    for project, details in pt_details.iterrows():
+        rows.append({'name': project, 'lever': 'pt_included', 'value': project,
+                     'capex': details.get('capex', np.nan), 'opex': details.get('opex', np.nan),
+                     'lifetime': details.get('lifetime', np.nan)})
+    if lever_costs is not None:
+        for _, option in lever_costs.iterrows():
+            if option.value == engine.lever_defaults[option.lever]:
+                continue
+            rows.append({'name': '{} = {:g}'.format(option.lever, option.value), 'lever': option.lever, 'value': option.value,
+                         'capex': option.capex, 'opex': option.opex, 'lifetime': option.lifetime})
+    return pd.DataFrame(rows, columns=['name', 'lever', 'value', 'capex', 'opex', 'lifetime'])
+
+
+def yearly_cost(capex, opex, lifetime, discount_rate=default_discount_rate):
+    '''
+    Returns the capex annualised over its lifetime at the discount rate, plus the opex ($ per year)
+    '''
+    capex = np.nan_to_num(np.asarray(capex, dtype=float))
+    opex = np.nan_to_num(np.asarray(opex, dtype=float))
+    lifetime = np.asarray(lifetime, dtype=float)
+    lifetime = np.where(np.isnan(lifetime), default_lifetime, lifetime)
+    if discount_rate == 0:
+        return capex / lifetime + opex
+    return capex * discount_rate / (1 - (1 + discount_rate) ** -lifetime) + opex
+
+
+def _option_costs(options, lever_costs, discount_rate):
+    # The yearly cost of each intervention, and of each lever option (the lever's default costs nothing
+    # unless lever_costs says otherwise). Interventions with neither capex nor opex have no cost (nan)
+    known = ~(options.capex.isna() & options.opex.isna())
+    costs = np.where(known, yearly_cost(options.capex.to_numpy(dtype=float), options.opex.to_numpy(dtype=float),
+                                        options.lifetime.to_numpy(dtype=float), discount_rate), np.nan)
+    lever_option_costs = {}
+    if lever_costs is not None:
+        for _, option in lever_costs.iterrows():
+            lever_option_costs[(option.lever, option.value)] = float(yearly_cost(option.capex, option.opex, option.lifetime, discount_rate))
+    return costs, lever_option_costs
+
+
+def _with(scenario, option):
+    # The scenario with one more intervention
+    changed = dict(scenario)
+    if option.lever == 'pt_included':
+        changed['pt_included'] = list(scenario['pt_included']) + [option.value]
+    else:
+        changed[option.lever] = option.value
+    return changed
+
+
+def _emissions(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, scenarios, **options):
+    # 2030 emissions of each scenario (t CO2-e), as one batch
+    batch = engine.make_batch(scenarios, list(pt_effects_pkt.index))
+    results = engine.evaluate_batch(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, batch, **options)
+    return results['emissions'].sum(axis=1) / 1000
+
+
+def standalone(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, options, lever_costs=None,
+               discount_rate=default_discount_rate, **evaluate_options):
+    '''
+    This function evaluates every intervention on its own, in one batch
+
+    Inputs:
+        numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt - as for engine.evaluate_batch
+        options - dataframe from interventions
+        lever_costs - optional dataframe from load_lever_costs (for the cost of each lever's default)
+        discount_rate - for annualising capex
+        evaluate_options - passed on to engine.evaluate_batch (mode_costs, od_effects)
+
+    Outputs:
+        options with abatement (t CO2-e per year, from emissions_2030_baseline), yearly_cost ($ per year,
+        relative to the lever's default) and cost_per_tonne columns
+    '''
+    baseline = base_numbers.loc['emissions_2030_baseline'].sum() / 1000
+    default = dict(engine.lever_defaults)
+    emissions = _emissions(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt,
+                           [_with(default, option) for option in options.itertuples()], **evaluate_options)
+    costs, lever_option_costs = _option_costs(options, lever_costs, discount_rate)
+    default_costs = np.array([lever_option_costs.get((option.lever, engine.lever_defaults[option.lever]), 0.0)
+                              if option.lever != 'pt_included' else 0.0 for option in options.itertuples()])
+
+    result = options.copy()
+    result['abatement'] = baseline - emissions
+    result['yearly_cost'] = costs - default_costs
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['cost_per_tonne'] = np.where(result.abatement > 0, result.yearly_cost / result.abatement, np.nan)
+    return result
+
+
+def curve(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, options, lever_costs=None,
+          discount_rate=default_discount_rate, **evaluate_options):
+    '''
+    This function builds the marginal abatement cost curve, taking the interactions between interventions into account
+
+    Inputs:
+        as for standalone
+
+    Outputs:
+        dataframe with one row per step of the curve, cheapest per tonne first: name, lever, value,
+        abatement (t CO2-e per year added by this step), yearly_cost ($ per year added by this step),
+        cost_per_tonne, and cumulative_abatement and emissions (t CO2-e per year) after the step
+    '''
+    costs, lever_option_costs = _option_costs(options, lever_costs, discount_rate)
+    options = options[~np.isnan(costs)].reset_index(drop=True)
+    costs = costs[~np.isnan(costs)]
+
+    baseline = base_numbers.loc['emissions_2030_baseline'].sum() / 1000
+    scenario = dict(engine.lever_defaults)
+    scenario['pt_included'] = []
+    current_emissions = baseline
+    chosen = np.zeros(len(options), dtype=bool)
+    steps = []
+
+    while True:
+        # Projects already in, and the lever options already set, are not candidates
+        candidates = [
+            k for k, option in enumerate(options.itertuples())
+            if not chosen[k] and (option.lever == 'pt_included' or scenario[option.lever] != option.value)
+        ]
+        if not candidates:
+            break
+        emissions = _emissions(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt,
+                               [_with(scenario, options.iloc[k]) for k in candidates], **evaluate_options)
+        abatement = current_emissions - emissions
+        # A lever option replaces the lever's current option, so it costs the difference between them
+        added_cost = np.array([
+            costs[k] - (lever_option_costs.get((options.lever[k], scenario[options.lever[k]]), 0.0)
+                        if options.lever[k] != 'pt_included' else 0.0)
+            for k in candidates
+        ])
+        useful = abatement > 1e-9 * max(baseline, 1)
+        if not useful.any():
+            break
+        with np.errstate(divide='ignore', invalid='ignore'):
+            per_tonne = np.where(useful, added_cost / abatement, np.inf)
+        best = int(np.argmin(per_tonne))
+        k = candidates[best]
+
+        option = options.iloc[k]
+        # An earlier option of the same lever no longer applies once it is replaced
+        if option.lever != 'pt_included':
+            chosen |= (options.lever == option.lever).to_numpy() & (options.value == scenario[option.lever]).to_numpy()
+        chosen[k] = True
+        scenario = _with(scenario, option)
+        current_emissions = emissions[best]
+        steps.append({
+            'name': option['name'], 'lever': option.lever, 'value': option.value,
+            'abatement': float(abatement[best]), 'yearly_cost': float(added_cost[best]), 'cost_per_tonne': float(per_tonne[best]),
+            'cumulative_abatement': float(baseline - current_emissions), 'emissions': float(current_emissions),
+        })
+
+    return pd.DataFrame(steps, columns=['name', 'lever', 'value', 'abatement', 'yearly_cost', 'cost_per_tonne',
+                                        'cumulative_abatement', 'emissions'])
+
+
+def curve_figure(steps):
+    '''
+    This function draws the curve: one bar per step, as wide as its abatement and as high as its cost per tonne
+
+    Outputs:
+        plotly figure
+    '''
+    import plotly.graph_objects as go
+
+    widths = steps.abatement.to_numpy() / 1000
+    left = np.concatenate([[0], np.cumsum(widths)[:-1]])
+    figure = go.Figure(go.Bar(
+        x = left + widths / 2,
+        y = steps.cost_per_tonne,
+        width = widths,
+        text = steps.name,
+        hovertemplate = '%{text}<br>%{width:,.1f} kt CO2-e per year<br>$%{y:,.0f} per tonne<extra></extra>',
+    ))
+    figure.update_layout(
+        title = 'Marginal Abatement Cost Curve (2030)',
+        xaxis_title = 'Abatement (kt CO2-e per year)',
+        yaxis_title = 'Cost ($ per tonne CO2-e)',
+        showlegend = False,
+    )
+    return figure
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Marginal abatement cost curve of the PT projects and lever options')
+    parser.add_argument('--lever-costs', default='lever_costs.csv', help='costs of the lever options')
+    parser.add_argument('--discount-rate', type=float, default=default_discount_rate, help='for annualising capex')
+    parser.add_argument('--mode-choice', action='store_true', help='use logit mode choice')
+    parser.add_argument('--csv', help='save the curve as a table')
+    parser.add_argument('--html', help='save the curve as an interactive chart')
+    args = parser.parse_args(argv)
+
+    import app
+    import mode_choice
+
+    lever_costs = load_lever_costs(args.lever_costs)
+    options = interventions(app.pt_details, lever_costs)
+    evaluate_options = {'mode_costs': mode_choice.load_costs()} if args.mode_choice else {'od_effects': app.od_effects}
+    steps = curve(app.numbers, app.master_base_numbers, app.emission_factors, app.pt_effects_vkt, app.pt_effects_pkt,
+                  options, lever_costs, args.discount_rate, **evaluate_options)
+    if steps.empty:
+        print('No interventions with costs: add capex and opex columns to pt_details.csv, or a {}'.format(args.lever_costs))
+        return
+
+    print(steps.to_string(index=False, float_format='{:,.1f}'.format))
+    if args.csv:
+        steps.to_csv(args.csv, index=False)
+    if args.html:
+        curve_figure(steps).write_html(args.html, include_plotlyjs='cdn')
+
+
+if __name__ == '__main__':
+    main()
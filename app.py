@@ -7,6 +7,25 @@ import numpy as np
 import plotly.graph_objects as go
 from dash.dependencies import Input, Output, State
 from pathlib import Path
+import flask
+import hashlib
+import inspect
+import json
+import os
+import plotly
+
+import coalescing
+import engine
+import fleet_size
+import goal_seek
+import instrumentation
+import jobs
+import mode_registry
+import od_demand
+import result_cache
+import service_profiles
+import shapley
+import traffic
 
 
 
@@ -43,10 +62,12 @@ def data_initialisation(base_numbers):
         numbers - dictionary with key values for calculations
     '''
     
+    mode_registry.check_modes(list(base_numbers.columns))
+
     # Finding the total pkt by private (and active) modes
-    private_modes =['passenger_light', 'electric_light', 'walking', 'cycling'] 
-    pt_modes = ['diesel_bus', 'electric_bus', 'heavy_rail', 'light_rail'] 
-    all_modes = ['passenger_light', 'electric_light', 'walking', 'cycling', 'diesel_bus', 'electric_bus', 'heavy_rail', 'light_rail'] 
+    private_modes = mode_registry.private_modes()
+    pt_modes = mode_registry.modes_where(category='pt')
+    all_modes = private_modes + pt_modes
     
     # What proportion of pkt are from each mode (for 2030 baseline)
     mode_sum_pkt = 0
@@ -73,7 +94,7 @@ def data_initialisation(base_numbers):
     
     return numbers
 
-def pt_proj_effects(numbers, base_numbers, pt_details):
+def pt_proj_effects(numbers, base_numbers, pt_details, profiles = None):
     '''
     This function returns dataframes which have the effect of different PT projects on the vkt 
     and pkt of different modes.
@@ -82,64 +103,59 @@ def pt_proj_effects(numbers, base_numbers, pt_details):
     numbers - dictionary containing key numbers
     pt_details - dataframe: containing frequency, capacity and distance data for various PT projects 
     base_numbers - dataframe: containing the PKT and VKT data for 2018, and for the 2030 baseline
+    profiles - optional hourly service profiles (see service_profiles), used instead of the
+               frequencies for the projects that have one
     
     OUTPUTS:
     pt_effects_vkt - dataframe with the effect of each project on the pkt and vkt for each mode
     pt_effects_pkt - dataframe with the effect of each project on the pkt and vkt for each mode
     '''
     
-    # Creating a new datafram for pkt and vkt by mode
-    pt_effects_pkt = pd.DataFrame(index = pt_details.index, columns = base_numbers.keys())
-    pt_effects_vkt = pd.DataFrame(index = pt_details.index, columns = base_numbers.keys())
-    
-    
-    # For each PT project
-    for project in pt_details.index:
-        
-        # Calculating the PKT by primary mode for each project
-        pt_effects_pkt.loc[project][pt_details.primary_mode[project]] = (
-            (60 / pt_details.peak_freq[project]) # Number of buses per hour in peak
-            * pt_details.distance[project] # Distance covered by this PT project 
-            * numbers['pkt_annualisation'] # Passenger annualisation factor: am peak to annual
-            * pt_details.vehicle_capacity[project] # Peak vehicle capacity
-            * 2 # Both directions
-            * 2 # For both AM peak hours
-        )
-        
-        # Calculating the VKT by primary mode for each project
-        pt_effects_vkt.loc[project][pt_details.primary_mode[project]] = (
-            ((60/pt_details.peak_freq[project]) # Number of buses per hour in peak
-            * pt_details.num_peak_hrs[project] # Number of hours considered peak
-            + (60/pt_details.off_peak_freq[project]) # Number of buses per hour in off-peak times
-            * (pt_details.num_hours[project]-pt_details.num_peak_hrs[project])) # Number of hours considered off-peak
-            * pt_details.distance[project] #  Distance covered by this PT project
-            * numbers['vkt_annualisation'] # Vehicle annualisation factor: day to year
-            * 2 # For both directions
-        )
-        
-        for mode in numbers['private_modes']:
-            # Calculating the effect on PKT for private/non-primary modes
-            #mode_prop = base_numbers.loc['pkt_2030_baseline'][mode] / numbers['mode_sum_pkt']
-            pt_effects_pkt.loc[project][mode] = (
-                - base_numbers.loc['pkt_2030_baseline'][mode] / numbers['mode_sum_pkt'] # Proportion of pkt by this mode in 2030 
-                * pt_effects_pkt.loc[project][pt_details.primary_mode[project]] # pkt by primary mode
-            )
-            
-            # Calculating the effect on VKT for private/non-primary modes
-            if mode in ['passenger_light', 'electric_light']:
-                pt_effects_vkt.loc[project][mode] = pt_effects_pkt.loc[project][mode]/numbers['car_occupancy']
-            elif mode in ['walking', 'cycling']:
-                pt_effects_vkt.loc[project][mode] = pt_effects_pkt.loc[project][mode]
-        
-        # No change in PT pkt or vkt (except primary mode)
-        for mode in numbers['pt_modes']:
-            if mode != pt_details.primary_mode[project]:
-                pt_effects_vkt.loc[project][mode] = 0 
-                pt_effects_pkt.loc[project][mode] = 0
+    modes = list(base_numbers.keys())
+    private_modes = numbers['private_modes']
+
+    # Calculating the PKT by primary mode for each project
+    primary_pkt = (
+        (60 / pt_details.peak_freq) # Number of buses per hour in peak
+        * pt_details.distance # Distance covered by this PT project 
+        * numbers['pkt_annualisation'] # Passenger annualisation factor: am peak to annual
+        * pt_details.vehicle_capacity # Peak vehicle capacity
+        * 2 # Both directions
+        * 2 # For both AM peak hours
+    ).to_numpy(dtype=float)
+
+    # Calculating the VKT by primary mode for each project
+    primary_vkt = (
+        ((60/pt_details.peak_freq) # Number of buses per hour in peak
+        * pt_details.num_peak_hrs # Number of hours considered peak
+        + (60/pt_details.off_peak_freq) # Number of buses per hour in off-peak times
+        * (pt_details.num_hours-pt_details.num_peak_hrs)) # Number of hours considered off-peak
+        * pt_details.distance #  Distance covered by this PT project
+        * numbers['vkt_annualisation'] # Vehicle annualisation factor: day to year
+        * 2 # For both directions
+    ).to_numpy(dtype=float)
+
+    # Projects with an hourly service profile
+    if profiles is not None:
+        profile_vkt, profile_pkt = service_profiles.profile_effects(numbers, pt_details, profiles)
+        primary_vkt = np.where(profiles['has_profile'], profile_vkt, primary_vkt)
+        primary_pkt = np.where(profiles['has_profile'], profile_pkt, primary_pkt)
+
+    # No change in PT pkt or vkt (except primary mode)
+    primary = pt_details.primary_mode.to_numpy()[:, np.newaxis] == np.array(modes)[np.newaxis, :]
+    pt_effects_pkt = pd.DataFrame(np.where(primary, primary_pkt[:, np.newaxis], 0.0), index = pt_details.index, columns = modes)
+    pt_effects_vkt = pd.DataFrame(np.where(primary, primary_vkt[:, np.newaxis], 0.0), index = pt_details.index, columns = modes)
+
+    # Calculating the effect on PKT for private/non-primary modes, by their proportion of pkt in 2030
+    mode_props = - base_numbers.loc['pkt_2030_baseline', private_modes].to_numpy(dtype=float) / numbers['mode_sum_pkt']
+    pt_effects_pkt[private_modes] = mode_props[np.newaxis, :] * primary_pkt[:, np.newaxis]
+
+    # Calculating the effect on VKT for private/non-primary modes
+    pt_effects_vkt[private_modes] = pt_effects_pkt[private_modes] / mode_registry.vkt_per_pkt(private_modes, numbers['car_occupancy'])
     
     return pt_effects_vkt, pt_effects_pkt
 
-def pt_projects_apply(base_numbers, pt_effects_vkt, pt_effects_pkt, pt_included):
+def pt_projects_apply(base_numbers, pt_effects_vkt, pt_effects_pkt, pt_included, od_effects = None):
     '''
     This function updates the 2030 scenario pkt and vkt based on the inclusion of different PT projects
     
@@ -148,12 +164,22 @@ def pt_projects_apply(base_numbers, pt_effects_vkt, pt_effects_pkt, pt_included)
         pt_effects_vkt - dataframe with the effect of each project on the pkt and vkt for each mode
         pt_effects_pkt - dataframe with the effect of each project on the pkt and vkt for each mode
         pt_included - list of included PT projects
+        od_effects - optional zone to zone effects (see od_demand.prepare), to shift trips in the
+                     OD pairs each project serves rather than across the region
         
     Outputs:
         updated base_numbers
     '''
     
-    if pt_included != []:
+    if pt_included != [] and od_effects is not None:
+        modes = list(base_numbers.columns)
+        pt_mask = pt_effects_pkt.index.isin(pt_included)[np.newaxis, :]
+        vkt = base_numbers.loc[['vkt_2030_scenario'], modes].to_numpy(dtype=float)
+        pkt = base_numbers.loc[['pkt_2030_scenario'], modes].to_numpy(dtype=float)
+        vkt, pkt = od_demand.pt_projects_apply_od(vkt, pkt, od_effects, pt_mask)
+        base_numbers.loc['vkt_2030_scenario', modes] = vkt[0]
+        base_numbers.loc['pkt_2030_scenario', modes] = pkt[0]
+    elif pt_included != []:
         base_numbers.loc['vkt_2030_scenario'] += pt_effects_vkt.loc[pt_included].sum()
         base_numbers.loc['pkt_2030_scenario'] += pt_effects_pkt.loc[pt_included].sum()
     
@@ -177,22 +203,17 @@ def bus_ridership_changes(numbers, base_numbers, bus_prop_increase):
         bus_change = base_numbers.loc['pkt_2030_baseline']['diesel_bus'] * bus_prop_increase
 
         # Apply change
-        base_numbers.loc['pkt_2030_scenario']['diesel_bus'] += bus_change
-
-        for mode in numbers['private_modes']:
-            effect = (
-                - base_numbers.loc['pkt_2030_baseline'][mode] 
-                / numbers['mode_sum_pkt'] # Proportion of pkt by this mode in 2030 baseline
-                * bus_change
-            )
-
-            base_numbers.loc['pkt_2030_scenario'][mode] += effect
+        base_numbers.loc['pkt_2030_scenario', 'diesel_bus'] += bus_change
 
-            if mode in ['passenger_light', 'electric_light']:
-                base_numbers.loc['vkt_2030_scenario'][mode] += effect/numbers['car_occupancy']
+        private_modes = numbers['private_modes']
+        effect = (
+            - base_numbers.loc['pkt_2030_baseline', private_modes]
+            / numbers['mode_sum_pkt'] # Proportion of pkt by each mode in 2030 baseline
+            * bus_change
+        )
 
-            elif mode in ['walking', 'cycling']:
-                base_numbers.loc['vkt_2030_scenario'][mode] += effect  
+        base_numbers.loc['pkt_2030_scenario', private_modes] += effect
+        base_numbers.loc['vkt_2030_scenario', private_modes] += effect / mode_registry.vkt_per_pkt(private_modes, numbers['car_occupancy'])
 
     return base_numbers
 
@@ -215,23 +236,22 @@ def cycling_changes(numbers, base_numbers, cycling_included):
         cycling_change = base_numbers.loc['pkt_2030_baseline']['cycling'] * cycling_included
 
         # Apply change
-        base_numbers.loc['pkt_2030_scenario']['cycling'] += cycling_change
-
-        for mode in numbers['private_modes']:
-            if mode != 'cycling':
-                effect = (
-                    - base_numbers.loc['pkt_2030_baseline'][mode] 
-                    / numbers['mode_pkt_no_bike'] # Proportion of pkt by this mode in 2030 baseline
-                    * cycling_change
-                )
-
-                base_numbers.loc['pkt_2030_scenario'][mode] += effect
+        base_numbers.loc['pkt_2030_scenario', 'cycling'] += cycling_change
+
+        private_modes = numbers['private_modes']
+        other_modes = [mode for mode in private_modes if mode != 'cycling']
+        effect = (
+            - base_numbers.loc['pkt_2030_baseline', other_modes]
+            / numbers['mode_pkt_no_bike'] # Proportion of pkt by each mode in 2030 baseline
+            * cycling_change
+        )
 
-            if mode in ['passenger_light', 'electric_light']:
-                base_numbers.loc['vkt_2030_scenario'][mode] += effect/numbers['car_occupancy']
+        base_numbers.loc['pkt_2030_scenario', other_modes] += effect
 
-            elif mode in ['walking', 'cycling']:
-                base_numbers.loc['vkt_2030_scenario'][mode] += effect
+        # Cycling vkt follows its own pkt change
+        vkt_effect = effect.reindex(private_modes)
+        vkt_effect['cycling'] = cycling_change
+        base_numbers.loc['vkt_2030_scenario', private_modes] += vkt_effect / mode_registry.vkt_per_pkt(private_modes, numbers['car_occupancy'])
     return base_numbers
 
 
@@ -252,13 +272,9 @@ def bus_electric(numbers, base_numbers, bus_electrification_included):
         # Calculate what % of the bus lifespan will be covered
         prop = (2030-bus_electrification_included)/numbers['bus_lifespan']
         # Replace that % of buses with electric buses for pkt and vkt
-        bus_vkt_shift = base_numbers.loc['vkt_2030_scenario']['diesel_bus']*prop
-        base_numbers.loc['vkt_2030_scenario','diesel_bus'] += - bus_vkt_shift
-        base_numbers.loc['vkt_2030_scenario','electric_bus'] += bus_vkt_shift
-
-        bus_pkt_shift = base_numbers.loc['pkt_2030_scenario']['diesel_bus']*prop
-        base_numbers.loc['pkt_2030_scenario','diesel_bus'] += - bus_pkt_shift 
-        base_numbers.loc['pkt_2030_scenario','electric_bus'] += bus_pkt_shift 
+        modes = list(base_numbers.columns)
+        for row in ['vkt_2030_scenario', 'pkt_2030_scenario']:
+            base_numbers.loc[row, modes] = mode_registry.electrify(base_numbers.loc[row, modes].to_numpy(dtype=float), modes, 'pt', prop)
     
     return base_numbers
 
@@ -276,13 +292,9 @@ def car_electric(base_numbers, car_electrification_included):
     '''
     if car_electrification_included > 0:
         # Replace that % of cars with electric cars for pkt and vkt
-        car_vkt_shift = base_numbers.loc['vkt_2030_scenario']['passenger_light']*car_electrification_included
-        base_numbers.loc['vkt_2030_scenario','passenger_light'] += - car_vkt_shift
-        base_numbers.loc['vkt_2030_scenario','electric_light'] += car_vkt_shift
-
-        car_pkt_shift = base_numbers.loc['pkt_2030_scenario']['passenger_light']*car_electrification_included
-        base_numbers.loc['pkt_2030_scenario','passenger_light'] += - car_pkt_shift 
-        base_numbers.loc['pkt_2030_scenario','electric_light'] += car_pkt_shift 
+        modes = list(base_numbers.columns)
+        for row in ['vkt_2030_scenario', 'pkt_2030_scenario']:
+            base_numbers.loc[row, modes] = mode_registry.electrify(base_numbers.loc[row, modes].to_numpy(dtype=float), modes, 'private', car_electrification_included)
 
     return base_numbers
 
@@ -299,8 +311,8 @@ def car_occupancy(base_numbers, occupancy_included):
     '''
     
     if occupancy_included > 0:
-        base_numbers.loc['vkt_2030_scenario']['passenger_light'] = base_numbers.loc['pkt_2030_scenario']['passenger_light']/occupancy_included
-        base_numbers.loc['vkt_2030_scenario']['electric_light'] = base_numbers.loc['pkt_2030_scenario']['electric_light']/occupancy_included
+        car_modes = mode_registry.car_modes()
+        base_numbers.loc['vkt_2030_scenario', car_modes] = base_numbers.loc['pkt_2030_scenario', car_modes]/occupancy_included
     
     return base_numbers
 
@@ -319,7 +331,8 @@ def calculate_emissions(base_numbers, emission_factors, car_emission_change):
     
     
     base_numbers.loc['emissions_2030_scenario'] = emission_factors.loc['values_2030_scenario'] * base_numbers.loc['vkt_2030_scenario']
-    base_numbers.loc['emissions_2030_scenario', 'passenger_light'] = base_numbers.loc['emissions_2030_scenario', 'passenger_light'] * (1-car_emission_change)
+    fuelled_cars = mode_registry.electrification('private')[0]
+    base_numbers.loc['emissions_2030_scenario', fuelled_cars] = base_numbers.loc['emissions_2030_scenario', fuelled_cars] * (1-car_emission_change)
     
     return base_numbers
 
@@ -337,19 +350,23 @@ def covid_trips(base_numbers, covid, numbers):
         updated base_numbers
     '''
     
-    for mode in numbers['all_modes']:
-        base_numbers.loc['pkt_2030_scenario', mode] = (1-(covid/100))*base_numbers.loc['pkt_2030_scenario', mode]
-        if mode in ['cycling', 'walking']:
-            base_numbers.loc['vkt_2030_scenario', mode] = base_numbers.loc['pkt_2030_scenario', mode]
-        elif mode in ['light_fleet', 'electric_light']:
-            base_numbers.loc['vkt_2030_scenario', mode] = base_numbers.loc['pkt_2030_scenario', mode]/numbers['car_occupancy']
+    all_modes = numbers['all_modes']
+    base_numbers.loc['pkt_2030_scenario', all_modes] = (1-(covid/100))*base_numbers.loc['pkt_2030_scenario', all_modes]
+
+    # Private and active vkt follow their pkt (PT vkt is set by the services run)
+    private_modes = numbers['private_modes']
+    base_numbers.loc['vkt_2030_scenario', private_modes] = (
+        base_numbers.loc['pkt_2030_scenario', private_modes] / mode_registry.vkt_per_pkt(private_modes, numbers['car_occupancy']))
     return base_numbers
 
 
 # Initialisation
 pt_details, master_base_numbers, emission_factors = data_load()
 numbers = data_initialisation(master_base_numbers)
-pt_effects_vkt, pt_effects_pkt = pt_proj_effects(numbers, master_base_numbers, pt_details)
+pt_profiles = service_profiles.load_profiles('pt_profiles.csv', list(pt_details.index)) # Optional hourly service profiles
+pt_effects_vkt, pt_effects_pkt = pt_proj_effects(numbers, master_base_numbers, pt_details, pt_profiles)
+od = od_demand.load_od('od', list(pt_details.index)) # Optional zone to zone demand
+od_effects = od_demand.prepare(numbers, master_base_numbers, od, pt_effects_vkt, pt_effects_pkt) if od is not None else None
 
 
 
@@ -406,7 +423,6 @@ colors = {
     'orange': '#e58a69',
     'orange_red': '#ae2513',
     'grey_red': '#7b514b',
-
     'far_background': '#364161',
     'covid_background': '#8d4951',
     'med_background': '#364161',
@@ -423,18 +439,18 @@ colors = {
     'header5_text': '#e2e0f1',
     'header6_text': '#e2e0f1',
 
-    'passenger_light': '#f75263',
-    'electric_light': '#d52b00',
-    'diesel_bus': '#f7f53e',
-    'electric_bus': '#eeac00',
-    'heavy_rail': '#469ae2',
-    'light_rail': '#004786',
-    'walking': '#65d799',
-    'cycling': '#1f9e65',
-
     'car_text': '#f75263',
 
 }
+colors.update(mode_registry.registry.colour) # One colour for each mode
+
+# Colour of the 2030 scenario car count for each of fleet_size.traffic_levels
+traffic_colours = {
+    'above_baseline': colors['electric_light'],
+    'high': colors['passenger_light'],
+    'moderate': colors['electric_bus'],
+    'low': colors['walking'],
+}
 
 font_size = {
     'text_size': 18,
@@ -455,1025 +471,562 @@ pad = 40
 
 
 
-colorway_colours = [colors['passenger_light'], colors['electric_light'], colors['diesel_bus'], colors['electric_bus'], colors['heavy_rail'], colors['light_rail'], colors['walking'], colors['cycling']]
+colorway_colours = [colors[mode] for mode in mode_registry.registry.index]
 text_size = 18
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+# Responses are compressed (gzip or brotli, as the browser accepts) by flask_compress
+app = dash.Dash(__name__, external_stylesheets=external_stylesheets, compress=True)
+server = app.server
+
+# Per-stage timings on /metrics, set TIMING_HEADER=1 to also send them with each callback response
+instrumentation.register(app.server, timing_header = os.environ.get('TIMING_HEADER') == '1')
+
+# Set TRAFFIC_LOG to a file path to record every update_graph call, for replaying with traffic.py
+traffic_recorder = traffic.Recorder(os.environ['TRAFFIC_LOG']) if os.environ.get('TRAFFIC_LOG') else None
+
+# Input data and model code the scenario results depend on
+version_files = (
+    ['pt_details.csv', 'base_numbers.csv', 'emission_factors.csv', mode_registry.registry_path]
+    + (['pt_profiles.csv'] if pt_profiles is not None else [])
+    + (sorted(str(path) for path in Path('od').iterdir()) if od is not None else [])
+    + [__file__, engine.__file__, fleet_size.__file__, mode_registry.__file__, od_demand.__file__, service_profiles.__file__])
+
+# Set RESULT_CACHE to a SQLite file to share update_graph results between workers and across restarts
+scenario_cache = result_cache.from_environment(version_files)
+
+# Long-running analyses run as background jobs in their own processes (JOBS_DIR, JOB_WORKERS)
+job_queue = jobs.from_environment()
+jobs.register(app.server, job_queue)
+
+
+
+
+# LAYOUT
+# The page is built from the specs below rather than written out component by component: each
+# control is a header and a dcc component, each information section a header and body_text keys.
+
+# Controls, in the order they appear. Values and slider ranges are engine.lever_defaults and
+# engine.lever_options; labels are given in the order of the options
+controls = [
+    {'id': 'pt_included', 'title': 'PT Projects', 'component': 'Checklist', 'options': [
+        ('City Rail Link', 'CRL'),
+        ('Aiport to Botany', 'A2B'),
+        ('Isthmus Crosstown', 'IsthmusCrosstown'),
+        ('Northwestern Light Rail', 'NorthwesternLightRail'),
+        ('City to Airport Light Rail', 'AirportLightRail'),
+        ('Eastern Busway (AMETI)', 'AMETI'),
+    ]},
+    {'id': 'bus_prop_increase', 'title': 'Bus Ridership Increase', 'component': 'RadioItems', 'labels': [
+        'No Bus Ridership Change from 2018',
+        'Bus Ridership Increases with Current Trends',
+        'Bus Ridership Increases with Double Current Trends',
+        'Bus Ridership Increases with Triple Current Trends',
+    ]},
+    {'id': 'cycling_included', 'title': 'Cycling Projects Included', 'component': 'RadioItems', 'labels': [
+        'No Cycling Mode Share Increase',
+        'Cycling Investment Plan',
+        'Double Cycling Investment Plan',
+        'Reach Cycling Levels of Copenhagen',
+    ]},
+    {'id': 'bus_electrification_included', 'title': 'Bus Electrification Start Year', 'component': 'Dropdown', 'labels': [
+        'No Bus Electrification', '2020', '2021', '2022', '2023', '2024', '2025 (Current Plan)',
+    ]},
+    {'id': 'car_emission_change', 'title': 'Improved Car Emission Standards', 'component': 'Dropdown', 'labels': [
+        'No Change From 2018',
+    ] + ['{}0% decrease in emissions per km'.format(i) for i in range(1, 7)]},
+    {'id': 'car_electrification_included', 'title': 'Car Electrification Proportion', 'component': 'Slider',
+     'marks': {i: '{:.0f} %'.format(i) for i in range(0, 101, 10)}},
+    {'id': 'occupancy_included', 'title': 'Average Car Occupancy', 'component': 'Slider', 'title_style': {'marginTop': 30},
+     'marks': {i: {'label': label, 'style': {'color': colors['contrast_option_text' if i == 158 else 'option_text']}} for i, label in [
+         (140, '1.4'), (150, '1.5'), (158, '1.58'), (170, '1.7'), (180, '1.8'), (190, '1.9'), (200, '2.0')]}},
+]
+
+covid_control = {'id': 'covid', 'title': 'Reduction in Trips Taken', 'component': 'Slider', 'title_color': 'header5_text',
+                 'title_style': {'marginTop': 30}, 'marks': {i: '{}%'.format(i) for i in range(0, 101, 10)}}
+
+lever_titles = {spec['id']: spec['title'] for spec in controls + [covid_control]}
+
+# Labels of the checklist, radio item and dropdown options, by control and value
+option_labels = {
+    spec['id']: {value: label for label, value in spec['options']} if 'options' in spec
+    else dict(zip(engine.lever_options[spec['id']], spec['labels']))
+    for spec in controls if spec['component'] != 'Slider'
+}
 
+# Outputs a target can be set for with goal seek: name, and format of a value
+goal_outputs = {
+    'total_emissions': ('2030 emissions', '{:,.3f} Mt CO2-e'),
+    'cars': ('cars on the road', '{:,.0f} cars'),
+}
 
+# Results shown as text: label, id and colour (of the 2018, 2030 baseline and 2030 scenario values)
+result_rows = [
+    ('2018:', '2018', 'electric_bus'),
+    ('2030 Baseline:', '2030_baseline', 'passenger_light'),
+    ('2030 Scenario:', '2030_scenario', 'passenger_light'),
+]
+
+# Information sections under the dashboard: the section text and any sub-headed texts, as body_text keys.
+# These are long, so only their headers are in the page; the text is sent when a section is opened (see show_info)
+info_sections = [
+    {'id': 'pt_projects', 'title': 'Public Transport Projects', 'text': ['pt_projects_info'], 'subsections': [
+        ('City Rail Link', 'crl'),
+        ('Airport to Botany', 'a2b'),
+        ('Isthmus Crosstown', 'isthmus'),
+        ('Northwestern Light Rail', 'northwest'),
+        ('City to Airport Light Rail', 'a2c'),
+        ('Eastern Busway (AMETI)', 'ameti'),
+    ]},
+    {'id': 'bus_ridership', 'title': 'Bus Ridership Levels', 'text': ['bus_ridership_info']},
+    {'id': 'cycling_projects', 'title': 'Cycling Projects', 'text': ['cycling_projects_info']},
+    {'id': 'bus_electrification', 'title': 'Bus Electrification', 'text': ['bus_electrification_info']},
+    {'id': 'car_emissions', 'title': 'Car Emission Standards', 'text': ['improved_car_emissions_info']},
+    {'id': 'car_electrification', 'title': 'Car Electrification', 'text': ['car_electrification_info']},
+    {'id': 'car_occupancy', 'title': 'Car Occupancy', 'text': ['car_occupancy_info']},
+]
+
+
+def heading(level, children, color, **style):
+    '''
+    Returns a left aligned html heading (H1 to H6) in the dashboard colours
+    '''
+    return getattr(html, 'H{}'.format(level))(
+        children = children,
+        style = dict({'textAlign': 'left', 'color': colors[color], 'fontSize': font_size['H{}'.format(level)]}, **style),
+    )
 
 
-app.layout = html.Div(
-    # DIV 0
-    style = {
-        'backgroundColor': colors['far_background'], 
-        'columnCount': 1,
-        
-    }, 
-    children = [
-    html.Div(
-        # DIV 1A
+def paragraph(children = None, color = 'info_text', size = 'text_size', id = None, **style):
+    '''
+    Returns a paragraph of text in the dashboard style (a paragraph with an id is filled in by a callback)
+    '''
+    properties = {'style': dict({
+        'textAlign': 'left',
+        'color': colors[color],
+        'fontSize': font_size[size],
+        'marginBottom': 15,
+        'marginLeft': 5,
+        'marginRight': 5,
+    }, **style)}
+    if children is not None:
+        properties['children'] = children
+    if id is not None:
+        properties['id'] = id
+    return html.P(**properties)
+
+
+def box(children, background, width, height, marginLeft = 0, marginTop = 0, **kwargs):
+    '''
+    Returns a rounded box with its content padded inside it
+    '''
+    return html.Div(
+        style = {
+            'backgroundColor': colors[background],
+            'columnCount': 1,
+            'marginTop': marginTop,
+            'marginBottom': 0,
+            'marginLeft': marginLeft,
+            'marginRight': 0,
+            'width': width,
+            'border-radius': 10,
+        },
+        children = [
+            html.Div(
+                style = {
+                    'backgroundColor': colors[background],
+                    'columnCount': 1,
+                    'marginTop': pad,
+                    'marginBottom': pad,
+                    'marginLeft': pad,
+                    'marginRight': pad,
+                    'height': height,
+                },
+                children = children,
+            ),
+        ],
+        **kwargs
+    )
+
+
+def control(spec):
+    '''
+    This function builds a control from its spec (see controls)
+
+    Inputs:
+        spec - dictionary of the control's id, title and dcc component, its option labels or slider marks,
+               and optionally the colour and extra style of its title
+
+    Outputs:
+        list of the title and the control
+    '''
+    lever = spec['id']
+    properties = {'id': lever}
+    if spec['component'] == 'Slider':
+        properties.update(
+            min = engine.lever_options[lever][0],
+            max = engine.lever_options[lever][1],
+            marks = spec['marks'],
+        )
+    else:
+        options = spec['options'] if 'options' in spec else list(zip(spec['labels'], engine.lever_options[lever]))
+        properties['options'] = [{'label': label, 'value': value} for label, value in options]
+    if spec['component'] in ['Checklist', 'RadioItems']:
+        properties.update(
+            labelStyle = {'fontSize': font_size['text_size']},
+            style = {'color': colors['option_text']},
+        )
+    # dcc.Checklist holds its ticked options in values
+    properties['values' if spec['component'] == 'Checklist' else 'value'] = engine.lever_defaults[lever]
+
+    return [
+        heading(5, spec['title'], spec.get('title_color', 'header3_text'), **spec.get('title_style', {})),
+        getattr(dcc, spec['component'])(**properties),
+    ]
+
+
+def results(name, size):
+    '''
+    Returns the label and value paragraphs of the 2018, 2030 baseline and 2030 scenario results (cars or emissions)
+    '''
+    children = []
+    for label, year, color in result_rows:
+        children.append(paragraph([label], color = 'text', size = size, marginBottom = 0))
+        children.append(paragraph(color = color, size = size, id = '{}_{}'.format(name, year)))
+    return children
+
+
+def info_section(section):
+    '''
+    Returns an information section with only its header and a button to show its text
+    '''
+    return html.Div(
+        style = {'breakInside': 'avoid'},
+        children = [
+            heading(4, section['title'], 'header4_text'),
+            html.Button( # Show and hide the text
+                'Read more',
+                id = '{}_more'.format(section['id']),
+                n_clicks = 0,
+                style = {'color': colors['option_text'], 'marginBottom': 15},
+            ),
+            html.Div(id = '{}_info'.format(section['id'])),
+        ],
+    )
+
+
+def info_text(section):
+    '''
+    Returns the text of an information section, as shown when it is opened
+    '''
+    children = [paragraph(body_text[key]) for key in section['text']]
+    for title, key in section.get('subsections', []):
+        children.append(heading(6, title, 'header6_text'))
+        children.append(paragraph(body_text[key]))
+    return children
+
+
+def page_layout():
+    '''
+    This function builds the dashboard page
+
+    Outputs:
+        the layout, as an html.Div
+    '''
+    header = html.Div(# Around heading
         style = {
-            'backgroundColor': colors['far_background'], 
+            'backgroundColor': colors['med_background'],
             'columnCount': 1,
-            'marginTop': 50,
-            'marginBottom': 50,
-            'marginLeft': 100,
-            'marginRight': 100,
-            #'border':'1px solid', 
-            'border-radius': 0,
-            'display': 'flex', 
-            'flexWrap': 'wrap',
-        }, 
+            'marginTop': 20,
+            'marginBottom': 20,
+            'marginLeft': 'auto',
+            'marginRight': 'auto',
+        },
         children = [
-            html.Div(# DIV 2A - around heading
+            html.Div(
                 style = {
-                    'backgroundColor': colors['med_background'], 
+                    'backgroundColor': colors['med_background'],
                     'columnCount': 1,
                     'marginTop': 20,
                     'marginBottom': 20,
-                    #'width': 1900,
-                    'marginLeft': 'auto',
-                    'marginRight': 'auto',
-                }, 
+                    'width': 1900,
+                    'marginLeft': 0,
+                    'marginRight': 0,
+                },
                 children = [
-                    html.Div(# DIV 2A - inner around heading
-                        style = {
-                            'backgroundColor': colors['med_background'], 
-                            'columnCount': 1,
-                            'marginTop': 20,
-                            'marginBottom': 20,
-                            'width': 1900,
-                            'marginLeft': 0,
-                            'marginRight': 0,
-                        }, 
-                        children = [
-                            html.H1(
-                                children='Transport Emissions in the Auckland Region',
-                                style={
-                                    'textAlign': 'center',
-                                    'color': colors['header_text'],
-                                    'fontSize': font_size['H1'],
-                                }
-                            ),
-                            html.P(
-                                style={
-                                    'textAlign': 'center',
-                                    'color': colors['header_text'],
-                                    'fontSize': font_size['large_text'],
-                                },
-                                children = body_text['header_intro']
-                            )
-
-                        ],
+                    html.H1(
+                        children = 'Transport Emissions in the Auckland Region',
+                        style = {'textAlign': 'center', 'color': colors['header_text'], 'fontSize': font_size['H1']},
                     ),
-
+                    html.P(
+                        style = {'textAlign': 'center', 'color': colors['header_text'], 'fontSize': font_size['large_text']},
+                        children = body_text['header_intro'],
+                    ),
+                ],
+            ),
+        ],
+    )
+
+    left_column = [
+        heading(4, 'Changes and Choices', 'header2_text'),
+        paragraph(body_text['changes_text']),
+    ]
+    for spec in controls:
+        left_column += control(spec)
+    left_column += [
+        heading(5, 'Reach a Target', 'header3_text', marginTop = 50),
+        html.P(
+            children = 'Find the setting of one slider that brings the 2030 scenario to a target, with the other choices as they are.',
+            style = {'textAlign': 'left', 'color': colors['text'], 'fontSize': font_size['text_size']},
+        ),
+        dcc.Dropdown( # goal_lever
+            id = 'goal_lever',
+            options = [{'label': lever_titles[lever], 'value': lever} for lever in goal_seek.continuous_levers],
+            value = 'car_electrification_included',
+            clearable = False,
+        ),
+        dcc.Dropdown( # goal_output
+            id = 'goal_output',
+            options = [{'label': name.capitalize(), 'value': output} for output, (name, _) in goal_outputs.items()],
+            value = 'total_emissions',
+            clearable = False,
+        ),
+        dcc.Input( # goal_target
+            id = 'goal_target',
+            type = 'number',
+            placeholder = 'Target (Mt CO2-e or cars)',
+            style = {'marginTop': 10},
+        ),
+        html.Button( # goal_solve
+            'Solve',
+            id = 'goal_solve',
+            n_clicks = 0,
+            style = {'color': colors['option_text'], 'marginLeft': 10},
+        ),
+        html.Button( # goal_snap
+            'Set Slider',
+            id = 'goal_snap',
+            n_clicks = 0,
+            style = {'color': colors['option_text'], 'marginLeft': 10},
+        ),
+        html.Div( # goal_result
+            id = 'goal_result',
+            style = {'textAlign': 'left', 'color': colors['text'], 'fontSize': font_size['text_size'], 'marginTop': 10},
+        ),
+        dcc.Store( # goal_solution
+            id = 'goal_solution',
+            data = None,
+        ),
+        heading(5, 'Compare Saved Scenarios', 'header3_text', marginTop = 50),
+        dcc.Input( # scenario_name
+            id = 'scenario_name',
+            type = 'text',
+            placeholder = 'Name for these choices',
+            value = '',
+        ),
+        html.Button( # save_scenario
+            'Save Scenario',
+            id = 'save_scenario',
+            n_clicks = 0,
+            style = {'color': colors['option_text'], 'marginLeft': 10},
+        ),
+        dcc.Checklist( # compare_included
+            id = 'compare_included',
+            options = [],
+            labelStyle = {'fontSize': font_size['text_size']},
+            style = {'color': colors['option_text'], 'marginTop': 10},
+            values = [],
+        ),
+        dcc.Store( # saved_scenarios
+            id = 'saved_scenarios',
+            storage_type = 'local',
+            data = {},
+        ),
+        heading(5, 'Explore All Choices', 'header3_text', marginTop = 50),
+        html.P(
+            children = 'Try a million random combinations of all the choices above, and find the range of 2030 emissions and the combination with the lowest.',
+            style = {'textAlign': 'left', 'color': colors['text'], 'fontSize': font_size['text_size']},
+        ),
+        html.Button( # run_sweep
+            'Run',
+            id = 'run_sweep',
+            n_clicks = 0,
+            style = {'color': colors['option_text']},
+        ),
+        html.Button( # cancel_sweep
+            'Cancel',
+            id = 'cancel_sweep',
+            n_clicks = 0,
+            style = {'color': colors['option_text'], 'marginLeft': 10},
+        ),
+        html.Div( # sweep_status
+            id = 'sweep_status',
+            style = {'textAlign': 'left', 'color': colors['text'], 'fontSize': font_size['text_size'], 'marginTop': 10},
+        ),
+        dcc.Store( # sweep_job
+            id = 'sweep_job',
+            data = None,
+        ),
+        dcc.Interval( # sweep_interval
+            id = 'sweep_interval',
+            interval = 1000, # Check on the job every second while it runs
+            disabled = True,
+        ),
+    ]
+
+    middle_column = [
+        heading(4, 'Auckland Transport Emissions', 'header4_text', marginTop = 0),
+        html.Div(
+            style = {
+                'backgroundColor': colors['near_background'],
+                'columnCount': 3,
+                'marginTop': pad,
+                'marginBottom': pad,
+            },
+            children = results('emissions', 'emissions'),
+        ),
+        dcc.Graph( # stacked_emissions
+            id = 'stacked_emissions',
+            config = {'displayModeBar': False},
+        ),
+        dcc.Graph( # shapley_waterfall
+            id = 'shapley_waterfall',
+            config = {'displayModeBar': False},
+        ),
+        html.P(
+            style = {'textAlign': 'left', 'color': colors['passenger_light'], 'fontSize': font_size['emissions'], 'marginBottom': 50},
+            children = ' ',
+        ),
+        dcc.Graph( # stacked_emissions1
+            id = 'stacked_emissions1',
+            config = {'displayModeBar': False},
+        ),
+    ]
+
+    right_column = [
+        box([heading(4, 'Cars on the Road', 'header2_text'), paragraph(body_text['cars_text2'])] + results('cars', 'cars'),
+            'near_background', 500, 595, marginLeft = 50),
+        box([heading(4, 'COVID-19', 'header2_text'), paragraph(body_text['covid_text']), paragraph(body_text['covid_text2'])]
+            + control(covid_control),
+            'covid_background', 500, 500, marginLeft = 50, marginTop = 25),
+    ]
+
+    information = html.Div(
+        style = {
+            'backgroundColor': colors['near_background'],
+            'columnCount': 1,
+            'marginTop': 25,
+            'marginBottom': 0,
+            'marginLeft': 0,
+            'marginRight': 0,
+            'width': 2000,
+            'border-radius': 10,
+        },
+        children = [
+            html.Div(# Instructions
+                style = {
+                    'backgroundColor': colors['near_background'],
+                    'columnCount': 1,
+                    'marginTop': pad,
+                    'marginBottom': pad,
+                    'marginLeft': pad,
+                    'marginRight': pad,
+                    'width': 1700,
+                },
+                children = [heading(2, 'Instructions and Information', 'header2_text')] + [
+                    paragraph(body_text[key], size = 'large_text')
+                    for key in ['instruction_text', 'instruction_text1', 'instruction_text2']
                 ],
             ),
-            html.Div(# DIV 2B - everything
+            html.Div(# Information sections
+                style = {
+                    'backgroundColor': colors['near_background'],
+                    'marginTop': 0,
+                    'marginBottom': pad,
+                    'marginLeft': pad,
+                    'marginRight': pad,
+                    'columnCount': 2,
+                },
+                children = [info_section(section) for section in info_sections],
+            ),
+        ],
+    )
+
+    return html.Div(
+        style = {'backgroundColor': colors['far_background'], 'columnCount': 1},
+        children = [
+            html.Div(
                 style = {
-                    'backgroundColor': colors['med_background'], 
+                    'backgroundColor': colors['far_background'],
                     'columnCount': 1,
-                    'marginTop': 20,
-                    'marginBottom': 20,
-                    'marginLeft': 'auto',
-                    'marginRight': 'auto',
-                    'width': 2000,
-                    #'vertical-align': 'centre',
-                    #'display': 'inline-block',
-                }, 
-                #className='container',
+                    'marginTop': 50,
+                    'marginBottom': 50,
+                    'marginLeft': 100,
+                    'marginRight': 100,
+                    'border-radius': 0,
+                    'display': 'flex',
+                    'flexWrap': 'wrap',
+                },
                 children = [
-                    html.Div(# DIV 3A - all content box
+                    header,
+                    html.Div(# Everything else
                         style = {
-                            'backgroundColor': colors['med_background'], 
+                            'backgroundColor': colors['med_background'],
                             'columnCount': 1,
-                            'marginTop': 0,
-                            'marginBottom': 0,
-                            'marginLeft': 0,
-                            'marginRight': 0,
-                            'border-radius': 0,
-                        }, 
+                            'marginTop': 20,
+                            'marginBottom': 20,
+                            'marginLeft': 'auto',
+                            'marginRight': 'auto',
+                            'width': 2000,
+                        },
                         children = [
-                        
-                        html.Div( # Border around left column box
-                            style = {
-                                    'backgroundColor': colors['near_background'], 
+                            html.Div(
+                                style = {
+                                    'backgroundColor': colors['med_background'],
                                     'columnCount': 1,
                                     'marginTop': 0,
                                     'marginBottom': 0,
                                     'marginLeft': 0,
                                     'marginRight': 0,
-                                    'width': 550,
-                                    'border-radius': 10,
-                                }, 
-                            children = [
-                                html.Div(# DIV 4A - left column content                                
-                                    style = {
-                                        'backgroundColor': colors['near_background'], 
-                                        'columnCount': 1,
-                                        'marginTop': pad,
-                                        'marginBottom': pad,
-                                        'marginLeft': pad,
-                                        'marginRight': pad,
-                                        'height': 1200,
-                                    }, 
-                                    children = [
-                                        html.H4( # Changes and Choices
-                                            children='Changes and Choices',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header2_text'],
-                                                'fontSize': font_size['H4'],
-                                            }
-                                        ),
-
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['changes_text']
-                                        ),
-
-                                        html.H5( # PT Projects
-                                            children = 'PT Projects',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header3_text'],
-                                                'fontSize': font_size['H5'],
-                                            }
-                                        ),
-                                        
-                                        dcc.Checklist( # pt_included
-                                            id = 'pt_included',
-                                            options=[
-                                                {'label': 'City Rail Link', 'value': 'CRL'},
-                                                {'label': 'Aiport to Botany', 'value': 'A2B'},
-                                                {'label': 'Isthmus Crosstown', 'value': 'IsthmusCrosstown'},
-                                                {'label': 'Northwestern Light Rail', 'value': 'NorthwesternLightRail'},
-                                                {'label': 'City to Airport Light Rail', 'value': 'AirportLightRail'},
-                                                {'label': 'Eastern Busway (AMETI)', 'value': 'AMETI'}
-                                            ],
-                                            labelStyle = {
-                                                'fontSize': font_size['text_size'],
-                                            },
-                                            style={
-                                                'color': colors['option_text'],
-                                            },
-                                            values = []
-                                        ),
-
-
-                                        html.H5( # Bus Ridership Increase
-                                            children = 'Bus Ridership Increase',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header3_text'],
-                                                'fontSize': font_size['H5'],
-                                            }),
-
-                                        dcc.RadioItems( # bus_prop_increase
-                                            id = 'bus_prop_increase',
-                                            options=[
-                                                {'label': 'No Bus Ridership Change from 2018', 'value': 0},
-                                                {'label': 'Bus Ridership Increases with Current Trends', 'value': 0.4},
-                                                {'label': 'Bus Ridership Increases with Double Current Trends', 'value': 0.8},
-                                                {'label': 'Bus Ridership Increases with Triple Current Trends', 'value': 1.2},
-                                            ],
-                                            value=0,
-                                            style={
-                                                'color': colors['option_text']
-                                            },
-                                            labelStyle = {
-                                                'fontSize': font_size['text_size'],
-                                            },
-                                        ),
-
-
-                                        html.H5( # Cycling Projects Included
-                                            children = 'Cycling Projects Included',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header3_text'],
-                                                'fontSize': font_size['H5'],
-                                            }),
-
-                                        dcc.RadioItems( # cycling_included
-                                            id = 'cycling_included',
-                                            options=[
-                                                {'label': 'No Cycling Mode Share Increase', 'value': 0},
-                                                {'label': 'Cycling Investment Plan', 'value': 5},
-                                                {'label': 'Double Cycling Investment Plan', 'value': 10},
-                                                {'label': 'Reach Cycling Levels of Copenhagen', 'value': 24},
-                                            ],
-                                            value=0,
-                                            style={
-                                                'color': colors['option_text']
-                                            },
-                                            labelStyle = {
-                                                'fontSize': font_size['text_size'],
-                                            },
-                                        ),
-
-
-                                        html.H5( # Bus Electrification Start Year
-                                            children = 'Bus Electrification Start Year',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header3_text'],
-                                                'fontSize': font_size['H5'],
-                                            }),
-
-                                        dcc.Dropdown( # bus_electrification_included
-                                            id = 'bus_electrification_included',
-                                            options=[
-                                                {'label': 'No Bus Electrification', 'value': 0},
-                                                {'label': '2020', 'value': 2020},
-                                                {'label': '2021', 'value': 2021},
-                                                {'label': '2022', 'value': 2022},
-                                                {'label': '2023', 'value': 2023},
-                                                {'label': '2024', 'value': 2024},
-                                                {'label': '2025 (Current Plan)', 'value': 2025}
-                                            ],
-                                            value=0,
-                                        ),
-
-
-                                        html.H5( # Improved Car Emission Standards
-                                            children = 'Improved Car Emission Standards',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header3_text'],
-                                                'fontSize': font_size['H5'],
-                                            }),
-
-                                        dcc.Dropdown( # car_emission_change
-                                            id = 'car_emission_change',
-                                            options=[
-                                                {'label': 'No Change From 2018', 'value': 0},
-                                                {'label': '10% decrease in emissions per km', 'value': 0.1},
-                                                {'label': '20% decrease in emissions per km', 'value': 0.2},
-                                                {'label': '30% decrease in emissions per km', 'value': 0.3},
-                                                {'label': '40% decrease in emissions per km', 'value': 0.4},
-                                                {'label': '50% decrease in emissions per km', 'value': 0.5},
-                                                {'label': '60% decrease in emissions per km', 'value': 0.6}
-                                            ],
-                                            value=0,
-                                        ),
-
-
-                                        html.H5( # Car Electrification Proportion
-                                            children = 'Car Electrification Proportion',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header3_text'],
-                                                'fontSize': font_size['H5'],
-                                            }),
-
-                                        dcc.Slider( # car_electrification_included
-                                            id = 'car_electrification_included',
-                                            min=0,
-                                            max=100,
-                                            marks={i: '{:.0f} %'.format(i) for i in range(0, 101, 10)},
-                                            value=0,
-                                        ),
-
-
-                                        html.H5( # Average Car Occupancy
-                                            children = 'Average Car Occupancy',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header3_text'],
-                                                'fontSize': font_size['H5'],
-                                                'marginTop': 30
-                                            }),
-
-                                        dcc.Slider(# occupancy_included
-                                            id = 'occupancy_included',
-                                            min=140,
-                                            max=200,
-                                            marks={
-                                                140: {'label': '1.4', 'style': {'color': colors['option_text']}},
-                                                150: {'label': '1.5', 'style': {'color': colors['option_text']}},
-                                                158: {'label': '1.58', 'style': {'color': colors['contrast_option_text']}},
-                                                170: {'label': '1.7', 'style': {'color': colors['option_text']}},
-                                                180: {'label': '1.8', 'style': {'color': colors['option_text']}},
-                                                190: {'label': '1.9', 'style': {'color': colors['option_text']}},
-                                                200: {'label': '2.0', 'style': {'color': colors['option_text']}}
-                                                },
-                                            value=158,
-                                        ),
-                                    ],
-                                ),
-
-                        ], className="six columns"),
-
-                        html.Div( # Border around middle column box
-                            style = {
-                                'backgroundColor': colors['near_background'], 
-                                'columnCount': 1,
-                                'marginTop': 0,
-                                'marginBottom': 0,
-                                'marginLeft': 50,
-                                'marginRight': 0,
-                                'width': 850,
-                                'border-radius': 10,
-                            }, 
-                            children = [
-                                html.Div(# DIV 4B - middle column content
-                                    style = {
-                                        'backgroundColor': colors['near_background'], 
-                                        'columnCount': 1,
-                                        'marginTop': pad,
-                                        'marginBottom': pad,
-                                        'marginLeft': pad,
-                                        'marginRight': pad,
-                                        'height': 1200,
-                                    }, 
-                                    children = [
-
-                                        html.H4( # Auckland Transport Emissions
-                                            children = 'Auckland Transport Emissions',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header4_text'],
-                                                'fontSize': font_size['H4'],
-                                                'marginTop': 0
-                                            }),
-
-                                        html.Div(
-                                            style = {
-                                                'backgroundColor': colors['near_background'],
-                                                'columnCount': 3,
-                                                'marginTop': pad,
-                                                'marginBottom': pad,
-                                            },
-                                            children = [
-                                                html.P(
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['text'],
-                                                        'fontSize': font_size['emissions'],
-                                                        'marginBottom': 0,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                    children = ['2018:']
-                                                ),
-                                                html.P(
-                                                    id = 'emissions_2018',
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['electric_bus'],
-                                                        'fontSize': font_size['emissions'],
-                                                        'marginBottom': 15,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                ),
-                                                
-                                                html.P(
-                                                    
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['text'],
-                                                        'fontSize': font_size['emissions'],
-                                                        'marginBottom': 0,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                    children = ['2030 Baseline:']
-                                                ),
-                                                html.P(
-                                                    id = 'emissions_2030_baseline',
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['passenger_light'],
-                                                        'fontSize': font_size['emissions'],
-                                                        'marginBottom': 15,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                ),
-
-                                                html.P(
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['text'],
-                                                        'fontSize': font_size['emissions'],
-                                                        'marginBottom': 0,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                    children = ['2030 Scenario:']
-                                                ),
-                                                html.P(
-                                                    id = 'emissions_2030_scenario',
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['passenger_light'],
-                                                        'fontSize': font_size['emissions'],
-                                                        'marginBottom': 15,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                ),
-                                            ],
-                                        ),
-                                        
-                                        
-                                        dcc.Graph( # stacked_emissions
-                                            id='stacked_emissions',
-                                            config ={'displayModeBar': False},
-                                        ),
-
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['passenger_light'],
-                                                'fontSize': font_size['emissions'],
-                                                'marginBottom': 50,
-                                            },
-                                            children = ' '
-                                        ),
-
-                                        dcc.Graph( # stacked_emissions
-                                            id='stacked_emissions1',
-                                            config ={'displayModeBar': False},
-                                        ),
-                                    ],
-                                ),
-                        ], className="six columns"),
-
-
-                        html.Div( # Border around right column boxes (both)
-                            style = {
-                                'backgroundColor': colors['far_background'], 
-                                'columnCount': 1,
-                                'marginTop': 0,
-                                'marginBottom': 0,
-                                'marginLeft': 0,
-                                'marginRight': 0,
-                                'width': 500,
-                                'border-radius': 0,
-                            }, 
-                            children = [
-                                html.Div( # Inner border around right column box (top)
-                                    style = {
-                                        'backgroundColor': colors['near_background'], 
-                                        'columnCount': 1,
-                                        'marginTop': 0,
-                                        'marginBottom': 0,
-                                        'marginLeft': 50,
-                                        'marginRight': 0,
-                                        'width': 500,
-                                        'border-radius': 10,
-                                    }, 
-                                    children = [
-                                        html.Div( # DIV 4C - top right column content
-                                            style = {
-                                                'backgroundColor': colors['near_background'], 
-                                                'columnCount': 1,
-                                                'marginTop': pad,
-                                                'marginBottom': pad,
-                                                'marginLeft': pad,
-                                                'marginRight': pad,
-                                                'height': 595,
-                                            }, 
-                                            children = [
-                                                html.H4( # Cars
-                                                    children='Cars on the Road',
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['header2_text'],
-                                                        'fontSize': font_size['H4'],
-                                                    },
-                                                ),
-
-                                                html.P(
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['info_text'],
-                                                        'fontSize': font_size['text_size'],
-                                                        'marginBottom': 15,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                    children = body_text['cars_text2'],
-                                                ),
-
-                                                html.P(
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['text'],
-                                                        'fontSize': font_size['cars'],
-                                                        'marginBottom': 0,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                    children = ['2018:']
-                                                ),
-                                                html.P(
-                                                    id = 'cars_2018',
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['electric_bus'],
-                                                        'fontSize': font_size['cars'],
-                                                        'marginBottom': 15,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                ),
-                                                
-                                                html.P(
-                                                    
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['text'],
-                                                        'fontSize': font_size['cars'],
-                                                        'marginBottom': 0,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                    children = ['2030 Baseline:']
-                                                ),
-                                                html.P(
-                                                    id = 'cars_2030_baseline',
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['passenger_light'],
-                                                        'fontSize': font_size['cars'],
-                                                        'marginBottom': 15,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                ),
-
-                                                html.P(
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['text'],
-                                                        'fontSize': font_size['cars'],
-                                                        'marginBottom': 0,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                    children = ['2030 Scenario:']
-                                                ),
-                                                html.P(
-                                                    id = 'cars_2030_scenario',
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['passenger_light'],
-                                                        'fontSize': font_size['cars'],
-                                                        'marginBottom': 15,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                ),
-                                            ],
-                                        ),
-                                    ],
-                                ),
-                                html.Div( # Inner border around right column box (bottom)
-                                    style = {
-                                        'backgroundColor': colors['covid_background'], 
-                                        'columnCount': 1,
-                                        'marginTop': 25,
-                                        'marginBottom': 0,
-                                        'marginLeft': 50,
-                                        'marginRight': 0,
-                                        'width': 500,
-                                        'border-radius': 10,
-                                    }, 
-                                    children = [
-                                        html.Div(# DIV 4C - bottom right column content
-                                            style = {
-                                                'backgroundColor': colors['covid_background'], 
-                                                'columnCount': 1,
-                                                'marginTop': pad,
-                                                'marginBottom': pad,
-                                                'marginLeft': pad,
-                                                'marginRight': pad,
-                                                'height': 500,
-                                            }, 
-                                            children = [
-                                                html.H4( # Covid
-                                                    children='COVID-19',
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['header2_text'],
-                                                        'fontSize': font_size['H4'],
-                                                    }
-                                                ),
-
-                                                html.P(
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['info_text'],
-                                                        'fontSize': font_size['text_size'],
-                                                        'marginBottom': 15,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                    children = body_text['covid_text']
-                                                ),
-                                                html.P(
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['info_text'],
-                                                        'fontSize': font_size['text_size'],
-                                                        'marginBottom': 15,
-                                                        'marginLeft': 5,
-                                                        'marginRight': 5,
-                                                    },
-                                                    children = body_text['covid_text2']
-                                                ),
-
-                                                html.H5( # Reduction in Trips Taken
-                                                    children = 'Reduction in Trips Taken',
-                                                    style={
-                                                        'textAlign': 'left',
-                                                        'color': colors['header5_text'],
-                                                        'fontSize': font_size['H5'],
-                                                        'marginTop': 30
-                                                    }),
-
-                                                dcc.Slider(# covid
-                                                    id = 'covid',
-                                                    min=0,
-                                                    max=100,
-                                                    marks={i: '{}%'.format(i) for i in range(0, 101, 10)},
-                                                    value=0,
-                                                ),
-                                            ],
-                                        ),
-                                    ],
-                                ),
-                        ], className="six columns"),
-                    ], className="row"),
-                    
-
-                    html.Div(
-                            style = {
-                                'backgroundColor': colors['near_background'], 
-                                'columnCount': 1,
-                                'marginTop': 25,
-                                'marginBottom': 0,
-                                'marginLeft': 0,
-                                'marginRight': 0,
-                                'width': 2000,
-                                'border-radius': 10,
-                            }, 
-                            children = [
-                                html.Div(# Bottom box content, header
-                                    style = {
-                                        'backgroundColor': colors['near_background'], 
-                                        'columnCount': 1,
-                                        'marginTop': pad,
-                                        'marginBottom': pad,
-                                        'marginLeft': pad,
-                                        'marginRight': pad,
-                                        'width': 1700,
-                                    }, 
-                                    children = [
-                                        html.H2( # Instructions
-                                            children = 'Instructions and Information',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header2_text'],
-                                                'fontSize': font_size['H2'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['large_text'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['instruction_text']
-                                        ),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['large_text'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['instruction_text1']
-                                        ),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['large_text'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['instruction_text2']
-                                        ),
-                                    ],
-                                ),
-
-                                html.Div(# Bottom box content, text
-                                    style = {
-                                        'backgroundColor': colors['near_background'], 
-                                        'marginTop': 0,
-                                        'marginBottom': pad,
-                                        'marginLeft': pad,
-                                        'marginRight': pad,
-                                        #'height': 500,
-                                        'columnCount': 2
-                                    }, 
-                                    children = [
-                                        html.H4( # PT Projects info
-                                            children = 'Public Transport Projects',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header4_text'],
-                                                'fontSize': font_size['H4'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['pt_projects_info']
-                                        ),
-
-
-                                        html.H6( # City Rail Link
-                                            children = 'City Rail Link',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header6_text'],
-                                                'fontSize': font_size['H6'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['crl']
-                                        ),
-
-                                        html.H6( # Airport to Botany
-                                            children = 'Airport to Botany',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header6_text'],
-                                                'fontSize': font_size['H6'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['a2b']
-                                        ),
-
-                                        html.H6( # Isthmus Crosstown
-                                            children = 'Isthmus Crosstown',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header6_text'],
-                                                'fontSize': font_size['H6'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['isthmus']
-                                        ),
-
-                                        html.H6( # Northwestern Light Rail
-                                            children = 'Northwestern Light Rail',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header6_text'],
-                                                'fontSize': font_size['H6'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['northwest']
-                                        ),
-
-                                        html.H6( # City to Airport Light Rail
-                                            children = 'City to Airport Light Rail',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header6_text'],
-                                                'fontSize': font_size['H6'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['a2c']
-                                        ),
-
-                                        html.H6( # Eastern Busway (AMETI)
-                                            children = 'Eastern Busway (AMETI)',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header6_text'],
-                                                'fontSize': font_size['H6'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 50,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['ameti']
-                                        ),
-
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['near_background'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 500,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = 'Super secret hidden text ' 
-                                        ),
-
-
-
-                                        html.H4( # Bus ridership info
-                                            children = 'Bus Ridership Levels',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header4_text'],
-                                                'fontSize': font_size['H4'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['bus_ridership_info']
-                                        ),
-
-                                        html.H4( # Cycling Investment
-                                            children = 'Cycling Projects',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header4_text'],
-                                                'fontSize': font_size['H4'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['cycling_projects_info']
-                                        ),
-
-                                        html.H4( # Bus Electrification
-                                            children = 'Bus Electrification',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header4_text'],
-                                                'fontSize': font_size['H4'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['bus_electrification_info']
-                                        ),
-
-                                        html.H4( # Car Emissions
-                                            children = 'Car Emission Standards',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header4_text'],
-                                                'fontSize': font_size['H4'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['improved_car_emissions_info']
-                                        ),
-
-                                        html.H4( # Car Electrification
-                                            children = 'Car Electrification',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header4_text'],
-                                                'fontSize': font_size['H4'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['car_electrification_info']
-                                        ),
-
-                                        html.H4( # Car Occupancy
-                                            children = 'Car Occupancy',
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['header4_text'],
-                                                'fontSize': font_size['H4'],
-                                            }),
-                                        html.P(
-                                            style={
-                                                'textAlign': 'left',
-                                                'color': colors['info_text'],
-                                                'fontSize': font_size['text_size'],
-                                                'marginBottom': 15,
-                                                'marginLeft': 5,
-                                                'marginRight': 5,
-                                            },
-                                            children = body_text['car_occupancy_info']
-                                        ),
-                                    ],
-                                ),
-                        ]),
+                                    'border-radius': 0,
+                                },
+                                children = [
+                                    box(left_column, 'near_background', 550, 2100, className = 'six columns'),
+                                    box(middle_column, 'near_background', 850, 1700, marginLeft = 50, className = 'six columns'),
+                                    html.Div( # Around the right column boxes
+                                        style = {
+                                            'backgroundColor': colors['far_background'],
+                                            'columnCount': 1,
+                                            'marginTop': 0,
+                                            'marginBottom': 0,
+                                            'marginLeft': 0,
+                                            'marginRight': 0,
+                                            'width': 500,
+                                            'border-radius': 0,
+                                        },
+                                        children = right_column,
+                                        className = 'six columns',
+                                    ),
+                                ],
+                                className = 'row',
+                            ),
+                            information,
+                        ],
+                    ),
                 ],
             ),
-            
         ],
-    ),
-])
+    )
+
 
+app.layout = page_layout()
 
 
 
 
 
-@app.callback([
+
+update_graph_outputs = [
     Output('stacked_emissions', 'figure'),
     Output('stacked_emissions1', 'figure'),
     Output('cars_2018', 'children'),
@@ -1484,7 +1037,11 @@ app.layout = html.Div(
     Output('emissions_2018', 'children'),
     Output('emissions_2030_baseline', 'children'),
     Output('emissions_2030_scenario', 'children'),
-    ],
+    Output('shapley_waterfall', 'figure'),
+]
+
+
+@app.callback(update_graph_outputs,
     [Input('cycling_included', 'value'),
      Input('bus_prop_increase', 'value'),
      Input('bus_electrification_included', 'value'),
@@ -1493,7 +1050,13 @@ app.layout = html.Div(
      Input('pt_included', 'values'),
      Input('car_emission_change', 'value'),
      Input('covid', 'value'),
-    ])
+     Input('compare_included', 'values'),
+    ],
+    [State('saved_scenarios', 'data')])
+@instrumentation.timed('update_graph')
+@traffic.recorded(traffic_recorder)
+@coalescing.coalesced
+@result_cache.cached(scenario_cache)
 def update_graph(
     cycling_included, 
     bus_prop_increase, 
@@ -1503,7 +1066,12 @@ def update_graph(
     pt_included, 
     car_emission_change, 
     covid,
+    compare_included = None,
+    saved_scenarios = None,
 ):
+    timer = instrumentation.LapTimer()
+    scenario = dict(zip(engine.lever_names, [cycling_included, bus_prop_increase, bus_electrification_included, occupancy_included,
+                                             car_electrification_included, pt_included, car_emission_change, covid]))
     occupancy_included = occupancy_included/100
     car_electrification_included = car_electrification_included/100
     
@@ -1511,17 +1079,26 @@ def update_graph(
     base_numbers = master_base_numbers.copy()
     
     # Applying Selected Changes
-    base_numbers = pt_projects_apply(base_numbers, pt_effects_vkt, pt_effects_pkt, pt_included)
+    base_numbers = pt_projects_apply(base_numbers, pt_effects_vkt, pt_effects_pkt, pt_included, od_effects)
+    timer.lap('pt_projects_apply')
     base_numbers = bus_ridership_changes(numbers, base_numbers, bus_prop_increase)
+    timer.lap('bus_ridership_changes')
     base_numbers = cycling_changes(numbers, base_numbers, cycling_included)
+    timer.lap('cycling_changes')
 
     base_numbers = bus_electric(numbers, base_numbers, bus_electrification_included)
+    timer.lap('bus_electric')
     base_numbers = car_electric(base_numbers, car_electrification_included)
+    timer.lap('car_electric')
 
     base_numbers = covid_trips(base_numbers, covid, numbers)
+    timer.lap('covid_trips')
 
     base_numbers = car_occupancy(base_numbers, occupancy_included)
+    timer.lap('car_occupancy')
     base_numbers = calculate_emissions(base_numbers, emission_factors, car_emission_change)
+    timer.lap('calculate_emissions')
+    coalescing.checkpoint()
 
 
     
@@ -1550,52 +1127,40 @@ def update_graph(
     elif emissions_2030_scenario_num > (emissions_2018_num):
         emissions_colour = colors['passenger_light']
     elif emissions_2030_scenario_num > (emissions_2018_num/2):
-        emissions_colour = colors['electric_bus'],
+        emissions_colour = colors['electric_bus']
     else:
-        emissions_colour = colors['walking'],
+        emissions_colour = colors['walking']
 
     emissions_style = {'textAlign': 'left', 'color': emissions_colour, 'fontSize': font_size['emissions'], 'marginBottom': 15, 'marginLeft': 5, 'marginRight': 5,}
+    timer.lap('emissions_totals')
 
-    cars_2030_baseline_num = numbers['2018_car_ownership']/(base_numbers.loc['vkt_2018', 'passenger_light']+base_numbers.loc['vkt_2018','electric_light'])*(base_numbers.loc['vkt_2030_baseline', 'passenger_light']+base_numbers.loc['vkt_2030_baseline','electric_light'])
-    cars_2030_scenario_num = numbers['2018_car_ownership']/(base_numbers.loc['vkt_2018', 'passenger_light']+base_numbers.loc['vkt_2018','electric_light'])*(base_numbers.loc['vkt_2030_scenario', 'passenger_light']+base_numbers.loc['vkt_2030_scenario','electric_light'])
-
+    modes = list(base_numbers.columns)
+    car_rate, cars_2018_num, cars_2030_baseline_num = fleet_size.base_counts(numbers, base_numbers)
+    cars_2030_scenario_num = fleet_size.cars_on_road(base_numbers.loc['vkt_2030_scenario', modes].to_numpy(dtype=float), modes, car_rate)
 
-    if cars_2030_scenario_num > cars_2030_baseline_num:
-        car_colour = colors['electric_light']
-    elif cars_2030_scenario_num > 1432825:
-        car_colour = colors['passenger_light']
-    elif cars_2030_scenario_num > 1089207:
-        car_colour = colors['electric_bus'],
-    else:
-        car_colour = colors['walking'],
+    car_colour = traffic_colours[fleet_size.traffic_levels[int(fleet_size.traffic_level(cars_2030_scenario_num, cars_2030_baseline_num))]]
     cars_style = {'textAlign': 'left', 'color': car_colour, 'fontSize': font_size['cars'], 'marginBottom': 15, 'marginLeft': 5, 'marginRight': 5,}
     
     base_numbers_emissions = base_numbers_emissions.transpose()
     
-    cars_2018 = '{:,.0f} cars'.format(numbers['2018_car_ownership'])
+    cars_2018 = '{:,.0f} cars'.format(cars_2018_num)
     cars_2030_baseline = '{:,.0f} cars '.format(cars_2030_baseline_num)
     cars_2030_scenario = '{:,.0f} cars '.format(cars_2030_scenario_num)
+    timer.lap('car_counts')
+    coalescing.checkpoint()
+
+    # One trace for each mode, with no emissions hover or legend for modes which never have emissions
+    emissions_traces = []
+    pkt_traces = []
+    for mode, label in mode_registry.registry.label.items():
+        if (emission_factors[mode] == 0).all():
+            emissions_traces.append(go.Bar(x=emissions_row_labels, y=base_numbers_emissions.loc[mode], name=label, hoverinfo = 'none', showlegend = False))
+        else:
+            emissions_traces.append(go.Bar(x=emissions_row_labels, y=base_numbers_emissions.loc[mode], name=label, hovertemplate = '%{y:,.2f} kg CO2-e')) #<extra></extra>
+        pkt_traces.append(go.Bar(x=emissions_row_labels, y=base_numbers_pkt.loc[mode], name=label, hovertemplate = '%{y:,.2f} km'))
+
 
-    trace1 = go.Bar(x=emissions_row_labels, y=base_numbers_emissions.loc['passenger_light'], name='Petrol and Diesel Cars', hovertemplate = '%{y:,.2f} kg CO2-e') #<extra></extra>
-    trace2 = go.Bar(x=emissions_row_labels, y=base_numbers_emissions.loc['electric_light'], name='Electric Cars', hovertemplate = '%{y:,.2f} kg CO2-e')
-    trace3 = go.Bar(x=emissions_row_labels, y=base_numbers_emissions.loc['diesel_bus'], name='Diesel Buses', hovertemplate = '%{y:,.2f} kg CO2-e')
-    trace4 = go.Bar(x=emissions_row_labels, y=base_numbers_emissions.loc['electric_bus'], name='Electric Buses', hovertemplate = '%{y:,.2f} kg CO2-e')
-    trace5 = go.Bar(x=emissions_row_labels, y=base_numbers_emissions.loc['heavy_rail'], name='Heavy Rail', hoverinfo = 'none', showlegend = False)
-    trace6 = go.Bar(x=emissions_row_labels, y=base_numbers_emissions.loc['light_rail'], name='Light Rail', hoverinfo = 'none', showlegend = False)
-    trace7 = go.Bar(x=emissions_row_labels, y=base_numbers_emissions.loc['walking'], name='Walking', hoverinfo = 'none', showlegend = False)
-    trace8 = go.Bar(x=emissions_row_labels, y=base_numbers_emissions.loc['cycling'], name='Cycling', hoverinfo = 'none', showlegend = False)
-
-    trace9 = go.Bar(x=emissions_row_labels, y=base_numbers_pkt.loc['passenger_light'], name='Petrol and Diesel Cars', hovertemplate = '%{y:,.2f} km') 
-    trace10 = go.Bar(x=emissions_row_labels, y=base_numbers_pkt.loc['electric_light'], name='Electric Cars', hovertemplate = '%{y:,.2f} km')
-    trace11 = go.Bar(x=emissions_row_labels, y=base_numbers_pkt.loc['diesel_bus'], name='Diesel Buses', hovertemplate = '%{y:,.2f} km')
-    trace12 = go.Bar(x=emissions_row_labels, y=base_numbers_pkt.loc['electric_bus'], name='Electric Buses', hovertemplate = '%{y:,.2f} km')
-    trace13 = go.Bar(x=emissions_row_labels, y=base_numbers_pkt.loc['heavy_rail'], name='Heavy Rail', hovertemplate = '%{y:,.2f} km')
-    trace14 = go.Bar(x=emissions_row_labels, y=base_numbers_pkt.loc['light_rail'], name='Light Rail', hovertemplate = '%{y:,.2f} km')
-    trace15 = go.Bar(x=emissions_row_labels, y=base_numbers_pkt.loc['walking'], name='Walking', hovertemplate = '%{y:,.2f} km')
-    trace16 = go.Bar(x=emissions_row_labels, y=base_numbers_pkt.loc['cycling'], name='Cycling', hovertemplate = '%{y:,.2f} km')
-
-
-    emissions_by_mode = {'data': [trace1, trace2, trace3, trace4, trace5, trace6, trace7, trace8],
+    emissions_by_mode = {'data': emissions_traces,
         'layout':
             go.Layout(
                 title='Auckland Transport Emissions by Mode', 
@@ -1638,7 +1203,7 @@ def update_graph(
 
 
     pkt_by_mode = {
-        'data': [trace9, trace10, trace11, trace12, trace13, trace14, trace15, trace16],
+        'data': pkt_traces,
         'layout':
             go.Layout(
                 title='Passenger km Travelled by Mode', 
@@ -1679,10 +1244,300 @@ def update_graph(
             )
 
     }
-    return emissions_by_mode, pkt_by_mode, cars_2018, cars_2030_baseline, cars_style, cars_2030_scenario, emissions_style, emissions_2018, emissions_2030_baseline, emissions_2030_scenario
 
+    # Saved scenarios to compare against, all evaluated in one batch
+    compare_names = [name for name in (compare_included or []) if name in (saved_scenarios or {})]
+    if compare_names != []:
+        comparison = engine.evaluate_batch(
+            numbers, master_base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt,
+            engine.make_batch([saved_scenarios[name] for name in compare_names], list(pt_details.index)),
+            od_effects = od_effects,
+        )
+        comparison_labels = emissions_row_labels[:3] + compare_names
+        for emissions_trace, pkt_trace, mode in zip(emissions_by_mode['data'], pkt_by_mode['data'], mode_registry.registry.index):
+            m = comparison['modes'].index(mode)
+            emissions_trace.x = comparison_labels
+            emissions_trace.y = list(emissions_trace.y) + list(comparison['emissions'][:, m])
+            pkt_trace.x = comparison_labels
+            pkt_trace.y = list(pkt_trace.y) + list(comparison['pkt'][:, m])
+
+    timer.lap('figures')
+
+    # The waterfall comes from the same request, so it is coalesced and cached with the rest
+    waterfall = shapley_waterfall(scenario)
+    timer.lap('shapley_waterfall')
+    return emissions_by_mode, pkt_by_mode, cars_2018, cars_2030_baseline, cars_style, cars_2030_scenario, emissions_style, emissions_2018, emissions_2030_baseline, emissions_2030_scenario, waterfall
+
+
+
+
+
+@app.callback(
+    Output('saved_scenarios', 'data'),
+    [Input('save_scenario', 'n_clicks')],
+    [State('scenario_name', 'value')]
+    + [State(lever, 'values' if lever == 'pt_included' else 'value') for lever in engine.lever_names]
+    + [State('saved_scenarios', 'data')])
+def save_scenario(n_clicks, scenario_name, *lever_values_and_saved):
+    '''
+    This function saves the current choices under the given name, for comparing in the graphs
+    '''
+    *lever_values, saved_scenarios = lever_values_and_saved
+    if not n_clicks or not scenario_name or not scenario_name.strip():
+        raise dash.exceptions.PreventUpdate
+
+    saved_scenarios = dict(saved_scenarios or {})
+    saved_scenarios[scenario_name.strip()] = dict(zip(engine.lever_names, lever_values))
+    return saved_scenarios
+
+
+@app.callback(
+    Output('compare_included', 'options'),
+    [Input('saved_scenarios', 'data')])
+def compare_options(saved_scenarios):
+    '''
+    This function lists the saved scenarios as options to compare
+    '''
+    return [{'label': name, 'value': name} for name in (saved_scenarios or {})]
+
+
+@app.callback(
+    Output('sweep_job', 'data'),
+    [Input('run_sweep', 'n_clicks'),
+     Input('cancel_sweep', 'n_clicks')],
+    [State('sweep_job', 'data')])
+def sweep_job(run_clicks, cancel_clicks, job_id):
+    '''
+    This function starts or cancels a background job trying random combinations of all the choices
+    '''
+    triggered = [item['prop_id'] for item in dash.callback_context.triggered]
+    if 'run_sweep.n_clicks' in triggered and run_clicks:
+        # One job per tab: a new run replaces the one still going
+        if job_id and job_queue.status(job_id) is not None:
+            job_queue.cancel(job_id)
+        return job_queue.submit('sweep', {'n': 10**6}, owner = coalescing.current_session())
+    if 'cancel_sweep.n_clicks' in triggered and cancel_clicks and job_id:
+        job_queue.cancel(job_id)
+        return job_id
+    raise dash.exceptions.PreventUpdate
+
+
+@app.callback(
+    [Output('sweep_status', 'children'),
+     Output('sweep_interval', 'disabled')],
+    [Input('sweep_job', 'data'),
+     Input('sweep_interval', 'n_intervals')])
+def sweep_status(job_id, n_intervals):
+    '''
+    This function shows the progress of the background job, and its results once finished
+    '''
+    status = job_queue.status(job_id) if job_id else None
+    if status is None:
+        return '', True
+    if status['state'] in ['queued', 'running']:
+        return 'Running: {:.0%} {}'.format(status['progress'], status['message']), False
+    if status['state'] != 'done':
+        return 'Job {}'.format(status['state']), True
+
+    result = job_queue.result(job_id)
+    emissions = result['emissions']
+    best = result['best']['levers']
+    return [
+        html.P('2030 emissions range from {:,.3f} to {:,.3f} Mt CO2-e (median {:,.3f}).'.format(
+            emissions['min'], emissions['max'], emissions['median'])),
+        html.P('Lowest: {:,.0f}% cycling, {:,.0f}% more bus riders, electric buses from {}, {:,.0f}% electric cars, {:,.2f} people per car, {:,.0f}% less car emissions per km, {:,.0f}% fewer trips, PT projects: {}.'.format(
+            best['cycling_included'], best['bus_prop_increase']*100,
+            '{:.0f}'.format(best['bus_electrification_included']) if best['bus_electrification_included'] else 'never',
+            best['car_electrification_included'],
+            best['occupancy_included']/100, best['car_emission_change']*100, best['covid'],
+            ', '.join(best['pt_included']) or 'none')),
+    ], True
+
+
+
+@app.callback(
+    [Output('{}_info'.format(section['id']), 'children') for section in info_sections]
+    + [Output('{}_more'.format(section['id']), 'children') for section in info_sections],
+    [Input('{}_more'.format(section['id']), 'n_clicks') for section in info_sections])
+def show_info(*n_clicks):
+    '''
+    This function shows the text of an information section when its button is clicked, and hides it on the next click
+    '''
+    triggered = [item['prop_id'] for item in dash.callback_context.triggered]
+    texts = [dash.no_update] * len(info_sections)
+    labels = [dash.no_update] * len(info_sections)
+    for i, section in enumerate(info_sections):
+        if '{}_more.n_clicks'.format(section['id']) in triggered and n_clicks[i]:
+            opened = n_clicks[i] % 2 == 1
+            texts[i] = info_text(section) if opened else []
+            labels[i] = 'Hide' if opened else 'Read more'
+    if all(text is dash.no_update for text in texts):
+        raise dash.exceptions.PreventUpdate
+    return texts + labels
+
+
+
+def lever_text(lever, value):
+    '''
+    Returns a slider value as the dashboard shows it
+    '''
+    if lever == 'occupancy_included':
+        return '{:.2f} people per car'.format(value/100)
+    return '{:g}%'.format(value)
+
+
+@app.callback(
+    [Output('goal_result', 'children'),
+     Output('goal_solution', 'data')],
+    [Input('goal_solve', 'n_clicks')],
+    [State('goal_lever', 'value'),
+     State('goal_output', 'value'),
+     State('goal_target', 'value')]
+    + [State(lever, 'values' if lever == 'pt_included' else 'value') for lever in engine.lever_names])
+def goal_seek_solve(n_clicks, lever, output, target, *lever_values):
+    '''
+    This function finds the value of the chosen slider that brings the 2030 scenario to the target, with the other choices as they are
+    '''
+    if not n_clicks:
+        raise dash.exceptions.PreventUpdate
+    if target is None or target == '':
+        return 'Enter a target to reach.', None
+
+    result = goal_seek.seek(numbers, master_base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt,
+                            dict(zip(engine.lever_names, lever_values)), lever, float(target), output, od_effects = od_effects)
+    name, value_format = goal_outputs[output]
+    if result['reachable']:
+        text = '{}: {} brings {} to {} (the target is reached at {}).'.format(
+            lever_titles[lever], lever_text(lever, result['snapped']), name, value_format.format(result['achieved']),
+            lever_text(lever, result['value']))
+    else:
+        text = '{} cannot be reached with this slider: {} range from {} to {}. The closest is {} at {}.'.format(
+            value_format.format(float(target)), name, value_format.format(result['range'][0]), value_format.format(result['range'][1]),
+            value_format.format(result['achieved']), lever_text(lever, result['snapped']))
+    return text, result
+
+
+@app.callback(
+    [Output(lever, 'value') for lever in goal_seek.continuous_levers],
+    [Input('goal_snap', 'n_clicks')],
+    [State('goal_solution', 'data')])
+def goal_seek_snap(n_clicks, solution):
+    '''
+    This function moves the slider to the value found by goal seek
+    '''
+    if not n_clicks or not solution:
+        raise dash.exceptions.PreventUpdate
+    snapped = int(solution['snapped']) if float(solution['snapped']).is_integer() else solution['snapped']
+    return [snapped if lever == solution['lever'] else dash.no_update for lever in goal_seek.continuous_levers]
+
+
+def component_text(lever, value):
+    '''
+    Returns the name of a lever or PT project in the waterfall, and its setting
+    '''
+    if lever == 'pt_included':
+        return option_labels[lever][value], 'Included'
+    if lever in option_labels:
+        return lever_titles[lever], option_labels[lever][value]
+    return lever_titles[lever], lever_text(lever, value)
+
+
+def shapley_waterfall(scenario):
+    '''
+    This function shows how much of the change from the 2030 baseline comes from each lever and PT project (their Shapley values)
+
+    Inputs:
+        scenario - dictionary of the lever settings, as the controls give them
+    '''
+    try:
+        attribution = shapley.attribute(numbers, master_base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt,
+                                        scenario, od_effects = od_effects)
+    except ValueError as error:
+        return {'data': [], 'layout': go.Layout(title = str(error))}
+
+    texts = [component_text(lever, value) for lever, value in attribution['components']]
+    names = [name for name, _ in texts]
+    settings = [setting for _, setting in texts]
+    waterfall = go.Waterfall(
+        x = ['2030 Baseline'] + names + ['2030 Scenario'],
+        y = [attribution['baseline']] + list(attribution['contributions']) + [attribution['scenario']],
+        measure = ['absolute'] + ['relative'] * len(names) + ['total'],
+        hovertext = [''] + settings + [''],
+        hovertemplate = '%{x}<br>%{hovertext}<br>%{y:,.3f} Mt CO2-e<extra></extra>',
+        increasing = {'marker': {'color': colors['electric_light']}},
+        decreasing = {'marker': {'color': colors['walking']}},
+        totals = {'marker': {'color': colors['passenger_light']}},
+        connector = {'line': {'color': colors['option_text']}},
+    )
+    return {
+        'data': [waterfall],
+        'layout': go.Layout(
+            title = 'Change in Emissions by Lever',
+            font = {
+                'color': colors['option_text'],
+                'size': font_size['graph_text_size'],
+            },
+            showlegend = False,
+            margin = {
+                'l': 80,
+                'b': 160,
+                't': 80,
+            },
+            autosize = True,
+            separators = ".,",
+            paper_bgcolor = colors['near_background'],
+            plot_bgcolor = colors['near_background'],
+            xaxis = {
+                'visible': True,
+                'tickangle': -30,
+            },
+            yaxis = {
+                'visible': True,
+                'title': 'Emissions per year (Mt CO2-equivalent)',
+            },
+        ),
+    }
+
+
+# The default scenario is the same for every visitor, so its results are computed once here and put
+# straight into the layout. The page shows them as soon as it loads, and assets/prerendered.js answers
+# the renderer's first update_graph request itself, so a page load costs no callback work on the server
+default_outputs = inspect.unwrap(update_graph)(*[engine.lever_defaults[lever] for lever in engine.lever_names])
+for output, value in zip(update_graph_outputs, default_outputs):
+    setattr(app.layout[output.component_id], output.component_property, value)
+
+# The layout is the same for every visitor, so it is serialised once rather than on every page load,
+# and sent with an ETag so a returning browser gets a 304 Not Modified instead of the whole layout again
+layout_json = json.dumps(app.layout, cls = plotly.utils.PlotlyJSONEncoder)
+layout_etag = hashlib.sha1(layout_json.encode()).hexdigest()
+
+
+@app.server.after_request
+def add_etag(response):
+    '''
+    Adds an ETag to the page, scripts and other GET responses, so browsers can check their copy is current
+    and get a 304 Not Modified rather than the whole response again (callback responses are POSTs, which are not cached)
+    '''
+    if (flask.request.method == 'GET' and response.status_code == 200
+            and not response.direct_passthrough and response.get_etag()[0] is None):
+        response.add_etag()
+        if 'Cache-Control' not in response.headers:
+            response.headers['Cache-Control'] = 'no-cache'
+        response = response.make_conditional(flask.request)
+    return response
+
+
+def serve_layout():
+    '''
+    Serves the serialised layout in place of dash's /_dash-layout (which serialises it on every request)
+    '''
+    response = flask.Response(layout_json, mimetype = 'application/json')
+    response.set_etag(layout_etag)
+    response.headers['Cache-Control'] = 'no-cache' # Check the ETag with the server before using a stored copy
+    return response.make_conditional(flask.request)
 
 
+app.server.view_functions[app.config.routes_pathname_prefix + '_dash-layout'] = serve_layout
 
 
 
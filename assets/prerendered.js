@@ -0,0 +1,33 @@
+// The results for the default choices are computed once when the server starts and are already in
+// the layout (see app.py), as are the starting values of the other callbacks' outputs. The requests
+// the Dash renderer makes for them as the page loads are answered here with 204 No Content (no
+// update), so they never reach the server. Only the first request for each callback is answered
+// here: it is the one made on loading the page, with the values in the layout.
+(function () {
+    'use strict';
+
+    // Callbacks whose outputs for the starting inputs are already in the layout, by one of their outputs
+    var prerendered = [
+        'stacked_emissions.figure',     // update_graph (and the Shapley waterfall)
+        'saved_scenarios.data',         // save_scenario (nothing saved until the button is clicked)
+        'sweep_job.data',               // sweep_job (no job until Run is clicked)
+        'sweep_status.children',        // sweep_status
+        'pt_projects_info.children',    // show_info (sections start closed)
+        'goal_result.children',         // goal_seek_solve (nothing solved until Solve is clicked)
+        'car_electrification_included.value',  // goal_seek_snap
+    ];
+    var requested = {};
+
+    var originalFetch = window.fetch;
+    window.fetch = function (url, options) {
+        if (typeof url === 'string' && url.indexOf('_dash-update-component') !== -1) {
+            var output = JSON.parse(options.body).output;
+            var first = !requested.hasOwnProperty(output);
+            requested[output] = true;
+            if (first && prerendered.some(function (prop) { return output.indexOf(prop) !== -1; })) {
+                return Promise.resolve(new Response(null, {status: 204}));
+            }
+        }
+        return originalFetch.apply(this, arguments);
+    };
+})();
@@ -0,0 +1,21 @@
+// Gives each page load (each open tab) its own session id, sent with every callback and job request
+// as the X-Session-Id header, so that coalescing.py only drops requests overtaken by a newer one from
+// the same tab, and a tab's new job only cancels that tab's previous one (jobs.py). A cookie would be shared by every tab of the browser, and tabs would drop each other's
+// requests.
+(function () {
+    'use strict';
+
+    var bytes = new Uint8Array(16);
+    window.crypto.getRandomValues(bytes);
+    var session = Array.prototype.map.call(bytes, function (b) { return ('0' + b.toString(16)).slice(-2); }).join('');
+
+    var originalFetch = window.fetch;
+    window.fetch = function (url, options) {
+        if (typeof url === 'string' && (url.indexOf('_dash-update-component') !== -1 || url.indexOf('/jobs/') !== -1)) {
+            options = Object.assign({}, options);
+            options.headers = Object.assign({}, options.headers, {'X-Session-Id': session});
+            return originalFetch.call(this, url, options);
+        }
+        return originalFetch.apply(this, arguments);
+    };
+})();
@@ -0,0 +1,366 @@
+'''
+Benchmarks for the emissions model and the dashboard callback.
+
+Each benchmark times one part of the app (loading the data, each of the scenario functions,
+the full update_graph callback and serialising its figures, and a goal seek), first with the real inputs and
+then, with --scale, with synthetic scale-ups: 1k and 10k PT projects (with and without hourly
+service profiles), 100 regions, a 1M scenario sweep through the vectorised engine (and 100k with
+logit mode choice, and 100k with 2,000 zone OD demand), 1M scenarios of the full factorial sweep
+streamed in float32 chunks, and yearly emissions to 2050 for every grid pathway.
+
+Results are saved to benchmark_results/ and compared against benchmark_results/baseline.json.
+The run fails (exit status 1) if any metric is slower than the baseline by more than the threshold.
+
+Before timing anything, the fast paths are checked against the reference scenario functions with
+fuzz.py (--fuzz-cases random cases), and the run fails if any of them gives different numbers:
+being faster only counts if the results are the same.
+
+Usage:
+    python benchmarks.py                                   # realistic inputs only
+    python benchmarks.py --scale                           # also run the synthetic scale-ups
+    python benchmarks.py --save-baseline                   # store this run as the new baseline
+    python benchmarks.py --threshold 0.1 --metric-threshold update_graph=0.3
+    python benchmarks.py --fuzz-cases 0                    # skip the check against the reference
+'''
+import argparse
+import datetime
+import inspect
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import plotly
+
+import app
+import engine
+import fuzz
+import goal_seek
+import grid_intensity
+import mode_choice
+import od_demand
+import service_profiles
+import shapley
+import sweeps
+
+
+results_dir = Path('benchmark_results')
+baseline_path = results_dir / 'baseline.json'
+
+# Inputs used for the single scenario benchmarks: every lever moved away from its default
+example_inputs = (5, 0.4, 2022, 170, 30, ['CRL', 'A2B', 'AirportLightRail'], 0.1, 20)
+
+
+def time_call(function, setup=None, repeat=20):
+    '''
+    This function times a function call, returning the median time in seconds
+
+    Inputs:
+        function - the function to time
+        setup - optional function returning a tuple of arguments for each call (not timed)
+        repeat - how many times to call the function
+    '''
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def synthetic_pt_details(pt_details, n, seed=0):
+    '''
+    This function makes a larger PT project catalogue by resampling the real projects
+
+    Inputs:
+        pt_details - dataframe of the real PT projects
+        n - number of projects to make
+        seed - seed for the random number generator
+
+    Outputs:
+        dataframe with n projects, with frequencies and distances jittered by up to 20%
+    '''
+    rng = np.random.default_rng(seed)
+    projects = pt_details.iloc[rng.integers(0, len(pt_details), size=n)].copy()
+    for column in ['peak_freq', 'off_peak_freq', 'distance']:
+        projects[column] = projects[column] * rng.uniform(0.8, 1.2, size=n)
+    projects.index = ['{}_{}'.format(name, i) for i, name in enumerate(projects.index)]
+    projects.index.name = pt_details.index.name
+    return projects
+
+
+def synthetic_regions(base_numbers, n, seed=0):
+    '''
+    This function splits the Auckland numbers into n synthetic regions of random size
+
+    Inputs:
+        base_numbers - dataframe with pkt, vkt and emissions data
+        n - number of regions
+        seed - seed for the random number generator
+
+    Outputs:
+        list of n base_numbers dataframes
+    '''
+    rng = np.random.default_rng(seed)
+    shares = rng.dirichlet(np.ones(n))
+    return [base_numbers * share for share in shares]
+
+
+def synthetic_od(directory, base_numbers, projects, n_zones, n_pairs, pairs_per_project, seed=0):
+    '''
+    This function writes synthetic OD demand: random pairs with random mode mixes, and random pairs for each project
+
+    Inputs:
+        directory - directory to write to (see od_demand.save_od)
+        base_numbers - dataframe with pkt, vkt and emissions data
+        projects - list of PT projects
+        n_zones - number of zones
+        n_pairs - number of pairs with travel
+        pairs_per_project - number of pairs each project serves
+        seed - seed for the random number generator
+    '''
+    rng = np.random.default_rng(seed)
+    modes = list(base_numbers.columns)
+    zones = pd.DataFrame({'name': ['Zone {}'.format(i) for i in range(n_zones)]}, index = ['Z{}'.format(i) for i in range(n_zones)])
+    keys = np.sort(rng.choice(n_zones * n_zones, n_pairs, replace=False))
+    pairs = np.stack([keys // n_zones, keys % n_zones], axis=1)
+    baseline = base_numbers.loc['pkt_2030_baseline', modes].to_numpy(dtype=float)
+    pkt = baseline * rng.uniform(0, 2, size=(n_pairs, len(modes)))
+
+    served = rng.integers(0, n_pairs, size=(len(projects), pairs_per_project))
+    project_pairs = pd.DataFrame({
+        'proj_name': np.repeat(projects, pairs_per_project),
+        'origin': zones.index[pairs[served.ravel(), 0]],
+        'destination': zones.index[pairs[served.ravel(), 1]],
+    }).drop_duplicates()
+    od_demand.save_od(directory, zones, pairs, pkt, modes, project_pairs)
+
+
+def run_scenario(base_numbers, pt_effects_vkt, pt_effects_pkt, inputs):
+    '''
+    This function runs the scenario functions in the same order as update_graph
+    '''
+    (cycling_included, bus_prop_increase, bus_electrification_included, occupancy_included,
+        car_electrification_included, pt_included, car_emission_change, covid) = inputs
+
+    base_numbers = app.pt_projects_apply(base_numbers, pt_effects_vkt, pt_effects_pkt, pt_included)
+    base_numbers = app.bus_ridership_changes(app.numbers, base_numbers, bus_prop_increase)
+    base_numbers = app.cycling_changes(app.numbers, base_numbers, cycling_included)
+    base_numbers = app.bus_electric(app.numbers, base_numbers, bus_electrification_included)
+    base_numbers = app.car_electric(base_numbers, car_electrification_included/100)
+    base_numbers = app.covid_trips(base_numbers, covid, app.numbers)
+    base_numbers = app.car_occupancy(base_numbers, occupancy_included/100)
+    base_numbers = app.calculate_emissions(base_numbers, app.emission_factors, car_emission_change)
+    return base_numbers
+
+
+def realistic_benchmarks():
+    '''
+    Benchmarks using the real data, returns a dictionary of metric name: seconds
+    '''
+    numbers = app.numbers
+    master = app.master_base_numbers
+    (cycling_included, bus_prop_increase, bus_electrification_included, occupancy_included,
+        car_electrification_included, pt_included, car_emission_change, covid) = example_inputs
+
+    def fresh():
+        return (master.copy(),)
+
+    # The callback body alone, without the Dash, instrumentation, traffic, coalescing and result cache wrappers
+    update_graph = inspect.unwrap(app.update_graph)
+    figures = update_graph(*example_inputs)[:2]
+
+    results = {
+        'data_load': time_call(app.data_load, repeat=5),
+        'pt_proj_effects': time_call(lambda: app.pt_proj_effects(numbers, master, app.pt_details), repeat=5),
+        'pt_projects_apply': time_call(
+            lambda b: app.pt_projects_apply(b, app.pt_effects_vkt, app.pt_effects_pkt, pt_included), fresh),
+        'bus_ridership_changes': time_call(lambda b: app.bus_ridership_changes(numbers, b, bus_prop_increase), fresh),
+        'cycling_changes': time_call(lambda b: app.cycling_changes(numbers, b, cycling_included), fresh),
+        'bus_electric': time_call(lambda b: app.bus_electric(numbers, b, bus_electrification_included), fresh),
+        'car_electric': time_call(lambda b: app.car_electric(b, car_electrification_included/100), fresh),
+        'covid_trips': time_call(lambda b: app.covid_trips(b, covid, numbers), fresh),
+        'car_occupancy': time_call(lambda b: app.car_occupancy(b, occupancy_included/100), fresh),
+        'calculate_emissions': time_call(
+            lambda b: app.calculate_emissions(b, app.emission_factors, car_emission_change), fresh),
+        'update_graph': time_call(lambda: update_graph(*example_inputs)),
+        'figure_serialisation': time_call(lambda: json.dumps(figures, cls=plotly.utils.PlotlyJSONEncoder)),
+        # Car electrification bringing emissions to half of 2018, with the other levers as in example_inputs
+        'goal_seek': time_call(lambda: goal_seek.seek(
+            numbers, master, app.emission_factors, app.pt_effects_vkt, app.pt_effects_pkt,
+            dict(zip(engine.lever_names, example_inputs)), 'car_electrification_included',
+            master.loc['emissions_2018'].sum()/(10**9)/2)),
+        # Shapley attribution over every subset of the levers and projects of example_inputs (2^10 scenarios)
+        'shapley': time_call(lambda: shapley.attribute(
+            numbers, master, app.emission_factors, app.pt_effects_vkt, app.pt_effects_pkt,
+            dict(zip(engine.lever_names, example_inputs)))),
+    }
+    # The callback as Dash calls it, through every wrapper and serialising the response (with RESULT_CACHE set,
+    # every call after the first is a cache hit)
+    if update_graph is not app.update_graph:
+        results['update_graph_response'] = time_call(lambda: app.update_graph(*example_inputs))
+    return results
+
+
+def scale_benchmarks():
+    '''
+    Benchmarks using synthetic scale-ups of the real data, returns a dictionary of metric name: seconds
+    '''
+    numbers = app.numbers
+    master = app.master_base_numbers
+    results = {}
+
+    for n in [1000, 10000]:
+        pt_details = synthetic_pt_details(app.pt_details, n)
+        effects_vkt, effects_pkt = app.pt_proj_effects(numbers, master, pt_details)
+        results['pt_proj_effects_{}k'.format(n // 1000)] = time_call(
+            lambda: app.pt_proj_effects(numbers, master, pt_details), repeat=1)
+        results['pt_projects_apply_{}k'.format(n // 1000)] = time_call(
+            lambda b: app.pt_projects_apply(b, effects_vkt, effects_pkt, list(pt_details.index)),
+            lambda: (master.copy(),), repeat=5)
+        profiles = service_profiles.from_frequencies(pt_details)
+        results['pt_proj_effects_profiles_{}k'.format(n // 1000)] = time_call(
+            lambda: app.pt_proj_effects(numbers, master, pt_details, profiles), repeat=3)
+
+    regions = synthetic_regions(master, 100)
+    results['regions_100'] = time_call(
+        lambda: [run_scenario(region.copy(), app.pt_effects_vkt, app.pt_effects_pkt, example_inputs) for region in regions],
+        repeat=3)
+
+    projects = list(app.pt_details.index)
+    batch = engine.random_batch(10**6, projects)
+    results['sweep_1m'] = time_call(
+        lambda: engine.evaluate_batch(numbers, master, app.emission_factors, app.pt_effects_vkt, app.pt_effects_pkt, batch),
+        repeat=3)
+    mode_costs = mode_choice.load_costs()
+    logit_batch = engine.random_batch(10**5, projects)
+    results['sweep_logit_100k'] = time_call(
+        lambda: engine.evaluate_batch(numbers, master, app.emission_factors, app.pt_effects_vkt, app.pt_effects_pkt, logit_batch, mode_costs),
+        repeat=3)
+
+    # The first million scenarios of the full factorial sweep, streamed in chunks keeping the extremes for each lever value
+    levels = sweeps.lever_levels(projects)
+    def stream():
+        extremes = sweeps.LeverExtremes(levels)
+        for _ in sweeps.iterate(numbers, master, app.emission_factors, app.pt_effects_vkt, app.pt_effects_pkt, levels,
+                                stop=10**6, dtype=np.float32, reduce=extremes):
+            pass
+    results['sweep_stream_1m'] = time_call(stream, repeat=3)
+
+    # Zone to zone demand: 2,000 zones with a million pairs with travel, each project serving 5,000 of them
+    with tempfile.TemporaryDirectory() as directory:
+        synthetic_od(directory, master, projects, 2000, 10**6, 5000)
+        od = od_demand.load_od(directory, projects)
+        results['od_prepare_2k_zones'] = time_call(
+            lambda: od_demand.prepare(numbers, master, od, app.pt_effects_vkt, app.pt_effects_pkt), repeat=3)
+        od_effects = od_demand.prepare(numbers, master, od, app.pt_effects_vkt, app.pt_effects_pkt)
+        od_batch = engine.random_batch(10**5, projects)
+        results['sweep_od_100k'] = time_call(
+            lambda: engine.evaluate_batch(numbers, master, app.emission_factors, app.pt_effects_vkt, app.pt_effects_pkt, od_batch, od_effects=od_effects),
+            repeat=3)
+        del od, od_effects
+
+    # Emissions for every year to 2050, under one grid pathway and under all of them (the 2030 vkt for every year)
+    grid_pathways, vehicle_efficiency = grid_intensity.load_curves()
+    modes = list(master.columns)
+    years = np.arange(2018, 2051)
+    batch = engine.random_batch(10**5, projects)
+    vkt = engine.evaluate_batch(numbers, master, app.emission_factors, app.pt_effects_vkt, app.pt_effects_pkt, batch)['vkt']
+    for name, pathways in [('grid_pathways_1', grid_pathways.iloc[:1]), ('grid_pathways_all', grid_pathways)]:
+        results[name] = time_call(
+            lambda: grid_intensity.total_emissions_by_year(
+                vkt, grid_intensity.factors_by_year(app.emission_factors, modes, pathways, vehicle_efficiency, years),
+                modes, batch['car_emission_change']),
+            repeat=3)
+    return results
+
+
+def find_regressions(results, baseline, threshold, metric_thresholds):
+    '''
+    This function compares a run against the baseline
+
+    Inputs:
+        results - dictionary of metric name: seconds for this run
+        baseline - dictionary of metric name: seconds for the baseline
+        threshold - allowed fractional slowdown (0.2 means 20% slower)
+        metric_thresholds - dictionary of metric name: allowed slowdown, overriding threshold
+
+    Outputs:
+        list of (metric name, baseline seconds, seconds, slowdown) for metrics over their threshold
+    '''
+    regressions = []
+    for name, seconds in results.items():
+        if name in baseline and baseline[name] > 0:
+            change = seconds / baseline[name] - 1
+            if change > metric_thresholds.get(name, threshold):
+                regressions.append((name, baseline[name], seconds, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the emissions model and dashboard callback')
+    parser.add_argument('--scale', action='store_true', help='also run the synthetic scale-up benchmarks')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed fractional slowdown against the baseline')
+    parser.add_argument('--metric-threshold', action='append', default=[], metavar='NAME=VALUE',
+                        help='allowed slowdown for one metric, can be given more than once')
+    parser.add_argument('--baseline', type=Path, default=baseline_path, help='baseline results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='save this run as the baseline')
+    parser.add_argument('--fuzz-cases', type=int, default=50, help='random cases to check against the reference first (0 to skip)')
+    args = parser.parse_args(argv)
+
+    if args.fuzz_cases:
+        report = fuzz.run(args.fuzz_cases)
+        fuzz.print_report(report)
+        if fuzz.failed(report):
+            print('The fast paths differ from the reference, so nothing was timed')
+            return 1
+        print()
+
+    metric_thresholds = {}
+    for item in args.metric_threshold:
+        name, value = item.split('=')
+        metric_thresholds[name] = float(value)
+
+    results = realistic_benchmarks()
+    if args.scale:
+        results.update(scale_benchmarks())
+
+    run = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    results_dir.mkdir(exist_ok=True)
+    with open(results_dir / '{}.json'.format(run['timestamp'].replace(':', '')), 'w') as f:
+        json.dump(run, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(run, f, indent=2)
+
+    baseline = {}
+    if args.baseline.exists() and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    print('{:<28}{:>14}{:>14}{:>10}'.format('metric', 'baseline (ms)', 'this run (ms)', 'change'))
+    for name, seconds in results.items():
+        if name in baseline:
+            print('{:<28}{:>14.3f}{:>14.3f}{:>+10.1%}'.format(name, baseline[name]*1000, seconds*1000, seconds/baseline[name] - 1))
+        else:
+            print('{:<28}{:>14}{:>14.3f}{:>10}'.format(name, '-', seconds*1000, '-'))
+
+    regressions = find_regressions(results, baseline, args.threshold, metric_thresholds)
+    for name, before, after, change in regressions:
+        print('REGRESSION: {} went from {:.3f} ms to {:.3f} ms ({:+.1%})'.format(name, before*1000, after*1000, change))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
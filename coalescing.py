@@ -0,0 +1,117 @@
+'''
+Coalescing of superseded callback requests.
+
+Dragging a slider sends a burst of update_graph calls, and the browser only keeps the response to
+the last one. Here each open tab is a session: assets/session.js gives every page load an id, sent
+with its callback requests as the X-Session-Id header (the load testing tools send one too), and
+every callback request from it is numbered in the order it arrives. A session only computes one
+request at a time. A request that arrives meanwhile waits, and a newer one wakes it to be dropped
+without computing anything, so at most one request per session is waiting at a time. The request
+being computed stops at its next checkpoint once it is overtaken. Dropped requests return 204 No
+Content, which the browser ignores. Requests without a session id are computed as they come.
+
+The sessions are kept in memory, so coalescing only works within one server process: requests from
+a tab that land on different processes are not coalesced with each other. Run the app with threads
+(e.g. gunicorn --threads) rather than many single-threaded processes to get the most out of it.
+'''
+import threading
+import time
+
+from dash.exceptions import PreventUpdate
+from flask import has_request_context, request
+
+import instrumentation
+
+
+header_name = 'X-Session-Id'
+
+# Sessions that have not sent a request for this long are forgotten
+session_timeout = 600
+
+_lock = threading.Lock()
+_sessions = {}
+_current = threading.local()
+_registrations = 0
+
+
+class Superseded(PreventUpdate):
+    '''
+    Raised when a newer request from the same session has arrived
+    '''
+
+
+def current_session():
+    '''
+    Returns the session id of the request being handled (None outside a request or without an id)
+    '''
+    if not has_request_context():
+        return None
+    return request.headers.get(header_name)
+
+
+def _register(session):
+    global _registrations
+    now = time.time()
+    with _lock:
+        state = _sessions.get(session)
+        if state is None:
+            state = _sessions[session] = {'condition': threading.Condition(), 'running': False, 'latest': 0, 'last_seen': now}
+        state['last_seen'] = now
+
+        _registrations += 1
+        if _registrations % 1000 == 0:
+            for key in [key for key, s in _sessions.items() if now - s['last_seen'] > session_timeout and not s['running']]:
+                del _sessions[key]
+
+    # Wake any request of the session still waiting, so it is dropped now rather than when its turn comes
+    with state['condition']:
+        state['latest'] += 1
+        state['condition'].notify_all()
+        return state, state['latest']
+
+
+def checkpoint():
+    '''
+    Stops the current request if a newer one has arrived from the same session
+    '''
+    current = getattr(_current, 'request', None)
+    if current is not None:
+        state, number = current
+        if state['latest'] != number:
+            raise Superseded()
+
+
+def coalesced(function):
+    '''
+    Decorator for the callback: one request at a time per session, skipping any that are superseded
+    '''
+    def wrapper(*args):
+        session = current_session()
+        if session is None:
+            return function(*args)
+
+        start = time.perf_counter()
+        state, number = _register(session)
+        with state['condition']:
+            while state['running'] and state['latest'] == number:
+                state['condition'].wait()
+            if state['latest'] != number:
+                instrumentation.observe('superseded', time.perf_counter() - start)
+                raise Superseded()
+            state['running'] = True
+        try:
+            _current.request = (state, number)
+            return function(*args)
+        except Superseded:
+            instrumentation.observe('superseded', time.perf_counter() - start)
+            raise
+        finally:
+            _current.request = None
+            with state['condition']:
+                state['running'] = False
+                state['condition'].notify_all()
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    wrapper.__wrapped__ = function
+    return wrapper
+
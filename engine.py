@@ -0,0 +1,367 @@
+'''
+Vectorised version of the 2030 scenario calculations in app.py.
+
+Each function here mirrors one of the pandas functions in app.py, but works on whole batches
+of lever settings at once. The vkt and pkt for the 2030 scenario are held as arrays with one
+row per scenario and one column per mode (in the same order as the base_numbers columns), so
+evaluating a million scenarios costs a handful of numpy operations rather than a million
+callback runs.
+
+Lever values are in the same units as the dashboard controls (so occupancy_included is 158
+for 1.58 people per car), which means a batch can be built straight from update_graph inputs.
+'''
+import numpy as np
+
+import fleet_size
+import grid_intensity
+import mode_choice
+import mode_registry
+import od_demand
+
+
+# The inputs to update_graph, in the order the callback receives them
+lever_names = [
+    'cycling_included',
+    'bus_prop_increase',
+    'bus_electrification_included',
+    'occupancy_included',
+    'car_electrification_included',
+    'pt_included',
+    'car_emission_change',
+    'covid',
+]
+
+# Initial values of the dashboard controls
+lever_defaults = {
+    'cycling_included': 0,
+    'bus_prop_increase': 0,
+    'bus_electrification_included': 0,
+    'occupancy_included': 158,
+    'car_electrification_included': 0,
+    'pt_included': [],
+    'car_emission_change': 0,
+    'covid': 0,
+}
+
+# The values each control can take: a list for the radio items and dropdowns, (min, max) for the sliders
+lever_options = {
+    'cycling_included': [0, 5, 10, 24],
+    'bus_prop_increase': [0, 0.4, 0.8, 1.2],
+    'bus_electrification_included': [0, 2020, 2021, 2022, 2023, 2024, 2025],
+    'occupancy_included': (140, 200),
+    'car_electrification_included': (0, 100),
+    'car_emission_change': [0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6],
+    'covid': (0, 100),
+}
+
+
+def make_batch(scenarios, projects):
+    '''
+    This function turns a list of scenarios into a batch of arrays for evaluate_batch
+
+    Inputs:
+        scenarios - list of scenarios, each either a dictionary of lever values or a tuple in update_graph argument order.
+                    Levers missing from a dictionary take their default value
+        projects - list of PT project names, in the order of the pt_effects dataframes
+
+    Outputs:
+        batch - dictionary with one array per lever (one value per scenario); 'pt_included' is a
+                scenarios x projects boolean array
+    '''
+    columns = {lever: [] for lever in lever_names}
+    for scenario in scenarios:
+        if not isinstance(scenario, dict):
+            scenario = dict(zip(lever_names, scenario))
+        for lever in lever_names:
+            columns[lever].append(scenario.get(lever, lever_defaults[lever]))
+
+    project_index = {project: i for i, project in enumerate(projects)}
+    pt_mask = np.zeros((len(columns['pt_included']), len(projects)), dtype=bool)
+    for row, included in enumerate(columns['pt_included']):
+        for project in included or []:
+            pt_mask[row, project_index[project]] = True
+
+    batch = {lever: np.asarray(columns[lever], dtype=float) for lever in lever_names if lever != 'pt_included'}
+    batch['pt_included'] = pt_mask
+    return batch
+
+
+def random_batch(n, projects, seed=0):
+    '''
+    This function draws a batch of random lever settings from the values the dashboard allows
+
+    Inputs:
+        n - number of scenarios
+        projects - list of PT project names
+        seed - seed for the random number generator
+
+    Outputs:
+        batch - dictionary of lever arrays (see make_batch)
+    '''
+    rng = np.random.default_rng(seed)
+    batch = {}
+    for lever, options in lever_options.items():
+        if isinstance(options, tuple):
+            batch[lever] = rng.integers(options[0], options[1] + 1, size=n).astype(float)
+        else:
+            batch[lever] = rng.choice(np.asarray(options, dtype=float), size=n)
+    batch['pt_included'] = rng.random((n, len(projects))) < 0.5
+    return batch
+
+
+def batch_size(batch):
+    '''
+    Returns the number of scenarios in a batch
+    '''
+    return len(batch['pt_included'])
+
+
+def pt_projects_apply_batch(vkt, pkt, pt_effects_vkt, pt_effects_pkt, pt_mask):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on the inclusion of different PT projects
+
+    Inputs:
+        vkt, pkt - scenarios x modes arrays of the 2030 scenario vkt and pkt
+        pt_effects_vkt, pt_effects_pkt - projects x modes arrays with the effect of each project on each mode
+        pt_mask - scenarios x projects boolean array of included projects
+
+    Outputs:
+        updated vkt, pkt
+    '''
+    vkt += pt_mask @ pt_effects_vkt
+    pkt += pt_mask @ pt_effects_pkt
+    return vkt, pkt
+
+
+def bus_ridership_changes_batch(numbers, base_numbers, vkt, pkt, bus_prop_increase):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on an increase in bus ridership
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        vkt, pkt - scenarios x modes arrays of the 2030 scenario vkt and pkt
+        bus_prop_increase - array of the % increase in pkt by bus from the 2030 baseline
+
+    Outputs:
+        updated vkt, pkt
+    '''
+    modes = list(base_numbers.columns)
+    baseline_pkt = base_numbers.loc['pkt_2030_baseline']
+
+    bus_change = baseline_pkt['diesel_bus'] * np.where(bus_prop_increase > 0, bus_prop_increase, 0)
+    pkt[:, modes.index('diesel_bus')] += bus_change
+
+    private_modes = numbers['private_modes']
+    columns = mode_registry.indices(modes, private_modes)
+    effect = (- baseline_pkt[private_modes].to_numpy(dtype=float) / numbers['mode_sum_pkt'])[np.newaxis, :] * bus_change[:, np.newaxis]
+    pkt[:, columns] += effect
+    vkt[:, columns] += effect / mode_registry.vkt_per_pkt(private_modes, numbers['car_occupancy'])
+
+    return vkt, pkt
+
+
+def cycling_changes_batch(numbers, base_numbers, vkt, pkt, cycling_included):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on an increase in cycling mode share
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        vkt, pkt - scenarios x modes arrays of the 2030 scenario vkt and pkt
+        cycling_included - array of the final % mode share by bike
+
+    Outputs:
+        updated vkt, pkt
+    '''
+    modes = list(base_numbers.columns)
+    baseline_pkt = base_numbers.loc['pkt_2030_baseline']
+
+    cycling_change = baseline_pkt['cycling'] * np.where(cycling_included > 0, cycling_included - 1, 0)
+    pkt[:, modes.index('cycling')] += cycling_change
+
+    private_modes = numbers['private_modes']
+    other_modes = [mode for mode in private_modes if mode != 'cycling']
+    effect = (- baseline_pkt[other_modes].to_numpy(dtype=float) / numbers['mode_pkt_no_bike'])[np.newaxis, :] * cycling_change[:, np.newaxis]
+    pkt[:, mode_registry.indices(modes, other_modes)] += effect
+
+    # As in cycling_changes, cycling vkt follows its own pkt change
+    vkt_effect = np.insert(effect, private_modes.index('cycling'), cycling_change, axis=1)
+    vkt[:, mode_registry.indices(modes, private_modes)] += vkt_effect / mode_registry.vkt_per_pkt(private_modes, numbers['car_occupancy'])
+
+    return vkt, pkt
+
+
+def bus_electric_batch(numbers, modes, vkt, pkt, bus_electrification_included):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on partial electrification of the bus fleet
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        modes - list of modes, in the column order of vkt and pkt
+        vkt, pkt - scenarios x modes arrays of the 2030 scenario vkt and pkt
+        bus_electrification_included - array of the year bus electrification will begin (0 for no electrification)
+
+    Outputs:
+        updated vkt, pkt
+    '''
+    prop = np.where(bus_electrification_included > 2019, (2030 - bus_electrification_included) / numbers['bus_lifespan'], 0)
+    for values in (vkt, pkt):
+        mode_registry.electrify(values, modes, 'pt', prop)
+    return vkt, pkt
+
+
+def car_electric_batch(modes, vkt, pkt, car_electrification_included):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on partial electrification of the light fleet
+
+    Inputs:
+        modes - list of modes, in the column order of vkt and pkt
+        vkt, pkt - scenarios x modes arrays of the 2030 scenario vkt and pkt
+        car_electrification_included - array of the proportion of the fleet to electrify
+
+    Outputs:
+        updated vkt, pkt
+    '''
+    prop = np.where(car_electrification_included > 0, car_electrification_included, 0)
+    for values in (vkt, pkt):
+        mode_registry.electrify(values, modes, 'private', prop)
+    return vkt, pkt
+
+
+def covid_trips_batch(numbers, modes, vkt, pkt, covid):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on trips not taken
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        modes - list of modes, in the column order of vkt and pkt
+        vkt, pkt - scenarios x modes arrays of the 2030 scenario vkt and pkt
+        covid - array of the % reduction in trips taken
+
+    Outputs:
+        updated vkt, pkt
+    '''
+    columns = mode_registry.indices(modes, numbers['all_modes'])
+    pkt[:, columns] *= (1 - (covid / 100))[:, None]
+
+    # Private and active vkt follow their pkt (PT vkt is set by the services run)
+    private_modes = numbers['private_modes']
+    columns = mode_registry.indices(modes, private_modes)
+    vkt[:, columns] = pkt[:, columns] / mode_registry.vkt_per_pkt(private_modes, numbers['car_occupancy'])
+    return vkt, pkt
+
+
+def car_occupancy_batch(modes, vkt, pkt, occupancy_included):
+    '''
+    This function updates the 2030 scenario vkt based on changed car occupancy
+
+    Inputs:
+        modes - list of modes, in the column order of vkt and pkt
+        vkt, pkt - scenarios x modes arrays of the 2030 scenario vkt and pkt
+        occupancy_included - array of the average occupancy of a car (0 if no change from initial)
+
+    Outputs:
+        updated vkt, pkt
+    '''
+    changed = (occupancy_included > 0)[:, np.newaxis]
+    occupancy = np.where(changed, occupancy_included[:, np.newaxis], 1)
+    columns = mode_registry.indices(modes, mode_registry.car_modes())
+    vkt[:, columns] = np.where(changed, pkt[:, columns] / occupancy, vkt[:, columns])
+    return vkt, pkt
+
+
+def calculate_emissions_batch(emission_factors, modes, vkt, car_emission_change):
+    '''
+    This function calculates the 2030 scenario emissions from the 2030 scenario vkt and emission_factors
+
+    Inputs:
+        emission_factors - the emissions factors for each mode (how much CO2-e is emitted for each km travelled)
+        modes - list of modes, in the column order of vkt
+        vkt - scenarios x modes array of the 2030 scenario vkt
+        car_emission_change - array of the % reduction in car emissions per km travelled from 2018 levels
+
+    Outputs:
+        emissions - scenarios x modes array of the 2030 scenario emissions
+    '''
+    emissions = vkt * emission_factors.loc['values_2030_scenario', modes].to_numpy(dtype=float)
+    fuelled_cars = mode_registry.indices(modes, mode_registry.electrification('private')[0])
+    emissions[:, fuelled_cars] *= (1 - car_emission_change)[:, np.newaxis]
+    return emissions
+
+
+def evaluate_batch(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, batch, mode_costs=None, od_effects=None,
+                   grid=None):
+    '''
+    This function runs the full update_graph pipeline for every scenario in a batch
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        emission_factors - the emissions factors for each mode
+        pt_effects_vkt, pt_effects_pkt - dataframes with the effect of each project on the vkt and pkt for each mode
+        batch - dictionary of lever arrays (see make_batch)
+        mode_costs - optional mode costs (see mode_choice.load_costs), to shift pkt between modes with logit
+                     mode choice instead of in proportion to the 2030 baseline shares
+        od_effects - optional zone to zone effects (see od_demand.prepare), to shift trips to PT projects
+                     in the OD pairs they serve. Not used with mode_costs
+        grid - optional emission factors for grid pathways and years (see grid_intensity.prepare)
+
+    Outputs:
+        results - dictionary with the modes, scenarios x modes arrays of the 2030 scenario 'vkt', 'pkt' and 'emissions',
+                  and the number of cars on the road in each scenario ('cars'). With mode_costs, also the mode
+                  choice solver report ('mode_choice', see mode_choice.solve). With grid, also the
+                  scenarios x pathways x years total emissions in Mt CO2-e ('emissions_by_year')
+    '''
+    modes = list(base_numbers.columns)
+    n = batch_size(batch)
+
+    vkt = np.tile(base_numbers.loc['vkt_2030_scenario', modes].to_numpy(dtype=float), (n, 1))
+    pkt = np.tile(base_numbers.loc['pkt_2030_scenario', modes].to_numpy(dtype=float), (n, 1))
+
+    # Applying Selected Changes, in the same order as update_graph
+    report = None
+    if mode_costs is None:
+        if od_effects is not None:
+            vkt, pkt = od_demand.pt_projects_apply_od(vkt, pkt, od_effects, batch['pt_included'])
+        else:
+            vkt, pkt = pt_projects_apply_batch(
+                vkt, pkt,
+                pt_effects_vkt[modes].to_numpy(dtype=float),
+                pt_effects_pkt[modes].to_numpy(dtype=float),
+                batch['pt_included'],
+            )
+        vkt, pkt = bus_ridership_changes_batch(numbers, base_numbers, vkt, pkt, batch['bus_prop_increase'])
+        vkt, pkt = cycling_changes_batch(numbers, base_numbers, vkt, pkt, batch['cycling_included'])
+    else:
+        vkt, pkt, report = mode_choice.mode_choice_batch(
+            numbers, base_numbers, mode_costs, vkt, pkt,
+            pt_effects_vkt[modes].to_numpy(dtype=float),
+            pt_effects_pkt[modes].to_numpy(dtype=float),
+            batch['pt_included'], batch['bus_prop_increase'], batch['cycling_included'],
+        )
+
+    vkt, pkt = bus_electric_batch(numbers, modes, vkt, pkt, batch['bus_electrification_included'])
+    vkt, pkt = car_electric_batch(modes, vkt, pkt, batch['car_electrification_included'] / 100)
+
+    vkt, pkt = covid_trips_batch(numbers, modes, vkt, pkt, batch['covid'])
+
+    vkt, pkt = car_occupancy_batch(modes, vkt, pkt, batch['occupancy_included'] / 100)
+    emissions = calculate_emissions_batch(emission_factors, modes, vkt, batch['car_emission_change'])
+
+    car_rate = fleet_size.base_counts(numbers, base_numbers)[0]
+    cars = fleet_size.cars_on_road(vkt, modes, car_rate)
+
+    results = {'modes': modes, 'vkt': vkt, 'pkt': pkt, 'emissions': emissions, 'cars': cars}
+    if report is not None:
+        results['mode_choice'] = report
+    if grid is not None:
+        results['emissions_by_year'] = grid_intensity.total_emissions_by_year(vkt, grid['factors'], modes, batch['car_emission_change'])
+    return results
+
+
+def total_emissions(results):
+    '''
+    Returns the total 2030 scenario emissions for each scenario, in Mt CO2-e (as shown on the dashboard)
+    '''
+    return results['emissions'].sum(axis=1) / (10**9)
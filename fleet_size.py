@@ -0,0 +1,103 @@
+'''
+Fleet size model: the approximate number of cars on the road.
+
+The number of cars is estimated by scaling the 2018 car ownership by the light fleet vkt, so a
+scenario with 10% less light fleet vkt than 2018 has roughly 10% fewer cars. The functions work on
+arrays with modes as the last axis, so the leading axes can be scenarios, years, regions or any
+combination of them, and every count is evaluated in one go.
+'''
+import numpy as np
+
+import mode_registry
+
+
+light_fleet = mode_registry.car_modes()
+
+# Car counts used to colour the traffic levels on the dashboard
+traffic_thresholds = {
+    'high': 1432825,
+    'moderate': 1089207,
+}
+
+# Traffic levels returned by traffic_level
+traffic_levels = ['above_baseline', 'high', 'moderate', 'low']
+
+
+def light_fleet_vkt(vkt, modes):
+    '''
+    This function adds up the light fleet vkt
+
+    Inputs:
+        vkt - array of vkt with modes as the last axis
+        modes - list of modes, in the order of the last axis of vkt
+
+    Outputs:
+        array of light fleet vkt, with the shape of vkt without the last axis
+    '''
+    return np.asarray(vkt, dtype=float)[..., [modes.index(mode) for mode in light_fleet]].sum(axis=-1)
+
+
+def ownership_rate(car_ownership, vkt_2018, modes):
+    '''
+    This function works out the number of cars per light fleet vkt in 2018
+
+    Inputs:
+        car_ownership - 2018 number of cars: a single number, or an array with one value per region
+        vkt_2018 - 2018 vkt by mode: one row, or one row per region
+        modes - list of modes, in the order of the last axis of vkt_2018
+
+    Outputs:
+        cars per vkt (one value per region if regions are given)
+    '''
+    return np.asarray(car_ownership, dtype=float) / light_fleet_vkt(vkt_2018, modes)
+
+
+def cars_on_road(vkt, modes, rate):
+    '''
+    This function estimates the number of cars on the road
+
+    Inputs:
+        vkt - array of vkt with modes as the last axis (e.g. scenarios x years x modes)
+        modes - list of modes, in the order of the last axis of vkt
+        rate - cars per vkt from ownership_rate, which must broadcast against the leading axes of vkt
+
+    Outputs:
+        array of car counts, with the shape of vkt without the last axis
+    '''
+    return rate * light_fleet_vkt(vkt, modes)
+
+
+def traffic_level(cars, cars_baseline):
+    '''
+    This function classifies car counts into the traffic levels shown on the dashboard
+
+    Inputs:
+        cars - array of car counts
+        cars_baseline - car count for the 2030 baseline (broadcast against cars)
+
+    Outputs:
+        array of indices into traffic_levels
+    '''
+    cars = np.asarray(cars)
+    return np.select(
+        [cars > cars_baseline, cars > traffic_thresholds['high'], cars > traffic_thresholds['moderate']],
+        [0, 1, 2],
+        default=3,
+    )
+
+
+def base_counts(numbers, base_numbers):
+    '''
+    This function gives the car counts for 2018 and the 2030 baseline
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+
+    Outputs:
+        cars per vkt, 2018 car count, 2030 baseline car count
+    '''
+    modes = list(base_numbers.columns)
+    rate = ownership_rate(numbers['2018_car_ownership'], base_numbers.loc['vkt_2018', modes].to_numpy(dtype=float), modes)
+    cars_2030_baseline = cars_on_road(base_numbers.loc['vkt_2030_baseline', modes].to_numpy(dtype=float), modes, rate)
+    return rate, numbers['2018_car_ownership'], cars_2030_baseline
@@ -0,0 +1,578 @@
+'''
+Differential fuzzing of the fast paths against the reference scenario functions (reference.py).
+
+Each case draws perturbed model inputs and a batch of random scenarios, runs the scenarios
+through reference.run_scenario, and checks that every fast path gives the same 2030 scenario
+vkt, pkt and emissions, to within its tolerance:
+
+    app           - the scenario functions in app.py, in update_graph order, and pt_proj_effects, with
+                    the frequencies and with service_profiles.from_frequencies profiles
+    engine        - engine.evaluate_batch, the vectorised batch behind the sweeps, goal seek and abatement curves
+    sweeps        - a run of consecutive scenario numbers of a full factorial sweep, in small float32 chunks
+    shapley       - the Shapley values, which have to add up to the change from the default scenario,
+                    and for a few components match the average over every order of adding them
+    grid          - the emissions for grid pathways and years from engine.evaluate_batch, against the
+                    reference emissions with each pathway and year's factors worked out by hand
+    mode_choice   - the logit mode choice with PT over capacity, which has to keep the total pkt,
+                    fit demand within capacity and converge
+    goal_seek     - the slider value found has to give the output goal seek reports
+    update_graph  - the callback as it is served (result cache and coalescing included), on the real data
+    static        - static_export.js answering the callback in node, on the real data (with --static)
+
+The perturbed inputs scale every pkt and vkt, emission factor and PT project detail by a random
+factor, draw random car occupancy, annualisation factors and bus lifespan, and resample the PT
+projects. The scenarios include lever values between the dashboard's options and at the ends of
+the sliders. The two dashboard paths use the data app.py loaded, so they get the real inputs and
+lever values the controls allow.
+
+Every case has its own seed, made from --seed and its number, so a failing case can be run again
+on its own with --case.
+
+Usage:
+    python fuzz.py                          # 200 cases
+    python fuzz.py --cases 1000 --static    # more cases, and the static export (needs node)
+    python fuzz.py --seed 3 --case 17       # run one case again
+'''
+import argparse
+import itertools
+import json
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import plotly
+
+import app
+import engine
+import goal_seek
+import grid_intensity
+import mode_choice
+import mode_registry
+import reference
+import service_profiles
+import shapley
+import sweeps
+
+
+# Largest relative difference allowed on each path. The float64 paths only add things up in a
+# different order; the sweeps store their outputs as float32
+tolerances = {
+    'app': 1e-9,
+    'engine': 1e-9,
+    'sweeps': 1e-6,
+    'shapley': 1e-9,
+    'grid': 1e-9,
+    'mode_choice': 1e-6,
+    'goal_seek': 1e-9,
+    'update_graph': 1e-9,
+    'static': 1e-9,
+}
+
+# Scenarios run through each path in every case
+scenarios_per_case = 8
+
+# How far over capacity the mode_choice check puts the PT modes in use, in the default scenario
+overload = 1.25
+
+# Most components for the Shapley check (it evaluates 2^components scenarios)
+shapley_components = 10
+
+# Most components for the check against every order of adding them (components! orders)
+permutation_components = 5
+
+
+def perturbed_inputs(rng, spread=0.5):
+    '''
+    This function makes a random variation of the model inputs
+
+    Inputs:
+        rng - numpy random generator
+        spread - largest proportion each number is scaled up or down by
+
+    Outputs:
+        dictionary of numbers, reference_numbers (the same, from reference.data_initialisation),
+        base_numbers, emission_factors and pt_details
+    '''
+    def scaled(shape):
+        return rng.uniform(1 - spread, 1 + spread, size=shape)
+
+    base_numbers = app.master_base_numbers.copy()
+    rows = [row for row in base_numbers.index if row.startswith(('pkt', 'vkt'))]
+    base_numbers.loc[rows] = base_numbers.loc[rows] * scaled((len(rows), base_numbers.shape[1]))
+    emission_factors = app.emission_factors * scaled(app.emission_factors.shape)
+    for year in ['2018', '2030_baseline', '2030_scenario']:
+        base_numbers.loc['emissions_' + year] = emission_factors.loc['values_' + year] * base_numbers.loc['vkt_' + year]
+
+    # Between one and twice as many projects as there are, resampled from the real ones
+    pt_details = app.pt_details.iloc[rng.integers(0, len(app.pt_details), size=rng.integers(1, 2 * len(app.pt_details) + 1))].copy()
+    for column in ['peak_freq', 'off_peak_freq', 'vehicle_capacity', 'distance']:
+        pt_details[column] = pt_details[column] * scaled(len(pt_details))
+    pt_details['num_hours'] = rng.integers(16, 25, size=len(pt_details))
+    pt_details['num_peak_hrs'] = rng.integers(2, 7, size=len(pt_details))
+    pt_details.index = ['{}_{}'.format(name, i) for i, name in enumerate(pt_details.index)]
+    pt_details.index.name = app.pt_details.index.name
+
+    numbers = app.data_initialisation(base_numbers)
+    drawn = {
+        'car_occupancy': rng.uniform(1.1, 2.2),
+        'pkt_annualisation': numbers['pkt_annualisation'] * rng.uniform(1 - spread, 1 + spread),
+        'vkt_annualisation': numbers['vkt_annualisation'] * rng.uniform(1 - spread, 1 + spread),
+        'bus_lifespan': int(rng.integers(8, 26)),
+    }
+
+    return {'numbers': dict(numbers, **drawn), 'reference_numbers': dict(reference.data_initialisation(base_numbers), **drawn),
+            'base_numbers': base_numbers, 'emission_factors': emission_factors, 'pt_details': pt_details}
+
+
+def random_scenario(rng, projects, off_grid=0.25):
+    '''
+    This function draws random lever settings
+
+    Inputs:
+        rng - numpy random generator
+        projects - list of PT projects to choose from
+        off_grid - chance of each lever taking any value in its range, rather than one the dashboard allows
+
+    Outputs:
+        dictionary of lever settings, with every lever
+    '''
+    scenario = {}
+    for lever in engine.lever_names:
+        if lever == 'pt_included':
+            scenario[lever] = [project for project in projects if rng.random() < 0.5]
+            continue
+        options = engine.lever_options[lever]
+        low, high = options if isinstance(options, tuple) else (min(options), max(options))
+        if rng.random() < off_grid:
+            scenario[lever] = float(rng.uniform(low, high))
+        elif isinstance(options, tuple):
+            # The ends of the sliders a third of the time
+            scenario[lever] = int([low, high, rng.integers(low, high + 1)][rng.integers(3)])
+        else:
+            scenario[lever] = options[rng.integers(len(options))]
+    return scenario
+
+
+def relative_error(found, expected):
+    '''
+    Returns the largest difference between found and expected, relative to the largest expected
+    value in the same row (so modes with next to nothing on them do not count for more)
+    '''
+    found = np.atleast_2d(np.asarray(found, dtype=float))
+    expected = np.atleast_2d(np.asarray(expected, dtype=float))
+    if found.shape != expected.shape:
+        return np.inf
+    # Rows with nothing on them (e.g. pkt with every trip cut) are compared against the largest value of all
+    scale = np.abs(expected).max(axis=-1, keepdims=True)
+    scale[scale == 0] = np.abs(expected).max() or 1
+    with np.errstate(invalid='ignore', over='ignore'):
+        error = np.abs(found - expected) / scale
+    error[(found == expected) | (np.isnan(found) & np.isnan(expected))] = 0
+    error[np.isnan(error)] = np.inf
+    return float(error.max()) if error.size else 0.0
+
+
+def outputs(base_numbers, modes):
+    '''
+    Returns the 2030 scenario vkt, pkt and emissions of a base_numbers dataframe, as one 3 x modes array
+    '''
+    return base_numbers.loc[['vkt_2030_scenario', 'pkt_2030_scenario', 'emissions_2030_scenario'], modes].to_numpy(dtype=float)
+
+
+def app_scenario(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, scenario):
+    '''
+    This function runs a scenario through the app.py scenario functions, in the same order as update_graph
+    '''
+    base_numbers = base_numbers.copy()
+    base_numbers = app.pt_projects_apply(base_numbers, pt_effects_vkt, pt_effects_pkt, list(scenario['pt_included']))
+    base_numbers = app.bus_ridership_changes(numbers, base_numbers, scenario['bus_prop_increase'])
+    base_numbers = app.cycling_changes(numbers, base_numbers, scenario['cycling_included'])
+    base_numbers = app.bus_electric(numbers, base_numbers, scenario['bus_electrification_included'])
+    base_numbers = app.car_electric(base_numbers, scenario['car_electrification_included']/100)
+    base_numbers = app.covid_trips(base_numbers, scenario['covid'], numbers)
+    base_numbers = app.car_occupancy(base_numbers, scenario['occupancy_included']/100)
+    base_numbers = app.calculate_emissions(base_numbers, emission_factors, scenario['car_emission_change'])
+    return base_numbers
+
+
+def check_app(case):
+    # pt_proj_effects, then every scenario through the app.py functions
+    found = app.pt_proj_effects(case['numbers'], case['base_numbers'], case['pt_details'])
+    errors = [('pt_proj_effects', max(relative_error(f, e) for f, e in zip(found, case['reference_effects'])))]
+    # Profiles made from the frequencies have to give the same vkt and pkt
+    profiles = service_profiles.from_frequencies(case['pt_details'])
+    found = app.pt_proj_effects(case['numbers'], case['base_numbers'], case['pt_details'], profiles)
+    errors += [('profiles ' + name, relative_error(f, e)) for name, f, e in zip(['vkt', 'pkt'], found, case['reference_effects'])]
+    for scenario, expected in zip(case['scenarios'], case['expected']):
+        result = app_scenario(case['numbers'], case['base_numbers'], case['emission_factors'], *case['effects'], scenario)
+        errors.append((scenario, relative_error(outputs(result, case['modes']), expected)))
+    return errors
+
+
+def check_engine(case):
+    # Every scenario in one batch
+    results = engine.evaluate_batch(case['numbers'], case['base_numbers'], case['emission_factors'], *case['effects'],
+                                    engine.make_batch(case['scenarios'], case['projects']))
+    return [
+        (scenario, relative_error(np.stack([results['vkt'][k], results['pkt'][k], results['emissions'][k]]), expected))
+        for k, (scenario, expected) in enumerate(zip(case['scenarios'], case['expected']))
+    ]
+
+
+def check_sweeps(case):
+    # A random run of consecutive scenario numbers, in chunks smaller than the run
+    levels = sweeps.lever_levels(case['projects'])
+    start = int(case['rng'].integers(0, sweeps.size(levels) - scenarios_per_case))
+    chunks = list(sweeps.iterate(case['numbers'], case['base_numbers'], case['emission_factors'], *case['effects'], levels,
+                                 start=start, stop=start + scenarios_per_case, chunk_size=3, dtype=np.float32,
+                                 outputs=('vkt', 'pkt', 'emissions', 'total_emissions')))
+    batch = sweeps.decode(np.concatenate([chunk['index'] for chunk in chunks]), levels, case['projects'])
+    found = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in ['vkt', 'pkt', 'emissions', 'total_emissions']}
+    errors = []
+    for k in range(scenarios_per_case):
+        scenario = {lever: batch[lever][k] for lever in engine.lever_names if lever != 'pt_included'}
+        scenario['pt_included'] = [project for project, included in zip(case['projects'], batch['pt_included'][k]) if included]
+        expected = outputs(case['reference'](scenario), case['modes'])
+        error = max(relative_error(np.stack([found['vkt'][k], found['pkt'][k], found['emissions'][k]]), expected),
+                    relative_error(found['total_emissions'][k], expected[2].sum() / (10**9)))
+        errors.append((scenario, error))
+    return errors
+
+
+def component_scenario(parts):
+    '''
+    Returns the scenario with these components (see shapley.components) and every other lever at its default
+    '''
+    scenario = dict(engine.lever_defaults, pt_included=[])
+    for lever, value in parts:
+        if lever == 'pt_included':
+            scenario['pt_included'] = scenario['pt_included'] + [value]
+        else:
+            scenario[lever] = value
+    return scenario
+
+
+def permutation_shares(parts, total):
+    '''
+    This function works out Shapley values the long way: each component's effect when it is added,
+    averaged over every order the components could be added in
+
+    Inputs:
+        parts - list of (lever, value) pairs (see shapley.components)
+        total - function taking a scenario and returning its 2030 emissions
+
+    Outputs:
+        array of each component's share
+    '''
+    totals = {}
+
+    def subset_total(subset):
+        if subset not in totals:
+            totals[subset] = total(component_scenario([parts[i] for i in sorted(subset)]))
+        return totals[subset]
+
+    shares = np.zeros(len(parts))
+    orders = list(itertools.permutations(range(len(parts))))
+    for order in orders:
+        for position, i in enumerate(order):
+            before = frozenset(order[:position])
+            shares[i] += subset_total(before | {i}) - subset_total(before)
+    return shares / len(orders)
+
+
+def check_shapley(case):
+    def total(scenario):
+        return case['reference'](scenario).loc['emissions_2030_scenario'].sum() / (10**9)
+
+    errors = []
+    # The first scenario with few enough components; the shares add up to the change from the default scenario
+    scenario = next((scenario for scenario in case['scenarios']
+                     if len(shapley.components(scenario, case['projects'])) <= shapley_components), None)
+    if scenario is not None:
+        found = shapley.attribute(case['numbers'], case['base_numbers'], case['emission_factors'], *case['effects'], scenario)
+        baseline = total(dict(engine.lever_defaults))
+        scenario_total = case['expected'][case['scenarios'].index(scenario)][2].sum() / (10**9)
+        errors.append((scenario, relative_error(
+            [found['baseline'], found['scenario'], found['baseline'] + found['contributions'].sum()],
+            [baseline, scenario_total, scenario_total])))
+
+    # A few of the first scenario's components; each share matches the average over every order of adding them
+    rng = case['rng']
+    parts = shapley.components(case['scenarios'][0], case['projects'])
+    parts = [parts[i] for i in sorted(rng.choice(len(parts), size=min(len(parts), permutation_components), replace=False))]
+    scenario = component_scenario(parts)
+    found = shapley.attribute(case['numbers'], case['base_numbers'], case['emission_factors'], *case['effects'], scenario)
+    if found['components'] != parts:
+        return errors + [(scenario, np.inf)]
+    errors.append((scenario, relative_error(found['contributions'], permutation_shares(parts, total))))
+    return errors
+
+
+def check_grid(case):
+    # Random curves for three pathways at 2018, 2030 and 2050, shown in those years and halfway to 2030.
+    # The first pathway gives the case's own factors in 2030, so it has to match the reference as it is
+    rng, modes = case['rng'], case['modes']
+    electric = ['electric_light', 'electric_bus']
+    curve_years = [2018, 2030, 2050]
+    grid_curves = pd.DataFrame(rng.uniform(0.01, 0.5, size=(3, 3)), index=['p0', 'p1', 'p2'], columns=curve_years)
+    efficiency = pd.DataFrame(rng.uniform(0.1, 2, size=(2, 3)), index=electric, columns=curve_years)
+    efficiency[2030] = case['emission_factors'].loc['values_2030_scenario', electric] / grid_curves.loc['p0', 2030]
+    years = [2018, 2024, 2030, 2050]
+    grid = grid_intensity.prepare(case['emission_factors'], modes, grid_curves, efficiency, years)
+    results = engine.evaluate_batch(case['numbers'], case['base_numbers'], case['emission_factors'], *case['effects'],
+                                    engine.make_batch(case['scenarios'], case['projects']), grid=grid)
+
+    errors = [('current 2030', 0.0 if not grid_intensity.check_current(grid, case['emission_factors'], modes, 'p0') else np.inf)]
+    for k, scenario in enumerate(case['scenarios']):
+        base_numbers = case['reference'](scenario)
+        expected = np.empty((len(grid_curves), len(years)))
+        for p, pathway in enumerate(grid_curves.index):
+            for y, year in enumerate(years):
+                # 2024 is halfway between the 2018 and 2030 values of both curves
+                column = (lambda curves: (curves[2018] + curves[2030]) / 2) if year == 2024 else (lambda curves: curves[year])
+                factors = case['emission_factors'].copy()
+                factors.loc['values_2030_scenario', electric] = grid_curves.loc[pathway].pipe(column) * efficiency.pipe(column)
+                expected[p, y] = reference.calculate_emissions(
+                    base_numbers.copy(), factors, scenario['car_emission_change']).loc['emissions_2030_scenario'].sum() / (10**9)
+        errors.append((scenario, relative_error(results['emissions_by_year'][k], expected)))
+    return errors
+
+
+def check_mode_choice(case):
+    base_numbers, modes = case['base_numbers'], case['modes']
+    scenarios = [dict(engine.lever_defaults)] + case['scenarios']
+    batch = engine.make_batch(scenarios, case['projects'])
+    vkt = np.tile(base_numbers.loc['vkt_2030_scenario', modes].to_numpy(dtype=float), (len(scenarios), 1))
+    pkt = np.tile(base_numbers.loc['pkt_2030_scenario', modes].to_numpy(dtype=float), (len(scenarios), 1))
+    effects = [effect[modes].to_numpy(dtype=float) for effect in case['effects']]
+    baseline_vkt = base_numbers.loc['vkt_2030_baseline', modes].to_numpy(dtype=float)
+    baseline_pkt = base_numbers.loc['pkt_2030_baseline', modes].to_numpy(dtype=float)
+
+    def solve(costs):
+        return mode_choice.mode_choice_batch(case['numbers'], base_numbers, costs, vkt.copy(), pkt, *effects,
+                                             batch['pt_included'], batch['bus_prop_increase'], batch['cycling_included'])
+
+    # With the shipped costs PT never reaches capacity, so the shadow prices are never solved for. Set the
+    # load factors so the default scenario's demand, with no capacity limit, is overload x the capacity
+    costs = mode_choice.load_costs().reindex(modes)
+    unlimited = solve(costs.assign(current_load_factor = np.nan))[1][0]
+    in_use = costs.current_load_factor.notna().to_numpy() & (baseline_vkt > 0)
+    costs.loc[in_use, 'current_load_factor'] = overload * baseline_pkt[in_use] / unlimited[in_use]
+    new_vkt, new_pkt, report = solve(costs)
+
+    # Capacity from the PT vkt run: the baseline load per vkt over the load factor, or for new modes what the projects carry
+    load_factor = costs.current_load_factor.to_numpy(dtype=float)
+    limited = ~np.isnan(load_factor)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        capacity = np.where(baseline_vkt > 0, new_vkt * baseline_pkt / baseline_vkt / load_factor, batch['pt_included'] @ effects[1])
+        over = np.where(limited & (capacity > 0), new_pkt / capacity - 1, np.where(limited & (new_pkt > 0), np.inf, 0))
+
+    errors = []
+    for k, scenario in enumerate(scenarios):
+        error = max(relative_error(new_pkt[k].sum(), pkt[k].sum()), over[k].max(), 0.0)
+        if not report['converged'][k]:
+            error = np.inf
+        if k == 0:
+            # The default scenario starts over capacity, so it needs shadow prices and ends at capacity on some mode
+            at_capacity = np.abs(over[k][limited & (capacity[k] > 0)]).min()
+            error = max(error, at_capacity) if report['iterations'][k] > 1 else np.inf
+        errors.append((scenario, error))
+    return errors
+
+
+def check_goal_seek(case):
+    # A target for a random slider, somewhere around the outputs it can reach
+    rng = case['rng']
+    scenario = case['scenarios'][0]
+    lever = list(goal_seek.continuous_levers)[rng.integers(len(goal_seek.continuous_levers))]
+
+    def total(value):
+        return case['reference'](dict(scenario, **{lever: value})).loc['emissions_2030_scenario'].sum() / (10**9)
+
+    low, high = sorted(total(value) for value in engine.lever_options[lever])
+    target = rng.uniform(low - 0.1 * (high - low), high + 0.1 * (high - low))
+    found = goal_seek.seek(case['numbers'], case['base_numbers'], case['emission_factors'], *case['effects'], scenario, lever, target)
+    error = relative_error([found['current'], found['achieved']], [total(scenario[lever]), total(found['snapped'])])
+    if found['reachable']:
+        error = max(error, relative_error(total(found['value']), target))
+    return [(dict(scenario, goal_lever=lever, goal_target=target), error)]
+
+
+def figure_outputs(response, modes):
+    '''
+    Returns the 2030 scenario pkt and emissions in an update_graph response, as one 2 x modes array (vkt is not sent)
+    '''
+    traces = {'emissions': response['stacked_emissions']['figure']['data'], 'pkt': response['stacked_emissions1']['figure']['data']}
+    trace_modes = list(mode_registry.registry.index)
+    return np.array([[traces[name][trace_modes.index(mode)]['y'][2] for mode in modes] for name in ['pkt', 'emissions']])
+
+
+def check_update_graph(case):
+    # The callback as Dash calls it, on the real data
+    scenario = case['dashboard_scenario']
+    response = json.loads(app.update_graph(*[scenario[lever] for lever in engine.lever_names]))['response']
+    return [(scenario, relative_error(figure_outputs(response, case['modes']), case['dashboard_expected'][1:]))]
+
+
+def check_static(static_dir, dashboard_cases):
+    '''
+    This function answers the update_graph requests of every case with static_export.js, in one run of node
+
+    Inputs:
+        static_dir - directory of an exported site
+        dashboard_cases - list of (scenario, expected outputs) on the real data
+
+    Outputs:
+        list of (scenario, relative error)
+    '''
+    import static_export
+
+    dependency = [item for item in json.loads((static_dir / '_dash-dependencies').read_text())
+                  if 'stacked_emissions.figure' in item['output']][0]
+    bodies = [
+        {'output': dependency['output'],
+         'inputs': [dict(item, value=scenario.get(item['id'], [])) for item in dependency['inputs']],
+         'state': [dict(item, value={}) for item in dependency['state']]}
+        for scenario, _ in dashboard_cases
+    ]
+    responses = static_export.respond_with_node(static_dir, bodies)
+    modes = list(app.master_base_numbers.columns)
+    return [(scenario, relative_error(figure_outputs(response['response'], modes), expected[1:]))
+            for (scenario, expected), response in zip(dashboard_cases, responses)]
+
+
+checks = {
+    'app': check_app,
+    'engine': check_engine,
+    'sweeps': check_sweeps,
+    'shapley': check_shapley,
+    'grid': check_grid,
+    'mode_choice': check_mode_choice,
+    'goal_seek': check_goal_seek,
+    'update_graph': check_update_graph,
+}
+
+
+def make_case(rng):
+    '''
+    This function draws the inputs and scenarios of one case, and runs the scenarios through the reference functions
+    '''
+    case = perturbed_inputs(rng)
+    case['rng'] = rng
+    case['modes'] = list(case['base_numbers'].columns)
+    case['projects'] = list(case['pt_details'].index)
+    case['reference_effects'] = reference.pt_proj_effects(case['reference_numbers'], case['base_numbers'], case['pt_details'])
+    case['effects'] = app.pt_proj_effects(case['numbers'], case['base_numbers'], case['pt_details'])
+
+    def run_reference(scenario):
+        return reference.run_scenario(case['reference_numbers'], case['base_numbers'], case['emission_factors'],
+                                      *case['reference_effects'], scenario)
+    case['reference'] = run_reference
+    case['scenarios'] = [random_scenario(rng, case['projects']) for _ in range(scenarios_per_case)]
+    case['expected'] = [outputs(run_reference(scenario), case['modes']) for scenario in case['scenarios']]
+
+    # The dashboard paths run on the real data, with values the controls allow
+    case['dashboard_scenario'] = random_scenario(rng, list(app.pt_details.index), off_grid=0)
+    case['dashboard_expected'] = outputs(reference.run_scenario(
+        reference.data_initialisation(app.master_base_numbers), app.master_base_numbers, app.emission_factors,
+        *real_reference_effects(), case['dashboard_scenario']),
+        list(app.master_base_numbers.columns))
+    return case
+
+
+_real_reference_effects = []
+
+
+def real_reference_effects():
+    '''
+    Returns the reference PT project effects for the real data (worked out once)
+    '''
+    if not _real_reference_effects:
+        _real_reference_effects.extend(reference.pt_proj_effects(
+            reference.data_initialisation(app.master_base_numbers), app.master_base_numbers, app.pt_details))
+    return _real_reference_effects
+
+
+def run(cases=200, seed=0, only_case=None, static=False):
+    '''
+    This function runs the fuzzing cases
+
+    Inputs:
+        cases - number of cases
+        seed - seed the seed of each case is made from
+        only_case - run only this case (to repeat a failure)
+        static - also check static_export.js (needs node; exports the site to a temporary directory)
+
+    Outputs:
+        dictionary of path: dictionary of the number of 'checks', the largest relative 'error' and
+        the 'failures' (case, scenario, error) over its tolerance
+    '''
+    report = {path: {'checks': 0, 'error': 0.0, 'failures': []} for path in list(checks) + (['static'] if static else [])}
+
+    def record(path, case_number, errors):
+        for scenario, error in errors:
+            report[path]['checks'] += 1
+            report[path]['error'] = max(report[path]['error'], error)
+            if not error <= tolerances[path]:
+                report[path]['failures'].append((case_number, scenario, error))
+
+    # The dashboard paths only match the reference without the optional OD demand and service profiles
+    dashboard = app.od_effects is None and app.pt_profiles is None
+    if not dashboard:
+        del report['update_graph']
+        report.pop('static', None)
+
+    dashboard_cases = []
+    for case_number in (range(cases) if only_case is None else [only_case]):
+        case = make_case(np.random.default_rng([seed, case_number]))
+        for path, check in checks.items():
+            if path in report:
+                record(path, case_number, check(case))
+        dashboard_cases.append((case_number, case['dashboard_scenario'], case['dashboard_expected']))
+
+    if 'static' in report:
+        import static_export
+        with tempfile.TemporaryDirectory() as static_dir:
+            static_export.export(static_dir)
+            errors = check_static(static_export.Path(static_dir), [(scenario, expected) for _, scenario, expected in dashboard_cases])
+        for (case_number, _, _), error in zip(dashboard_cases, errors):
+            record('static', case_number, [error])
+    return report
+
+
+def failed(report):
+    '''
+    Returns whether any path differed from the reference by more than its tolerance
+    '''
+    return any(result['failures'] for result in report.values())
+
+
+def print_report(report, seed=0):
+    '''
+    Prints the largest error on each path, and every failure with the case to rerun it
+    '''
+    print('{:<16}{:>10}{:>16}{:>12}'.format('path', 'checks', 'largest error', 'tolerance'))
+    for path, result in report.items():
+        print('{:<16}{:>10}{:>16.2e}{:>12.0e}'.format(path, result['checks'], result['error'], tolerances[path]))
+    for path, result in report.items():
+        for case_number, scenario, error in result['failures']:
+            print('FAILED: {} differs from the reference by {:.2e} in case {} (python fuzz.py --seed {} --case {}): {}'.format(
+                path, error, case_number, seed, case_number, json.dumps(scenario, cls=plotly.utils.PlotlyJSONEncoder)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the fast paths against the reference scenario functions')
+    parser.add_argument('--cases', type=int, default=200, help='number of random cases')
+    parser.add_argument('--seed', type=int, default=0, help='seed the seed of each case is made from')
+    parser.add_argument('--case', type=int, default=None, help='run only this case')
+    parser.add_argument('--static', action='store_true', help='also check static_export.js (needs node)')
+    args = parser.parse_args(argv)
+
+    report = run(args.cases, args.seed, args.case, args.static)
+    print_report(report, args.seed)
+    return 1 if failed(report) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
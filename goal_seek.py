@@ -0,0 +1,177 @@
+'''
+Goal seek: the value of one slider that brings the 2030 scenario to a target, with the other
+choices as they are.
+
+The sliders act late in the model (after the PT projects, bus ridership and cycling changes), and
+each of them moves the vkt in a simple way: car electrification and the reduction in trips taken
+scale it linearly, and car occupancy divides the car vkt by the occupancy. So the emissions and
+the cars on the road are affine in the slider value (or in its reciprocal, for occupancy), and
+the solution is found in closed form from a batch of three scenarios: the two ends of the slider
+and a third to check the line. If the check fails (a lever without a known form, or a model
+change that breaks it) the solution is bracketed instead, evaluating a grid of slider values as
+one batch and narrowing it down around the crossing. Either way it takes a few milliseconds.
+'''
+import numpy as np
+
+import engine
+
+
+# Sliders that can be solved for: how the outputs depend on them, as a function making them affine
+continuous_levers = {
+    'car_electrification_included': lambda values: values,
+    'covid': lambda values: values,
+    'occupancy_included': lambda values: 1 / values,
+}
+
+# Outputs that can be targeted, from engine.evaluate_batch
+outputs = ['total_emissions', 'cars']
+
+# Bracketing: scenarios in each grid, and the number of times the grid is narrowed
+grid_points = 65
+refinements = 3
+
+# Closed form solutions are checked to this relative tolerance
+tolerance = 1e-9
+
+
+def evaluate(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, scenario, lever, values, output, **options):
+    '''
+    This function runs a scenario with a range of values for one lever
+
+    Inputs:
+        numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt - as for engine.evaluate_batch
+        scenario - dictionary of lever settings (missing levers take their default)
+        lever - the lever to vary
+        values - array of values for the lever
+        output - name of the output (see outputs)
+        options - passed on to engine.evaluate_batch (mode_costs, od_effects)
+
+    Outputs:
+        array of the output for each value
+    '''
+    values = np.asarray(values, dtype=float)
+    batch = engine.make_batch([scenario], list(pt_effects_pkt.index))
+    batch = {name: np.repeat(column, len(values), axis=0) for name, column in batch.items()}
+    batch[lever] = values
+    results = engine.evaluate_batch(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, batch, **options)
+    return engine.total_emissions(results) if output == 'total_emissions' else results[output]
+
+
+def _closed_form(f, lever, target, low, high):
+    # Solves from the ends of the slider, checked against its middle. Returns None if the output is not affine
+    transform = continuous_levers[lever]
+    ends = np.array([low, high, (low + high) / 2])
+    found = f(ends)
+    t = transform(ends)
+    slope = (found[1] - found[0]) / (t[1] - t[0])
+    predicted = found[0] + slope * (t[2] - t[0])
+    if abs(predicted - found[2]) > tolerance * max(abs(found[2]), 1):
+        return None
+
+    if slope == 0:
+        value = low if found[0] == target else None
+    else:
+        # Back from the transformed value (both transforms are their own inverse)
+        value = float(transform(np.float64(t[0] + (target - found[0]) / slope)))
+    return {
+        'value': value,
+        'range': [float(found[:2].min()), float(found[:2].max())],
+        'output_at': lambda values: found[0] + slope * (transform(np.asarray(values, dtype=float)) - t[0]),
+    }
+
+
+def _bracket(f, target, low, high, current):
+    # Finds where the output crosses the target on a grid of slider values, and narrows the grid around it
+    grid = np.linspace(low, high, grid_points)
+    found = f(grid)
+    output_range = [float(found.min()), float(found.max())]
+    above = found >= target
+    crossings = np.flatnonzero(above[1:] != above[:-1])
+    if len(crossings) == 0:
+        return {'value': None, 'range': output_range, 'closest': float(grid[np.argmin(np.abs(found - target))])}
+
+    # The crossing nearest the current value, if the output crosses the target more than once
+    k = crossings[np.argmin(np.abs(grid[crossings] - current))]
+    for _ in range(refinements):
+        grid = np.linspace(grid[k], grid[k + 1], grid_points)
+        found = f(grid)
+        above = found >= target
+        k = np.flatnonzero(above[1:] != above[:-1])[0]
+    # Linear within the last (very small) bracket
+    value = grid[k] + (target - found[k]) * (grid[k + 1] - grid[k]) / (found[k + 1] - found[k])
+    return {'value': float(value), 'range': output_range}
+
+
+def seek(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, scenario, lever, target,
+         output='total_emissions', step=1, **options):
+    '''
+    This function finds the value of a slider that brings an output to a target, with the other levers as in scenario
+
+    Inputs:
+        numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt - as for engine.evaluate_batch
+        scenario - dictionary of lever settings (missing levers take their default)
+        lever - the slider to solve for (see continuous_levers)
+        target - the value to reach, in the units shown on the dashboard (Mt CO2-e for emissions)
+        output - name of the output (see outputs)
+        step - the slider's step, for the value to snap the slider to
+        options - passed on to engine.evaluate_batch (mode_costs, od_effects)
+
+    Outputs:
+        dictionary of:
+            reachable - whether any value of the slider reaches the target
+            value - the value reaching the target (if reachable, otherwise the one coming closest)
+            snapped - value rounded to a slider step, on the side that reaches the target
+            achieved - the output with the slider at snapped
+            current - the output with the slider where it is
+            range - the lowest and highest output over the slider's range
+            method - 'affine' or 'bracketing'
+    '''
+    if lever not in continuous_levers:
+        raise ValueError('Goal seek only works for the sliders ({}), not {}'.format(', '.join(continuous_levers), lever))
+    if output not in outputs:
+        raise ValueError('Unknown output {} (choose from {})'.format(output, ', '.join(outputs)))
+    low, high = engine.lever_options[lever]
+    current_value = scenario.get(lever, engine.lever_defaults[lever])
+
+    def f(values):
+        return evaluate(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, scenario, lever, values, output, **options)
+
+    solution = _closed_form(f, lever, target, low, high)
+    method = 'affine'
+    if solution is None:
+        solution = _bracket(f, target, low, high, current_value)
+        method = 'bracketing'
+
+    # Outside the slider's range means the target cannot be reached: report the end coming closest
+    reachable = solution['value'] is not None and low - 1e-9 <= solution['value'] <= high + 1e-9
+    range_low, range_high = solution['range']
+    if reachable:
+        value = min(max(solution['value'], low), high)
+    elif 'closest' in solution:
+        value = solution['closest']
+    else:
+        ends = np.array([low, high])
+        value = float(ends[np.argmin(np.abs(solution['output_at'](ends) - target))])
+
+    # Snap to the slider step on the far side of the target from where the output is now
+    candidates = np.unique(np.clip([np.floor(value / step) * step, np.ceil(value / step) * step], low, high))
+    at_candidates = solution['output_at'](candidates) if 'output_at' in solution else f(candidates)
+    current = float(solution['output_at']([current_value])[0] if 'output_at' in solution else f([current_value])[0])
+    reaches = (at_candidates <= target) if current >= target else (at_candidates >= target)
+    if reachable and reaches.any():
+        k = np.flatnonzero(reaches)[np.argmin(np.abs(candidates[reaches] - value))]
+    else:
+        k = np.argmin(np.abs(at_candidates - target))
+
+    return {
+        'lever': lever,
+        'output': output,
+        'target': target,
+        'reachable': bool(reachable),
+        'value': float(value),
+        'snapped': float(candidates[k]),
+        'achieved': float(at_candidates[k]),
+        'current': current,
+        'range': [range_low, range_high],
+        'method': method,
+    }
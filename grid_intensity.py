@@ -0,0 +1,212 @@
+'''
+Emission factors for electric modes from electricity grid and vehicle efficiency curves.
+
+emission_factors.csv gives electric cars and buses one fixed factor. Here the factor for each year
+is built from two curves instead:
+
+    grid_intensity.csv      - kg CO2-e per kWh generated, one row per grid pathway, one column per year
+    vehicle_efficiency.csv  - kWh per km, one row per electric mode, one column per year
+
+so the factor for an electric mode is grid intensity x efficiency. The curves only need values for
+some years; the years in between are interpolated linearly. Modes without an efficiency curve keep
+their values_2030_scenario factor from emission_factors.csv.
+
+Factors are held as a pathways x years x modes array, so the emissions for every pathway and year
+come from one array operation and running ten grid pathways costs about the same as running one.
+
+engine.evaluate_batch takes the factors (see prepare) as its grid option, and then also returns the
+total emissions of every scenario for every pathway and year. The "current" pathway has to give the
+emission_factors.csv factors in 2030 (see check_current), so its 2030 column is the dashboard's
+number. The scenario functions only give vkt for 2030, so emissions for other years apply the 2030
+scenario vkt to that year's factors; they show the effect of the grid and efficiency curves alone,
+not of travel changing over the years.
+
+The curves shipped in grid_intensity.csv and vehicle_efficiency.csv are illustrative placeholders,
+not sourced data: the "current" pathway and the 2030 efficiencies were picked to reproduce the
+0.025 and 0.108 kg CO2-e/km of emission_factors.csv, and the other pathways are made up to show the
+shape of the calculation. Replace them with real grid and fleet projections before using the
+results.
+
+Usage:
+    python grid_intensity.py                                        # the default scenario, every 5 years
+    python grid_intensity.py --scenario '{"car_electrification_included": 60}' --years 2025 2030 2040
+'''
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+import mode_registry
+
+
+def load_curves(grid_path='grid_intensity.csv', efficiency_path='vehicle_efficiency.csv'):
+    '''
+    This function reads the grid intensity and vehicle efficiency curves from csv files
+
+    Outputs:
+        grid_intensity - dataframe of kg CO2-e/kWh with one row per grid pathway and one column per year
+        vehicle_efficiency - dataframe of kWh/km with one row per electric mode and one column per year
+    '''
+    grid_intensity = pd.read_csv(grid_path, index_col = 0, comment = '#')
+    vehicle_efficiency = pd.read_csv(efficiency_path, index_col = 0, comment = '#')
+    grid_intensity.columns = grid_intensity.columns.astype(int)
+    vehicle_efficiency.columns = vehicle_efficiency.columns.astype(int)
+    return grid_intensity, vehicle_efficiency
+
+
+def interpolate(curves, years):
+    '''
+    This function interpolates curves to the given years
+
+    Inputs:
+        curves - dataframe with one row per curve and the years it has values for as columns
+        years - list or array of years
+
+    Outputs:
+        curves x years array (years outside the curves take the first or last value)
+    '''
+    known = curves.columns.to_numpy(dtype=float)
+    values = curves.to_numpy(dtype=float)
+    years = np.clip(np.asarray(years, dtype=float), known[0], known[-1])
+
+    # The same interpolation weights apply to every curve, so all curves are interpolated at once
+    right = np.clip(np.searchsorted(known, years, side='right'), 1, len(known) - 1)
+    left = right - 1
+    weight = (years - known[left]) / (known[right] - known[left])
+    return values[:, left] * (1 - weight) + values[:, right] * weight
+
+
+def factors_by_year(emission_factors, modes, grid_intensity, vehicle_efficiency, years):
+    '''
+    This function builds the emission factors for every grid pathway, year and mode
+
+    Inputs:
+        emission_factors - the emissions factors for each mode (how much CO2-e is emitted for each km travelled)
+        modes - list of modes, in the order of the last axis of the result
+        grid_intensity, vehicle_efficiency - curves from load_curves
+        years - list or array of years
+
+    Outputs:
+        pathways x years x modes array of emission factors (kg CO2-e/km)
+    '''
+    grid = interpolate(grid_intensity, years)
+
+    factors = np.empty((len(grid_intensity), len(years), len(modes)))
+    factors[:] = emission_factors.loc['values_2030_scenario', modes].to_numpy(dtype=float)
+
+    electric = [mode for mode in vehicle_efficiency.index if mode in modes]
+    efficiency = interpolate(vehicle_efficiency.loc[electric], years)
+    factors[:, :, [modes.index(mode) for mode in electric]] = grid[:, :, np.newaxis] * efficiency.T[np.newaxis]
+    return factors
+
+
+def prepare(emission_factors, modes, grid_intensity, vehicle_efficiency, years):
+    '''
+    This function builds the grid option of engine.evaluate_batch
+
+    Inputs:
+        see factors_by_year
+
+    Outputs:
+        dictionary of the 'pathways' and 'years', and the pathways x years x modes array of 'factors'
+    '''
+    years = np.asarray(years)
+    return {
+        'pathways': list(grid_intensity.index),
+        'years': years,
+        'factors': factors_by_year(emission_factors, modes, grid_intensity, vehicle_efficiency, years),
+    }
+
+
+def check_current(grid, emission_factors, modes, pathway='current', year=2030, tolerance=1e-9):
+    '''
+    This function compares one pathway's factors for one year with the values_2030_scenario factors
+    of emission_factors.csv
+
+    Inputs:
+        grid - dictionary from prepare (its years have to include year)
+        emission_factors - the emissions factors for each mode
+        modes - list of modes, in the order of the last axis of the factors
+        pathway, year - the factors to compare
+        tolerance - largest relative difference allowed
+
+    Outputs:
+        list of the modes whose factors differ (empty if they all match)
+    '''
+    found = grid['factors'][grid['pathways'].index(pathway), list(grid['years']).index(year)]
+    expected = emission_factors.loc['values_2030_scenario', modes].to_numpy(dtype=float)
+    return [mode for mode, f, e in zip(modes, found, expected) if abs(f - e) > tolerance * abs(e)]
+
+
+def emissions_by_year(vkt, factors, modes, car_emission_change=0):
+    '''
+    This function calculates the emissions by mode for every grid pathway and year
+
+    Inputs:
+        vkt - array of vkt with modes as the last axis (e.g. scenarios x modes)
+        factors - pathways x years x modes array from factors_by_year
+        modes - list of modes, in the order of the last axis of vkt
+        car_emission_change - the % reduction in car emissions per km travelled from 2018 levels
+                              (a single number or one per scenario)
+
+    Outputs:
+        array of emissions with the leading axes of vkt, then pathways x years x modes
+    '''
+    vkt = car_adjusted(vkt, modes, car_emission_change)
+    return vkt[..., np.newaxis, np.newaxis, :] * factors
+
+
+def total_emissions_by_year(vkt, factors, modes, car_emission_change=0):
+    '''
+    This function calculates the total emissions (summed over modes) for every grid pathway and year,
+    without holding the emissions for each mode
+
+    Inputs:
+        see emissions_by_year
+
+    Outputs:
+        array of emissions in Mt CO2-e with the leading axes of vkt, then pathways x years
+    '''
+    vkt = car_adjusted(vkt, modes, car_emission_change)
+    # One matrix product for all pathways and years
+    totals = vkt @ factors.reshape(-1, factors.shape[-1]).T
+    return totals.reshape(vkt.shape[:-1] + factors.shape[:2]) / (10**9)
+
+
+def car_adjusted(vkt, modes, car_emission_change):
+    '''
+    Returns a copy of vkt with the petrol and diesel (fuelled) car vkt scaled by the car emissions change, so
+    multiplying by the emission factors gives the same emissions as calculate_emissions
+    '''
+    vkt = np.array(vkt, dtype=float)
+    fuelled_cars = mode_registry.indices(modes, mode_registry.electrification('private')[0])
+    vkt[..., fuelled_cars] *= (1 - np.asarray(car_emission_change, dtype=float))[..., np.newaxis]
+    return vkt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Emissions of a scenario for every grid pathway and year')
+    parser.add_argument('--scenario', type=json.loads, default={}, help='JSON of lever settings (others take their default)')
+    parser.add_argument('--years', type=int, nargs='+', default=list(range(2020, 2051, 5)), help='years to show')
+    args = parser.parse_args(argv)
+
+    import app
+    import engine
+
+    modes = list(app.master_base_numbers.columns)
+    curves = load_curves()
+    grid = prepare(app.emission_factors, modes, *curves, sorted(set(args.years) | {2030}))
+    mismatched = check_current(grid, app.emission_factors, modes)
+    if mismatched:
+        raise SystemExit('The current pathway does not give the emission_factors.csv factors in 2030 for: {}'.format(', '.join(mismatched)))
+
+    results = engine.evaluate_batch(app.numbers, app.master_base_numbers, app.emission_factors, app.pt_effects_vkt, app.pt_effects_pkt,
+                                    engine.make_batch([args.scenario], list(app.pt_details.index)), od_effects = app.od_effects, grid = grid)
+    table = pd.DataFrame(results['emissions_by_year'][0], index = grid['pathways'], columns = grid['years'])[args.years]
+    print('Emissions in Mt CO2-e from the 2030 scenario vkt (placeholder curves, see grid_intensity.py)')
+    print(table.to_string(float_format = '{:,.3f}'.format))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+'''
+Timing hooks for the dashboard callback.
+
+update_graph records how long each of its stages takes (each scenario function, the car count
+maths and building the figures). The timings are kept as latency histograms per stage and served
+in the Prometheus text format on /metrics. Optionally, the stages for each callback request are
+added to the response as a Server-Timing header, so they show up in the browser dev tools.
+'''
+import bisect
+import threading
+import time
+
+from flask import Response, request
+
+
+# Histogram bucket upper bounds, in seconds
+buckets = [0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5]
+
+callback_path = '_dash-update-component'
+
+_lock = threading.Lock()
+_histograms = {}
+_request_timings = threading.local()
+
+
+def observe(stage, seconds):
+    '''
+    This function records one timing for a stage
+
+    Inputs:
+        stage - name of the stage
+        seconds - time taken
+    '''
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = {'counts': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+        histogram['counts'][bisect.bisect_left(buckets, seconds)] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+    # Breakdown for the current request (only set while a request is being handled)
+    stages = getattr(_request_timings, 'stages', None)
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0) + seconds
+
+
+class LapTimer:
+    '''
+    Records the time since the previous lap (or since the timer was made) against a stage name,
+    so a function can be timed stage by stage with one line after each stage
+    '''
+    def __init__(self):
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        observe(stage, now - self.last)
+        self.last = now
+
+
+def timed(stage):
+    '''
+    Decorator which records the total time of each call to a function against a stage name
+    '''
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(stage, time.perf_counter() - start)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        wrapper.__wrapped__ = function
+        return wrapper
+    return decorator
+
+
+def render_metrics():
+    '''
+    Returns the histograms in the Prometheus text format
+    '''
+    with _lock:
+        histograms = {stage: dict(h, counts=list(h['counts'])) for stage, h in _histograms.items()}
+
+    lines = [
+        '# HELP transport_emissions_stage_seconds Time spent in each stage of the dashboard callback',
+        '# TYPE transport_emissions_stage_seconds histogram',
+    ]
+    for stage in sorted(histograms):
+        histogram = histograms[stage]
+        cumulative = 0
+        for bound, count in zip(buckets + ['+Inf'], histogram['counts']):
+            cumulative += count
+            lines.append('transport_emissions_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(stage, bound, cumulative))
+        lines.append('transport_emissions_stage_seconds_sum{{stage="{}"}} {}'.format(stage, histogram['sum']))
+        lines.append('transport_emissions_stage_seconds_count{{stage="{}"}} {}'.format(stage, histogram['count']))
+    return '\n'.join(lines) + '\n'
+
+
+def register(server, timing_header=False):
+    '''
+    This function adds the /metrics route and the per-request timing hooks to the Flask server
+
+    Inputs:
+        server - the Flask server (app.server)
+        timing_header - whether to add a Server-Timing header with the stage breakdown to callback responses
+    '''
+
+    @server.route('/metrics')
+    def metrics():
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    @server.before_request
+    def start_request_timing():
+        _request_timings.stages = {}
+        _request_timings.start = time.perf_counter()
+
+    @server.after_request
+    def finish_request_timing(response):
+        stages = getattr(_request_timings, 'stages', None)
+        if stages is not None and request.path.endswith(callback_path):
+            total = time.perf_counter() - _request_timings.start
+            observe('request', total)
+            # Everything outside update_graph, which is mostly Dash serialising the figures
+            if 'update_graph' in stages:
+                observe('serialisation', total - stages['update_graph'])
+            if timing_header:
+                response.headers['Server-Timing'] = ', '.join(
+                    '{};dur={:.2f}'.format(stage, seconds * 1000) for stage, seconds in stages.items())
+        _request_timings.stages = None
+        return response
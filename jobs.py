@@ -0,0 +1,369 @@
+'''
+Background jobs for long-running analyses (sweeps, Monte Carlo runs, optimisations).
+
+Jobs run in a pool of separate processes, so they never hold up the threads answering the
+dashboard callbacks. Each job has a directory under the jobs directory (JOBS_DIR, default jobs/)
+holding its status.json (state, progress, message and times) and, when it has finished, its
+result.json. Any server process can therefore report on or cancel any job by its id, even one
+started by another worker.
+
+A job is a task from the tasks dictionary run with a dictionary of parameters. Tasks report their
+progress through the function they are given, which is also where a cancelled job stops. Each task
+has a check in parameter_checks which fills in defaults and rejects parameters out of bounds (such
+as more scenarios than a worker can hold), before the job is queued.
+
+A job can have an owner (the dashboard tab that asked for it, by its X-Session-Id header, see
+coalescing.py), and each owner has at most one job unfinished at a time: starting a job cancels the owner's previous one. Finished jobs'
+directories are deleted keep_seconds after they finish, when the next job is started.
+
+Routes added to the server by register:
+    POST /jobs/<task>          start a job (parameters as the JSON body), returns {"id": ...}, or 400
+                               if the parameters are out of bounds. Owned by the X-Session-Id of the
+                               request, and without one the job has no owner
+    GET  /jobs/<id>            status of a job
+    POST /jobs/<id>/cancel     cancel a job
+    GET  /jobs/<id>/result     result of a finished job
+'''
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from flask import jsonify, request
+
+import coalescing
+
+
+states = ['queued', 'running', 'done', 'failed', 'cancelled']
+finished_states = ['done', 'failed', 'cancelled']
+
+
+class Cancelled(Exception):
+    '''
+    Raised inside a task when its job has been cancelled
+    '''
+
+
+def _write_json(path, value):
+    # Write then rename, so readers never see a half written file
+    temporary = path.with_name(path.name + '.tmp')
+    temporary.write_text(json.dumps(value))
+    os.replace(str(temporary), str(path))
+
+
+def _read_json(path):
+    try:
+        return json.loads(path.read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class Progress:
+    '''
+    Passed to a task to report its progress: progress(fraction, message)
+    '''
+    def __init__(self, job_dir, interval=0.25):
+        self.job_dir = Path(job_dir)
+        self.interval = interval
+        self._last = 0
+
+    def __call__(self, fraction, message=''):
+        if (self.job_dir / 'cancel').exists():
+            raise Cancelled()
+        now = time.time()
+        if now - self._last >= self.interval or fraction >= 1:
+            self._last = now
+            status = _read_json(self.job_dir / 'status.json') or {}
+            status.update(state='running', progress=min(max(float(fraction), 0), 1), message=message)
+            _write_json(self.job_dir / 'status.json', status)
+
+
+def _run(task_name, parameters, job_dir):
+    '''
+    Runs one job in a pool process
+    '''
+    job_dir = Path(job_dir)
+    status = _read_json(job_dir / 'status.json')
+    if (job_dir / 'cancel').exists():
+        status.update(state='cancelled', finished=time.time())
+        _write_json(job_dir / 'status.json', status)
+        return
+    status.update(state='running', started=time.time())
+    _write_json(job_dir / 'status.json', status)
+
+    try:
+        result = tasks[task_name](parameters, Progress(job_dir))
+    except Cancelled:
+        status = _read_json(job_dir / 'status.json')
+        status.update(state='cancelled', finished=time.time())
+    except Exception as error:
+        status = _read_json(job_dir / 'status.json')
+        status.update(state='failed', message='{}: {}'.format(type(error).__name__, error), finished=time.time())
+    else:
+        _write_json(job_dir / 'result.json', result)
+        status = _read_json(job_dir / 'status.json')
+        status.update(state='done', progress=1.0, finished=time.time())
+    _write_json(job_dir / 'status.json', status)
+
+
+class JobQueue:
+    '''
+    Queue of jobs run by a pool of worker processes
+    '''
+    def __init__(self, jobs_dir='jobs', max_workers=2, keep_seconds=24 * 3600):
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.max_workers = max_workers
+        self.keep_seconds = keep_seconds
+        self._pool = None
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    @property
+    def pool(self):
+        # Started with the first job, so importing the app (as the workers themselves do) starts no processes.
+        # Worker processes are started fresh (not forked from the threaded server) and reused between jobs
+        with self._lock:
+            # A worker process that dies breaks the whole pool, so start a new one
+            if self._pool is None or getattr(self._pool, '_broken', False):
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def job_dir(self, job_id):
+        # Only ids made by submit, so a request cannot point outside the jobs directory
+        if not isinstance(job_id, str) or not job_id.isalnum():
+            raise KeyError(job_id)
+        return self.jobs_dir / job_id
+
+    def submit(self, task_name, parameters=None, owner=None):
+        '''
+        Starts a job, returning its id
+
+        Inputs:
+            task_name - name of the task in tasks
+            parameters - dictionary of task parameters (raises ValueError if they are out of bounds)
+            owner - optional string naming who asked for the job; their previous unfinished job is cancelled
+        '''
+        if task_name not in tasks:
+            raise KeyError(task_name)
+        parameters = parameter_checks[task_name](parameters or {})
+        owner = hashlib.sha256(owner.encode()).hexdigest()[:16] if owner else None
+        self.tidy(owner)
+
+        job_id = uuid.uuid4().hex
+        job_dir = self.job_dir(job_id)
+        job_dir.mkdir()
+        _write_json(job_dir / 'status.json', {
+            'id': job_id, 'task': task_name, 'parameters': parameters, 'owner': owner,
+            'state': 'queued', 'progress': 0.0, 'message': '', 'submitted': time.time(),
+        })
+        self._futures[job_id] = self.pool.submit(_run, task_name, parameters, str(job_dir))
+        self._futures[job_id].add_done_callback(lambda future, job_id=job_id: self._finished(job_id, future))
+        return job_id
+
+    def _finished(self, job_id, future):
+        self._futures.pop(job_id, None)
+        # The worker process died (or the job was cancelled before it started)
+        status = self.status(job_id)
+        if status is not None and status['state'] not in finished_states:
+            status.update(state='cancelled' if future.cancelled() else 'failed', finished=time.time())
+            if not future.cancelled() and future.exception() is not None:
+                status['message'] = str(future.exception())
+            _write_json(self.job_dir(job_id) / 'status.json', status)
+
+    def status(self, job_id):
+        '''
+        Returns the status of a job (None if there is no such job)
+        '''
+        try:
+            return _read_json(self.job_dir(job_id) / 'status.json')
+        except KeyError:
+            return None
+
+    def result(self, job_id):
+        '''
+        Returns the result of a finished job (None if it has not finished)
+        '''
+        return _read_json(self.job_dir(job_id) / 'result.json')
+
+    def tidy(self, owner=None):
+        '''
+        Cancels the owner's unfinished jobs (if there is an owner), and deletes the directories of jobs
+        that finished more than keep_seconds ago
+        '''
+        now = time.time()
+        for job_dir in self.jobs_dir.iterdir():
+            status = _read_json(job_dir / 'status.json') if job_dir.is_dir() else None
+            if status is None:
+                continue
+            if status['state'] in finished_states:
+                if now - status.get('finished', now) > self.keep_seconds:
+                    shutil.rmtree(str(job_dir), ignore_errors=True)
+            elif owner is not None and status.get('owner') == owner:
+                self.cancel(status['id'])
+
+    def cancel(self, job_id):
+        '''
+        Cancels a job: a queued job never starts, a running one stops when it next reports progress
+        '''
+        job_dir = self.job_dir(job_id)
+        if not job_dir.exists():
+            raise KeyError(job_id)
+        (job_dir / 'cancel').touch()
+        future = self._futures.get(job_id)
+        if future is not None:
+            future.cancel()
+
+
+# Bounds on the sweep parameters. Every scenario's emissions are kept for the percentiles (8 bytes each),
+# and a batch takes about 1 kB per scenario while it is evaluated
+sweep_limits = {
+    'n': (1, 5 * 10**6),
+    'chunk': (1, 10**5),
+}
+
+
+def check_sweep(parameters):
+    '''
+    This function checks the parameters of a sweep job
+
+    Inputs:
+        parameters - dictionary of sweep parameters (see sweep)
+
+    Outputs:
+        the parameters with defaults filled in (raises ValueError if any are not whole numbers or out of bounds)
+    '''
+    try:
+        checked = {
+            'n': int(parameters.get('n', 10**6)),
+            'chunk': int(parameters.get('chunk', 50000)),
+            'seed': int(parameters.get('seed', 0)),
+            'mode_choice': bool(parameters.get('mode_choice', False)),
+        }
+    except (TypeError, ValueError):
+        raise ValueError('n, chunk and seed must be whole numbers')
+    for name, (low, high) in sweep_limits.items():
+        if not low <= checked[name] <= high:
+            raise ValueError('{} must be between {:,} and {:,}'.format(name, low, high))
+    return checked
+
+
+def sweep(parameters, progress):
+    '''
+    Task: evaluates random settings of every control and summarises the 2030 scenario emissions
+
+    Parameters (see check_sweep for the bounds):
+        n - number of scenarios (default 1,000,000)
+        chunk - scenarios per batch (default 50,000)
+        seed - random seed (default 0)
+        mode_choice - use logit mode choice (default False)
+    '''
+    import numpy as np
+    import app
+    import engine
+    import mode_choice
+
+    parameters = check_sweep(parameters)
+    n = parameters['n']
+    chunk = parameters['chunk']
+    seed = parameters['seed']
+    mode_costs = mode_choice.load_costs() if parameters['mode_choice'] else None
+    projects = list(app.pt_details.index)
+
+    totals = []
+    best = None
+    for start in range(0, n, chunk):
+        batch = engine.random_batch(min(chunk, n - start), projects, seed=seed + start)
+        results = engine.evaluate_batch(app.numbers, app.master_base_numbers, app.emission_factors,
+                                        app.pt_effects_vkt, app.pt_effects_pkt, batch, mode_costs, app.od_effects)
+        emissions = engine.total_emissions(results)
+        totals.append(emissions)
+        lowest = int(np.argmin(emissions))
+        if best is None or emissions[lowest] < best['emissions']:
+            best = {'emissions': float(emissions[lowest]), 'levers': {
+                lever: ([project for project, included in zip(projects, batch[lever][lowest]) if included]
+                        if lever == 'pt_included' else float(batch[lever][lowest]))
+                for lever in engine.lever_names}}
+        done = min(start + chunk, n)
+        progress(done / n, '{:,} of {:,} scenarios'.format(done, n))
+
+    totals = np.concatenate(totals)
+    return {
+        'scenarios': n,
+        'emissions': {name: float(value) for name, value in zip(
+            ['min', 'p5', 'median', 'p95', 'max'], np.percentile(totals, [0, 5, 50, 95, 100]))},
+        'best': best,
+    }
+
+
+# Tasks jobs can run, by name
+tasks = {
+    'sweep': sweep,
+}
+
+# Parameter checks for each task (see check_sweep)
+parameter_checks = {
+    'sweep': check_sweep,
+}
+
+
+def from_environment():
+    '''
+    Makes the job queue set up by the JOBS_DIR, JOB_WORKERS and JOB_KEEP_HOURS environment variables
+    '''
+    return JobQueue(os.environ.get('JOBS_DIR', 'jobs'), int(os.environ.get('JOB_WORKERS', 2)),
+                    float(os.environ.get('JOB_KEEP_HOURS', 24)) * 3600)
+
+
+def register(server, queue):
+    '''
+    This function adds the job routes to the Flask server
+
+    Inputs:
+        server - the Flask server (app.server)
+        queue - the JobQueue
+    '''
+
+    @server.route('/jobs/<task_name>', methods=['POST'])
+    def submit_job(task_name):
+        if task_name not in tasks:
+            return jsonify(error='Unknown task {}'.format(task_name)), 404
+        parameters = request.get_json(silent=True) or {}
+        if not isinstance(parameters, dict):
+            return jsonify(error='Parameters must be a JSON object'), 400
+        try:
+            # Owned by the tab rather than the address, which users behind one NAT or proxy share
+            job_id = queue.submit(task_name, parameters, owner=coalescing.current_session())
+        except ValueError as error:
+            return jsonify(error=str(error)), 400
+        return jsonify(id=job_id), 202
+
+    @server.route('/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        status = queue.status(job_id)
+        if status is None:
+            return jsonify(error='No such job'), 404
+        return jsonify(status)
+
+    @server.route('/jobs/<job_id>/cancel', methods=['POST'])
+    def cancel_job(job_id):
+        try:
+            queue.cancel(job_id)
+        except KeyError:
+            return jsonify(error='No such job'), 404
+        return jsonify(queue.status(job_id))
+
+    @server.route('/jobs/<job_id>/result', methods=['GET'])
+    def job_result(job_id):
+        status = queue.status(job_id)
+        if status is None:
+            return jsonify(error='No such job'), 404
+        if status['state'] != 'done':
+            return jsonify(error='Job is {}'.format(status['state'])), 409
+        return jsonify(queue.result(job_id))
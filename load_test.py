@@ -0,0 +1,213 @@
+'''
+Load test for the dashboard callback, simulating many people using the dashboard at once.
+
+Each simulated session loads the page (one callback with the default inputs), then alternates
+between thinking and acting. An action is either a slider drag on car_electrification_included,
+occupancy_included or covid, which sends a quick burst of callbacks as the handle moves, or
+ticking/unticking a PT project in pt_included. Like a browser, a session does not wait for one
+callback to finish before sending the next, but has at most 6 requests in flight.
+
+Usage:
+    python load_test.py --url http://127.0.0.1:8050 --sessions 20 --duration 60
+    python load_test.py --serve-workers 4 --sessions 50     # starts gunicorn with 4 workers first
+'''
+import argparse
+import json
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import engine
+from traffic import CallbackClient, latency_report, print_report
+
+
+slider_levers = ['car_electrification_included', 'occupancy_included', 'covid']
+
+# Most requests a browser has in flight to one host
+browser_connections = 6
+
+
+def find_component(layout, component_id):
+    '''
+    Finds a component in the serialised layout by its id
+    '''
+    if isinstance(layout, dict):
+        props = layout.get('props', {})
+        if props.get('id') == component_id:
+            return props
+        return find_component(props.get('children'), component_id)
+    if isinstance(layout, list):
+        for child in layout:
+            found = find_component(child, component_id)
+            if found is not None:
+                return found
+    return None
+
+
+def pt_project_names(url):
+    '''
+    Reads the PT project options from the served layout
+    '''
+    with urllib.request.urlopen(url.rstrip('/') + '/_dash-layout') as response:
+        checklist = find_component(json.loads(response.read()), 'pt_included')
+    return [option['value'] for option in checklist['options']]
+
+
+def slider_drag(rng, state, lever):
+    '''
+    This function gives the values a slider passes through during one drag
+
+    Inputs:
+        rng - random.Random
+        state - dictionary of the current lever values
+        lever - the slider being dragged
+
+    Outputs:
+        list of the slider values sent, one per callback
+    '''
+    low, high = engine.lever_options[lever]
+    start, target = state[lever], rng.randint(low, high)
+    steps = rng.randint(4, 15)
+    values = []
+    for step in range(1, steps + 1):
+        value = round(start + (target - start) * step / steps)
+        if not values or value != values[-1]:
+            values.append(value)
+    return values
+
+
+class Session:
+    '''
+    One simulated browser session
+    '''
+    def __init__(self, number, client, projects, results, args):
+        self.number = number
+        self.client = client
+        self.projects = projects
+        self.results = results
+        self.args = args
+        self.rng = random.Random(args.seed * 100003 + number)
+        self.state = dict(engine.lever_defaults, pt_included=[])
+        self.headers = {'X-Session-Id': 'load-test-{}'.format(number)}
+        self.pool = ThreadPoolExecutor(max_workers=browser_connections)
+
+    def send(self, action, changed):
+        inputs = [self.state[lever] for lever in engine.lever_names]
+        inputs[engine.lever_names.index('pt_included')] = list(self.state['pt_included'])
+
+        def request():
+            status, seconds = self.client.post(inputs, changed, self.headers)
+            self.results.append((action, status, seconds))
+        self.pool.submit(request)
+
+    def run(self, stop_time):
+        self.send('page_load', None)
+        while time.time() < stop_time:
+            time.sleep(self.rng.expovariate(1 / self.args.think_time))
+            if time.time() >= stop_time:
+                break
+            if self.rng.random() < self.args.checklist_share:
+                project = self.rng.choice(self.projects)
+                if project in self.state['pt_included']:
+                    self.state['pt_included'].remove(project)
+                else:
+                    self.state['pt_included'].append(project)
+                self.send('checklist', engine.lever_names.index('pt_included'))
+            else:
+                lever = self.rng.choice(slider_levers)
+                for value in slider_drag(self.rng, self.state, lever):
+                    self.state[lever] = value
+                    self.send('slider_drag', engine.lever_names.index(lever))
+                    time.sleep(self.args.drag_interval)
+        self.pool.shutdown(wait=True)
+
+
+def run_load_test(args):
+    '''
+    Runs the sessions against args.url and returns the report
+    '''
+    client = CallbackClient(args.url)
+    projects = pt_project_names(args.url)
+    results = []
+
+    start = time.time()
+    stop_time = start + args.duration
+    threads = []
+    for number in range(args.sessions):
+        session = Session(number, client, projects, results, args)
+        thread = threading.Thread(target=session.run, args=(stop_time,))
+        thread.start()
+        threads.append(thread)
+        # Sessions arrive over the ramp-up period rather than all at once
+        time.sleep(args.ramp_up / max(1, args.sessions))
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    report = {'overall': latency_report([(status, seconds) for action, status, seconds in results], elapsed)}
+    for action in ['page_load', 'slider_drag', 'checklist']:
+        report[action] = latency_report([(status, seconds) for kind, status, seconds in results if kind == action], elapsed)
+    report['settings'] = {key: value for key, value in vars(args).items() if key != 'json'}
+    return report
+
+
+def start_server(workers, port):
+    '''
+    Starts the app under gunicorn and waits for it to answer
+    '''
+    if shutil.which('gunicorn') is None:
+        sys.exit('--serve-workers needs gunicorn installed')
+    server = subprocess.Popen([
+        'gunicorn', '--workers', str(workers), '--threads', '1', '--bind', '127.0.0.1:{}'.format(port), 'app:server',
+    ])
+    url = 'http://127.0.0.1:{}'.format(port)
+    for _ in range(120):
+        try:
+            urllib.request.urlopen(url + '/_dash-dependencies', timeout=1).read()
+            return server, url
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    sys.exit('server did not start')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simulate concurrent dashboard sessions against the callback endpoint')
+    parser.add_argument('--url', default='http://127.0.0.1:8050', help='address of the server')
+    parser.add_argument('--sessions', type=int, default=10, help='number of concurrent sessions')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run for')
+    parser.add_argument('--ramp-up', type=float, default=5, help='seconds over which the sessions start')
+    parser.add_argument('--think-time', type=float, default=3, help='mean seconds between actions in a session')
+    parser.add_argument('--drag-interval', type=float, default=0.05, help='seconds between callbacks during a slider drag')
+    parser.add_argument('--checklist-share', type=float, default=0.3, help='share of actions that toggle a PT project')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--serve-workers', type=int, default=0, help='start the app under gunicorn with this many workers')
+    parser.add_argument('--port', type=int, default=8060, help='port for --serve-workers')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args(argv)
+
+    server = None
+    if args.serve_workers:
+        server, args.url = start_server(args.serve_workers, args.port)
+    try:
+        report = run_load_test(args)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    for section in ['overall', 'page_load', 'slider_drag', 'checklist']:
+        print('\n' + section)
+        print_report(report[section])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+'''
+Logit mode choice, as an alternative to shifting pkt in proportion to the 2030 baseline shares.
+
+Each mode has a generalised cost per km (money plus time, from mode_costs.csv), and the share of
+pkt on each mode follows a multinomial logit over those costs:
+
+    share = exp(asc - sensitivity x cost) / sum over modes
+
+The alternative specific constants (asc) are calibrated so the 2030 baseline costs give the 2030
+baseline pkt exactly. The levers then act on the costs and supply rather than on pkt directly:
+
+    PT projects and bus ridership - more PT vehicle km, so shorter waits and more capacity
+    cycling_included              - multiplies the odds of cycling (as the proportional model
+                                    multiplies the cycling pkt)
+
+PT modes run at current_load_factor of their capacity in the 2030 baseline, so each PT vehicle km
+can carry the baseline pkt per vkt / current_load_factor (e.g. 0.6 leaves room for 1 / 0.6 = 1.67
+times the baseline load). New PT modes can carry what their projects were planned to carry. Where
+demand is above capacity, a shadow price is added to the mode's cost until demand fits, so the
+shares and the shadow prices are solved together as a fixed point. The whole batch of scenarios
+is solved in one loop, each scenario dropping out once its shadow prices have converged, and the
+tolerance reached and iterations used are reported for every scenario.
+
+With the current_load_factor in mode_costs.csv no scenario the dashboard allows reaches capacity,
+so the shadow prices stay at 0. fuzz.py's mode_choice check starts PT over capacity to test them.
+'''
+import numpy as np
+import pandas as pd
+
+import mode_registry
+
+
+parameters = {
+    'value_of_time': 20.0, # $ per hour
+    'sensitivity': 1.0, # Utility per $ of generalised cost per km
+    'tolerance': 1e-9, # Largest change in a shadow price ($ per km) counted as converged
+    'max_iterations': 100,
+}
+
+
+def load_costs(path='mode_costs.csv'):
+    '''
+    This function reads the cost of each mode
+
+    Outputs:
+        dataframe with one row per mode of cost_per_km ($), minutes_per_km (in vehicle), wait_minutes
+        (per trip, at 2030 baseline service), trip_km (average trip length) and current_load_factor (PT
+        only: the share of their capacity PT modes run at in the 2030 baseline)
+    '''
+    return pd.read_csv(path, index_col = 0)
+
+
+def generalised_cost(costs, modes, supply_ratio):
+    '''
+    This function calculates the generalised cost per km of each mode
+
+    Inputs:
+        costs - dataframe from load_costs
+        modes - list of modes
+        supply_ratio - array (e.g. scenarios x modes) of PT vehicle km relative to the 2030 baseline;
+                       waits get shorter in proportion
+
+    Outputs:
+        array of $ per km, with the shape of supply_ratio
+    '''
+    costs = costs.reindex(modes)
+    minutes = (
+        costs.minutes_per_km.to_numpy()
+        + costs.wait_minutes.to_numpy() / supply_ratio / costs.trip_km.to_numpy()
+    )
+    return costs.cost_per_km.to_numpy() + minutes * parameters['value_of_time'] / 60
+
+
+def calibrate(baseline_pkt, cost, modes):
+    '''
+    This function works out the alternative specific constants that reproduce the baseline shares
+
+    Inputs:
+        baseline_pkt - 2030 baseline pkt for each mode
+        cost - generalised cost per km of each mode at 2030 baseline service
+        modes - list of modes
+
+    Outputs:
+        array with a constant for each mode. Modes with no baseline pkt (e.g. a new light rail line)
+        take the constant of the busiest mode in their category
+    '''
+    baseline_pkt = np.asarray(baseline_pkt, dtype=float)
+    used = baseline_pkt > 0
+    asc = np.full(len(modes), np.nan)
+    asc[used] = np.log(baseline_pkt[used] / baseline_pkt[used].sum()) + parameters['sensitivity'] * cost[used]
+
+    categories = mode_registry.registry.category.reindex(modes).to_numpy()
+    for m in np.flatnonzero(~used):
+        peers = np.flatnonzero(used & (categories == categories[m]))
+        asc[m] = asc[peers[np.argmax(baseline_pkt[peers])]] if len(peers) > 0 else asc[used].min()
+    return asc
+
+
+def solve(asc, cost, total_pkt, capacity, available):
+    '''
+    This function solves the capacity constrained logit for a batch of scenarios
+
+    Inputs:
+        asc - scenarios x modes array of alternative specific constants
+        cost - scenarios x modes array of generalised costs per km
+        total_pkt - array of the total pkt in each scenario
+        capacity - scenarios x modes array of the most pkt each mode can carry (inf for no limit)
+        available - scenarios x modes boolean array of the modes that can be chosen
+
+    Outputs:
+        pkt - scenarios x modes array
+        report - dictionary of the 'tolerance', and for each scenario the 'iterations' used, whether it
+                 'converged', and the 'residual' (largest shadow price change in the last iteration)
+    '''
+    sensitivity = parameters['sensitivity']
+    n = len(total_pkt)
+    shadow = np.zeros(cost.shape)
+    pkt = np.zeros(cost.shape)
+    iterations = np.zeros(n, dtype=int)
+    residual = np.full(n, np.inf)
+    limited = np.isfinite(capacity) & available
+
+    # Scenarios still being solved
+    active = np.arange(n)
+    for _ in range(parameters['max_iterations']):
+        utility = np.where(available[active], asc[active] - sensitivity * (cost[active] + shadow[active]), -np.inf)
+        utility -= utility.max(axis=1, keepdims=True)
+        weights = np.exp(utility)
+        shares = weights / weights.sum(axis=1, keepdims=True)
+        demand = total_pkt[active, np.newaxis] * shares
+        pkt[active] = demand
+
+        # Newton step on each shadow price towards demand = capacity, never below 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = np.log(demand / capacity[active]) / (sensitivity * (1 - shares))
+        new_shadow = np.where(limited[active], np.maximum(shadow[active] + np.nan_to_num(step), 0), 0)
+
+        change = np.abs(new_shadow - shadow[active]).max(axis=1)
+        shadow[active] = new_shadow
+        iterations[active] += 1
+        residual[active] = change
+
+        active = active[change > parameters['tolerance']]
+        if len(active) == 0:
+            break
+
+    report = {
+        'tolerance': parameters['tolerance'],
+        'iterations': iterations,
+        'converged': residual <= parameters['tolerance'],
+        'residual': residual,
+    }
+    return pkt, report
+
+
+def mode_choice_batch(numbers, base_numbers, costs, vkt, pkt, pt_effects_vkt, pt_effects_pkt, pt_mask, bus_prop_increase, cycling_included):
+    '''
+    This function updates the 2030 scenario pkt and vkt for the PT projects, bus ridership and
+    cycling levers with logit mode choice (in place of pt_projects_apply, bus_ridership_changes
+    and cycling_changes)
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        costs - dataframe from load_costs
+        vkt, pkt - scenarios x modes arrays of the 2030 scenario vkt and pkt
+        pt_effects_vkt, pt_effects_pkt - projects x modes arrays with the effect of each project on each mode
+        pt_mask - scenarios x projects boolean array of included projects
+        bus_prop_increase - array of the % increase in bus service from the 2030 baseline
+        cycling_included - array of the factor the odds of cycling are multiplied by (0 for no change)
+
+    Outputs:
+        updated vkt, pkt, and the solver report (see solve)
+    '''
+    modes = list(base_numbers.columns)
+    pt = np.isin(modes, numbers['pt_modes'])
+    baseline_vkt = base_numbers.loc['vkt_2030_baseline', modes].to_numpy(dtype=float)
+    baseline_pkt = base_numbers.loc['pkt_2030_baseline', modes].to_numpy(dtype=float)
+
+    # PT service: baseline vehicle km, plus the included projects, with more buses for bus_prop_increase
+    bus = modes.index('diesel_bus')
+    added_vkt = pt_mask @ np.where(pt, pt_effects_vkt, 0)
+    added_capacity = pt_mask @ np.where(pt, pt_effects_pkt, 0)
+    supply = baseline_vkt + added_vkt
+    supply[:, bus] += baseline_vkt[bus] * np.where(bus_prop_increase > 0, bus_prop_increase, 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        supply_ratio = np.where(pt & (baseline_vkt > 0), supply / baseline_vkt, 1)
+    available = ~pt | (supply > 0)
+
+    # Capacity: PT modes in use can carry their baseline pkt per vkt / current_load_factor on each
+    # vehicle km, new PT modes what their projects were planned to carry
+    load_factor = costs.current_load_factor.reindex(modes).to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        capacity_per_vkt = np.where(baseline_vkt > 0, baseline_pkt / baseline_vkt / load_factor, np.nan)
+    capacity = np.where(baseline_vkt > 0, supply * capacity_per_vkt, added_capacity)
+    capacity = np.where(pt & ~np.isnan(load_factor), capacity, np.inf)
+
+    asc = calibrate(baseline_pkt, generalised_cost(costs, modes, np.ones(len(modes))), modes)
+    asc = np.tile(asc, (len(pkt), 1))
+    cycling = modes.index('cycling')
+    asc[:, cycling] += np.log(np.where(cycling_included > 0, cycling_included, 1))
+
+    new_pkt, report = solve(asc, generalised_cost(costs, modes, supply_ratio), pkt.sum(axis=1), capacity, available)
+
+    # PT vkt is the service run, private and active vkt follow their pkt
+    private_modes = numbers['private_modes']
+    columns = mode_registry.indices(modes, private_modes)
+    vkt[:, columns] += (new_pkt[:, columns] - pkt[:, columns]) / mode_registry.vkt_per_pkt(private_modes, numbers['car_occupancy'])
+    vkt[:, pt] = supply[:, pt]
+    return vkt, new_pkt, report
@@ -0,0 +1,147 @@
+'''
+Registry of the transport modes in the model.
+
+Each mode is one row of modes.csv:
+
+    mode              - column name used in base_numbers.csv and emission_factors.csv
+    category          - private (cars), active (walking, cycling, ...) or pt (public transport)
+    occupancy         - how the mode's vkt follows its pkt:
+                            car     - vkt = pkt / car occupancy
+                            person  - vkt = pkt (one person per vehicle)
+                            vehicle - vkt is set by the service run, not by ridership (PT)
+    electric_version  - the mode its vehicles become when electrified (blank if none)
+    colour, label     - how the mode is shown on the graphs
+
+The order of the rows is the order of the traces on the graphs. Adding a mode (hybrids, e-bikes,
+ferries...) means adding a row here and a column to base_numbers.csv and emission_factors.csv; the
+scenario calculations pick it up from its category and occupancy rule.
+
+The calculations use the registry as arrays over the modes (see vkt_per_pkt), so they do not need
+a Python branch per mode.
+'''
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+registry_path = Path(__file__).with_name('modes.csv')
+
+categories = ['private', 'active', 'pt']
+occupancy_rules = ['car', 'person', 'vehicle']
+
+
+def load_registry(path=registry_path):
+    '''
+    This function reads the mode registry from a csv file
+
+    Outputs:
+        dataframe with one row per mode (see the module docstring for the columns)
+    '''
+    registry = pd.read_csv(path, index_col = 0, dtype = str, keep_default_na = False)
+    unknown = registry[~registry.category.isin(categories) | ~registry.occupancy.isin(occupancy_rules)]
+    if len(unknown) > 0:
+        raise ValueError('Unknown category or occupancy rule for modes: {}'.format(', '.join(unknown.index)))
+    return registry
+
+
+registry = load_registry()
+
+
+def check_modes(modes):
+    '''
+    Raises a ValueError if the modes (e.g. the base_numbers columns) and the registry do not match
+    '''
+    missing = [mode for mode in modes if mode not in registry.index]
+    unused = [mode for mode in registry.index if mode not in modes]
+    if missing or unused:
+        raise ValueError('Modes not in {}: {}; modes in {} without data: {}'.format(
+            registry_path.name, missing, registry_path.name, unused))
+
+
+def modes_where(**conditions):
+    '''
+    Returns the modes, in registry order, whose columns have the given values
+    (e.g. modes_where(category='pt') or modes_where(occupancy='car'))
+    '''
+    selected = np.ones(len(registry), dtype=bool)
+    for column, value in conditions.items():
+        selected &= (registry[column] == value).to_numpy()
+    return list(registry.index[selected])
+
+
+def private_modes():
+    '''
+    Returns the private and active modes, which pkt is shifted away from when other modes grow
+    '''
+    return [mode for mode in registry.index if registry.category[mode] in ['private', 'active']]
+
+
+def car_modes():
+    '''
+    Returns the modes in the light fleet (vkt = pkt / car occupancy)
+    '''
+    return modes_where(occupancy='car')
+
+
+def person_modes():
+    '''
+    Returns the modes with one person per vehicle (vkt = pkt)
+    '''
+    return modes_where(occupancy='person')
+
+
+def electrification(category):
+    '''
+    This function lists which modes of a category are replaced by which when electrified
+
+    Outputs:
+        two lists: the modes with an electric version, and their electric versions
+    '''
+    modes = [mode for mode in modes_where(category=category) if registry.electric_version[mode] != '']
+    return modes, [registry.electric_version[mode] for mode in modes]
+
+
+def electrify(values, modes, category, prop):
+    '''
+    This function moves a proportion of the pkt or vkt of a category's modes to their electric versions
+
+    Inputs:
+        values - array of pkt or vkt with modes as the last axis (e.g. scenarios x modes)
+        modes - list of modes, in the order of the last axis of values
+        category - category of modes to electrify (see electrification)
+        prop - proportion to move: a single number, or one per row of values
+
+    Outputs:
+        updated values
+    '''
+    fuelled, electric = electrification(category)
+    fuelled = indices(modes, fuelled)
+    shift = values[..., fuelled] * np.asarray(prop)[..., np.newaxis]
+    values[..., fuelled] += - shift
+    # Several modes can have the same electric version, so add their shifts up
+    np.add.at(np.moveaxis(values, -1, 0), indices(modes, electric), np.moveaxis(shift, -1, 0))
+    return values
+
+
+def vkt_per_pkt(modes, car_occupancy):
+    '''
+    This function gives the divisor turning a change in pkt into a change in vkt, for each mode
+
+    Inputs:
+        modes - list of modes
+        car_occupancy - average number of people per car
+
+    Outputs:
+        array with car occupancy for car modes, 1 for person modes and inf for vehicle modes
+        (so a change in pkt divided by it gives no change in PT vkt)
+    '''
+    rules = registry.occupancy.reindex(modes).to_numpy()
+    return np.select([rules == 'car', rules == 'person'], [car_occupancy, 1.0], default=np.inf)
+
+
+def indices(modes, selected):
+    '''
+    Returns the positions of the selected modes in the list of modes, as an array
+    '''
+    return np.array([modes.index(mode) for mode in selected], dtype=int)
@@ -0,0 +1,297 @@
+'''
+Zone to zone (origin-destination) demand, so PT projects shift trips where their corridors run.
+
+Without OD data the model treats the region as one set of vkt and pkt, so every PT project takes its
+riders from the private modes in the regional mix. With an OD directory (optional), each project
+is tagged with the OD pairs it serves, and takes its riders from the private modes of those pairs:
+
+    zones.csv           - zone (id), name
+    meta.json           - {"modes": [...]}, the modes of the pkt columns
+    pairs.npy           - pairs x 2 int32 array of origin and destination zone positions in zones.csv,
+                          sorted by origin then destination
+    pkt.npy             - pairs x modes array of annual 2030 baseline pkt for each pair (float64)
+    project_pairs.csv   - proj_name, origin, destination (zone ids): the pairs each project serves
+
+Only pairs with some travel are stored, so an OD matrix of thousands of zones keeps to the pairs
+that have trips. pairs.npy and pkt.npy are memory-mapped, and only the rows of the pairs that
+projects serve are read into memory. The pkt of each mode is scaled so the pairs add up to the
+regional 2030 baseline in base_numbers.csv.
+
+A project's riders are spread over its pairs in proportion to their private (and active) pkt.
+Each pair loses those riders from its own private modes, in proportion to its own mode mix, and
+cannot lose more pkt than it has, so projects serving the same pairs compete for the same trips.
+Pairs served by the same projects always lose the same proportion of their pkt, so the scenarios are
+worked out over these groups of pairs rather than pair by pair.
+Projects with no pairs in project_pairs.csv keep the regional effects from pt_proj_effects. The
+other controls still act on the regional totals.
+'''
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import mode_registry
+
+
+# Largest scenarios x groups of pairs array held at once (float64)
+max_chunk_elements = 2**22
+
+
+def save_od(directory, zones, pairs, pkt, modes, project_pairs=None):
+    '''
+    This function writes OD demand in the format load_od reads
+
+    Inputs:
+        directory - directory to write to
+        zones - dataframe of zones, indexed by zone id, with a name column
+        pairs - pairs x 2 array of origin and destination zone positions
+        pkt - pairs x modes array of annual 2030 baseline pkt
+        modes - list of modes, in the column order of pkt
+        project_pairs - optional dataframe of proj_name, origin and destination zone ids
+    '''
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    pairs = np.asarray(pairs, dtype=np.int32)
+    order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+
+    zones.to_csv(directory / 'zones.csv', index_label = 'zone')
+    (directory / 'meta.json').write_text(json.dumps({'modes': list(modes)}))
+    np.save(directory / 'pairs.npy', pairs[order])
+    np.save(directory / 'pkt.npy', np.asarray(pkt, dtype=float)[order])
+    if project_pairs is not None:
+        project_pairs.to_csv(directory / 'project_pairs.csv', index = False)
+
+
+def load_od(directory, projects):
+    '''
+    This function reads OD demand (see the module docstring)
+
+    Inputs:
+        directory - directory of OD files
+        projects - list of PT projects, in pt_details order
+
+    Outputs:
+        dictionary of the 'zones' dataframe, the 'modes', the memory-mapped 'pairs' and 'pkt' arrays,
+        and for each row of project_pairs.csv the position of its project ('tag_project') and of its
+        pair ('tag_pair'), or None if the directory does not exist
+    '''
+    directory = Path(directory)
+    if not directory.exists():
+        return None
+    zones = pd.read_csv(directory / 'zones.csv', index_col = 0, dtype = {'zone': str})
+    modes = json.loads((directory / 'meta.json').read_text())['modes']
+    pairs = np.load(directory / 'pairs.npy', mmap_mode = 'r')
+    pkt = np.load(directory / 'pkt.npy', mmap_mode = 'r')
+    if pkt.shape != (len(pairs), len(modes)):
+        raise ValueError('pkt.npy should be {} pairs x {} modes, not {}'.format(len(pairs), len(modes), pkt.shape))
+    missing = [mode for mode in mode_registry.private_modes() if mode not in modes]
+    if missing:
+        raise ValueError('OD pkt has no columns for modes: {}'.format(', '.join(missing)))
+
+    # Pairs are found by their position in the sorted list of origin x zones + destination
+    keys = pairs[:, 0].astype(np.int64) * len(zones) + pairs[:, 1]
+    if np.any(np.diff(keys) <= 0):
+        raise ValueError('pairs.npy should be sorted by origin then destination, with no repeats')
+
+    path = directory / 'project_pairs.csv'
+    tags = pd.read_csv(path, dtype = str) if path.exists() else pd.DataFrame(columns = ['proj_name', 'origin', 'destination'])
+    unknown = sorted(set(tags.proj_name) - set(projects))
+    if unknown:
+        raise ValueError('OD pairs for projects not in pt_details: {}'.format(', '.join(unknown)))
+    zone_index = pd.Series(np.arange(len(zones)), index = zones.index)
+    origin = zone_index.reindex(tags.origin).to_numpy()
+    destination = zone_index.reindex(tags.destination).to_numpy()
+    if np.isnan(origin.astype(float)).any() or np.isnan(destination.astype(float)).any():
+        raise ValueError('project_pairs.csv has zones not in zones.csv')
+    tag_keys = origin.astype(np.int64) * len(zones) + destination.astype(np.int64)
+    tag_pair = np.searchsorted(keys, tag_keys)
+    if np.any(tag_pair >= len(keys)) or np.any(keys[np.minimum(tag_pair, len(keys) - 1)] != tag_keys):
+        raise ValueError('project_pairs.csv has OD pairs with no travel in pairs.npy')
+
+    return {
+        'zones': zones,
+        'modes': modes,
+        'pairs': pairs,
+        'pkt': pkt,
+        'tag_project': pd.Index(projects).get_indexer(tags.proj_name),
+        'tag_pair': tag_pair,
+    }
+
+
+def column_totals(pkt, chunk = 2**20):
+    '''
+    Returns the total of each column of a (memory-mapped) array, reading chunk rows at a time
+    '''
+    totals = np.zeros(pkt.shape[1])
+    for start in range(0, len(pkt), chunk):
+        totals += np.asarray(pkt[start:start + chunk], dtype=float).sum(axis=0)
+    return totals
+
+
+def prepare(numbers, base_numbers, od, pt_effects_vkt, pt_effects_pkt):
+    '''
+    This function works out how the PT projects act on the OD pairs they serve
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        od - OD demand from load_od
+        pt_effects_vkt, pt_effects_pkt - dataframes with the effect of each project on each mode (from pt_proj_effects)
+
+    Outputs:
+        od_effects - dictionary for pt_projects_apply_od and pair_changes, including:
+            served_pairs - served pairs x 2 array of origin and destination zone positions
+            served_total - private pkt of each served pair (scaled to the regional 2030 baseline)
+            pair_group - group of each served pair; pairs served by the same projects are in the same group
+            group_pkt - groups x private modes array of the pkt of each group's pairs
+            group_projects - groups x projects boolean array of the projects serving each group
+            rate - riders each project looks for per pkt in the pairs it serves
+            tagged - boolean array of the projects with OD pairs
+            primary - projects x modes array, 1 for each project's primary mode
+            pt_vkt - projects x modes array of each project's service vkt
+            regional_vkt, regional_pkt - projects x modes arrays of the regional effects (for projects without pairs)
+    '''
+    modes = list(base_numbers.columns)
+    private_modes = numbers['private_modes']
+    private = mode_registry.indices(modes, private_modes)
+    od_private = mode_registry.indices(od['modes'], private_modes)
+
+    # Scale the pairs to the regional 2030 baseline, mode by mode
+    totals = column_totals(od['pkt'])[od_private]
+    baseline = base_numbers.loc['pkt_2030_baseline', private_modes].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(totals > 0, baseline / totals, 0)
+
+    served, tag_served = np.unique(od['tag_pair'], return_inverse=True)
+    served_pkt = np.asarray(od['pkt'][served][:, od_private], dtype=float) * scale
+    served_total = served_pkt.sum(axis=1)
+
+    regional_pkt = pt_effects_pkt[modes].to_numpy(dtype=float)
+    regional_vkt = pt_effects_vkt[modes].to_numpy(dtype=float)
+    pt_pkt = regional_pkt.copy()
+    pt_pkt[:, private] = 0
+    pt_vkt = regional_vkt.copy()
+    pt_vkt[:, private] = 0
+
+    # Riders are spread over a project's pairs by their private pkt, so every pair a project serves
+    # gives it the same proportion of its pkt. Pairs served by the same projects therefore always
+    # lose the same proportion, and are worked out together as one group
+    serves = np.zeros((len(served), len(regional_pkt)), dtype=bool)
+    serves[tag_served, od['tag_project']] = True
+    group_projects, pair_group = np.unique(serves, axis=0, return_inverse=True)
+    pair_group = pair_group.ravel()
+    group_pkt = np.zeros((len(group_projects), len(private)))
+    np.add.at(group_pkt, pair_group, served_pkt)
+
+    project_pkt = serves.T.astype(float) @ served_total
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(project_pkt > 0, pt_pkt.sum(axis=1) / project_pkt, 0)
+
+    return {
+        'modes': modes,
+        'private': private,
+        'vkt_per_pkt': mode_registry.vkt_per_pkt(private_modes, numbers['car_occupancy']),
+        'zones': od['zones'],
+        'served_pairs': np.asarray(od['pairs'][served]),
+        'served_total': served_total,
+        'served_mix': np.nan_to_num(served_pkt / served_total[:, np.newaxis]) if len(served) else served_pkt,
+        'pair_group': pair_group,
+        'group_pkt': group_pkt,
+        'group_projects': group_projects,
+        'rate': rate,
+        'tagged': group_projects.any(axis=0),
+        'primary': np.where(pt_pkt > 0, 1.0, 0.0),
+        'pt_vkt': pt_vkt,
+        'regional_vkt': regional_vkt,
+        'regional_pkt': regional_pkt,
+    }
+
+
+def shift_by_group(od_effects, pt_mask):
+    '''
+    This function works out the proportion of each group's private pkt moved to the included projects
+
+    Inputs:
+        od_effects - dictionary from prepare
+        pt_mask - scenarios x projects array of included projects (with OD pairs)
+
+    Outputs:
+        shifted - scenarios x groups array of the proportion of private pkt moved to PT (at most 1)
+        taken - scenarios x groups array of the proportion of the riders looked for that were found
+    '''
+    wanted = pt_mask @ (od_effects['group_projects'] * od_effects['rate']).T
+    shifted = np.minimum(wanted, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        taken = np.where(wanted > 0, shifted / wanted, 1)
+    return shifted, taken
+
+
+def pt_projects_apply_od(vkt, pkt, od_effects, pt_mask):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on the inclusion of different PT projects,
+    with mode shift worked out for each OD pair (in place of pt_projects_apply_batch)
+
+    Inputs:
+        vkt, pkt - scenarios x modes arrays of the 2030 scenario vkt and pkt
+        od_effects - dictionary from prepare
+        pt_mask - scenarios x projects boolean array of included projects
+
+    Outputs:
+        updated vkt, pkt
+    '''
+    pt_mask = np.asarray(pt_mask, dtype=float)
+    tagged = od_effects['tagged']
+    private = od_effects['private']
+
+    # Projects without OD pairs act on the regional totals
+    untagged = pt_mask * ~tagged
+    vkt += untagged @ od_effects['regional_vkt']
+    pkt += untagged @ od_effects['regional_pkt']
+
+    # Projects with OD pairs, a chunk of scenarios at a time
+    tagged_mask = pt_mask * tagged
+    vkt += tagged_mask @ od_effects['pt_vkt']
+    group_projects_pkt = od_effects['group_projects'] * od_effects['group_pkt'].sum(axis=1, keepdims=True)
+    chunk = max(1, max_chunk_elements // max(len(group_projects_pkt), 1))
+    for start in range(0, len(pt_mask), chunk):
+        rows = slice(start, start + chunk)
+        shifted, taken = shift_by_group(od_effects, tagged_mask[rows])
+        riders = tagged_mask[rows] * od_effects['rate'] * (taken @ group_projects_pkt)
+        pkt[rows] += riders @ od_effects['primary']
+        private_change = - shifted @ od_effects['group_pkt']
+        pkt[rows, private] += private_change
+        vkt[rows, private] += private_change / od_effects['vkt_per_pkt']
+    return vkt, pkt
+
+
+def pair_changes(od_effects, emission_factors, pt_included, projects):
+    '''
+    This function gives the change in private pkt, vkt and emissions in each served OD pair for one scenario
+
+    Inputs:
+        od_effects - dictionary from prepare
+        emission_factors - the emissions factors for each mode
+        pt_included - list of included PT projects
+        projects - list of PT projects, in pt_details order
+
+    Outputs:
+        dataframe with one row per served pair: origin, destination, pkt_shifted, the proportion of the
+        riders looked for that were found (taken), and the total change in vkt and emissions (kg CO2-e)
+    '''
+    pt_mask = np.isin(projects, pt_included) & od_effects['tagged']
+    shifted, taken = shift_by_group(od_effects, pt_mask[np.newaxis, :].astype(float))
+    pkt_shifted = shifted[0, od_effects['pair_group']] * od_effects['served_total']
+    vkt_change = - pkt_shifted[:, np.newaxis] * od_effects['served_mix'] / od_effects['vkt_per_pkt']
+
+    private_modes = [od_effects['modes'][i] for i in od_effects['private']]
+    factors = emission_factors.loc['values_2030_scenario', private_modes].to_numpy(dtype=float)
+    zone_ids = od_effects['zones'].index
+    return pd.DataFrame({
+        'origin': zone_ids[od_effects['served_pairs'][:, 0]],
+        'destination': zone_ids[od_effects['served_pairs'][:, 1]],
+        'pkt_shifted': pkt_shifted,
+        'taken': taken[0, od_effects['pair_group']],
+        'vkt_change': vkt_change.sum(axis=1),
+        'emissions_change': (vkt_change * factors).sum(axis=1),
+    })
@@ -0,0 +1,345 @@
+'''
+Reference versions of the scenario functions, kept as the oracle the faster paths are checked against.
+
+These are the pandas scenario functions of app.py as they were before the fast paths were added
+(the vectorised engine, the sweeps, the result cache and the static export), written out one
+mode at a time. The one change since is the model fix that makes the bus ridership, cycling and car
+occupancy changes write to base_numbers (.loc[row, mode] rather than .loc[row][mode], which wrote
+to a copy) and gives cycling vkt its own change (rather than the change of the mode before it in
+the loop). They are deliberately slow and must not be optimised: fuzz.py runs random
+scenarios on perturbed inputs through them and through every fast path, and fails if any result
+differs. A change to the model itself (rather than to how fast it runs) has to be made here too.
+
+The mode lists, occupancy rules and constants are written out here as they were, rather than read
+from mode_registry or app.py, so an edit to modes.csv or to the shared helpers moves the fast paths
+and not the reference, and fuzz.py catches it. Adding a mode means adding it here too.
+'''
+import numpy as np
+import pandas as pd
+
+
+# The modes as they were before the mode registry
+private_modes = ['passenger_light', 'electric_light', 'walking', 'cycling']
+pt_modes = ['diesel_bus', 'electric_bus', 'heavy_rail', 'light_rail']
+all_modes = ['passenger_light', 'electric_light', 'walking', 'cycling', 'diesel_bus', 'electric_bus', 'heavy_rail', 'light_rail']
+car_modes = ['passenger_light', 'electric_light']
+person_modes = ['walking', 'cycling']
+
+
+def data_initialisation(base_numbers):
+    '''
+    This function produces the basic input values for the reference functions
+
+    Inputs:
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+
+    Outputs:
+        numbers - dictionary with key values for calculations
+    '''
+    # What proportion of pkt are from each mode (for 2030 baseline)
+    mode_sum_pkt = 0
+    mode_pkt_no_bike = 0
+    for mode in private_modes:
+        mode_sum_pkt += base_numbers.loc['pkt_2030_baseline', mode]
+        if mode != 'cycling':
+            mode_pkt_no_bike += base_numbers.loc['pkt_2030_baseline', mode]
+
+    return {
+        'pkt_annualisation': 2250.0, # Annualisation factor: one peak hour to annual ridership distances
+        'vkt_annualisation': 332.0,  # Annualisation factor: one weekday to annual vehicle distances
+        'car_occupancy': 1.58, # Average number of pkt per vkt for light fleet in NZ
+        'mode_sum_pkt': mode_sum_pkt,
+        'mode_pkt_no_bike': mode_pkt_no_bike,
+        'bus_lifespan': 15,
+        'private_modes': private_modes,
+        'pt_modes': pt_modes,
+        '2018_car_ownership': 1261016,
+        'all_modes': all_modes,
+    }
+
+
+def vkt_per_pkt(mode, car_occupancy):
+    '''
+    Returns the divisor turning a change in pkt into a change in vkt for a mode (inf for PT, whose vkt does not change)
+    '''
+    if mode in car_modes:
+        return car_occupancy
+    if mode in person_modes:
+        return 1.0
+    return np.inf
+
+
+def pt_proj_effects(numbers, base_numbers, pt_details):
+    '''
+    This function returns dataframes which have the effect of different PT projects on the vkt
+    and pkt of different modes.
+
+    INPUTS:
+    numbers - dictionary containing key numbers
+    pt_details - dataframe: containing frequency, capacity and distance data for various PT projects
+    base_numbers - dataframe: containing the PKT and VKT data for 2018, and for the 2030 baseline
+
+    OUTPUTS:
+    pt_effects_vkt - dataframe with the effect of each project on the pkt and vkt for each mode
+    pt_effects_pkt - dataframe with the effect of each project on the pkt and vkt for each mode
+    '''
+    modes = list(base_numbers.keys())
+    pt_effects_pkt = pd.DataFrame(0.0, index = pt_details.index, columns = modes)
+    pt_effects_vkt = pd.DataFrame(0.0, index = pt_details.index, columns = modes)
+
+    for project in pt_details.index:
+        primary_mode = pt_details.primary_mode[project]
+
+        # Calculating the PKT by primary mode for each project
+        pt_effects_pkt.loc[project, primary_mode] = (
+            (60 / pt_details.peak_freq[project]) # Number of buses per hour in peak
+            * pt_details.distance[project] # Distance covered by this PT project
+            * numbers['pkt_annualisation'] # Passenger annualisation factor: am peak to annual
+            * pt_details.vehicle_capacity[project] # Peak vehicle capacity
+            * 2 # Both directions
+            * 2 # For both AM peak hours
+        )
+
+        # Calculating the VKT by primary mode for each project
+        pt_effects_vkt.loc[project, primary_mode] = (
+            ((60/pt_details.peak_freq[project]) # Number of buses per hour in peak
+            * pt_details.num_peak_hrs[project] # Number of hours considered peak
+            + (60/pt_details.off_peak_freq[project]) # Number of buses per hour in off-peak times
+            * (pt_details.num_hours[project]-pt_details.num_peak_hrs[project])) # Number of hours considered off-peak
+            * pt_details.distance[project] #  Distance covered by this PT project
+            * numbers['vkt_annualisation'] # Vehicle annualisation factor: day to year
+            * 2 # For both directions
+        )
+
+        for mode in private_modes:
+            # Calculating the effect on PKT for private/non-primary modes
+            pt_effects_pkt.loc[project, mode] = (
+                - base_numbers.loc['pkt_2030_baseline', mode] / numbers['mode_sum_pkt'] # Proportion of pkt by this mode in 2030
+                * pt_effects_pkt.loc[project, primary_mode] # pkt by primary mode
+            )
+
+            # Calculating the effect on VKT for private/non-primary modes
+            pt_effects_vkt.loc[project, mode] = pt_effects_pkt.loc[project, mode] / vkt_per_pkt(mode, numbers['car_occupancy'])
+
+    return pt_effects_vkt, pt_effects_pkt
+
+
+def pt_projects_apply(base_numbers, pt_effects_vkt, pt_effects_pkt, pt_included):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on the inclusion of different PT projects
+
+    Inputs:
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        pt_effects_vkt - dataframe with the effect of each project on the pkt and vkt for each mode
+        pt_effects_pkt - dataframe with the effect of each project on the pkt and vkt for each mode
+        pt_included - list of included PT projects
+
+    Outputs:
+        updated base_numbers
+    '''
+    if pt_included != []:
+        base_numbers.loc['vkt_2030_scenario'] += pt_effects_vkt.loc[pt_included].sum()
+        base_numbers.loc['pkt_2030_scenario'] += pt_effects_pkt.loc[pt_included].sum()
+
+    return base_numbers
+
+
+def bus_ridership_changes(numbers, base_numbers, bus_prop_increase):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on an increase in bus ridership
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        bus_prop_increase - the % increase in pkt by bus from the 2030 baseline (0.4 would mean a 40% increase in pkt)
+
+    Outputs:
+        updated base_numbers
+    '''
+    if bus_prop_increase > 0:
+
+        # Work out how many pkt will be shifted to bus
+        bus_change = base_numbers.loc['pkt_2030_baseline', 'diesel_bus'] * bus_prop_increase
+
+        # Apply change
+        base_numbers.loc['pkt_2030_scenario', 'diesel_bus'] += bus_change
+
+        for mode in private_modes:
+            effect = (
+                - base_numbers.loc['pkt_2030_baseline', mode]
+                / numbers['mode_sum_pkt'] # Proportion of pkt by this mode in 2030 baseline
+                * bus_change
+            )
+
+            base_numbers.loc['pkt_2030_scenario', mode] += effect
+            base_numbers.loc['vkt_2030_scenario', mode] += effect / vkt_per_pkt(mode, numbers['car_occupancy'])
+
+    return base_numbers
+
+
+def cycling_changes(numbers, base_numbers, cycling_included):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on an increase in cycling mode share
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        cycling_included - the final % mode share by bike
+
+    Outputs:
+        updated base_numbers
+    '''
+    if cycling_included > 0:
+        # Calculate how much pkt will change based on increase
+        cycling_included = cycling_included - 1
+        cycling_change = base_numbers.loc['pkt_2030_baseline', 'cycling'] * cycling_included
+
+        # Apply change
+        base_numbers.loc['pkt_2030_scenario', 'cycling'] += cycling_change
+
+        for mode in private_modes:
+            if mode != 'cycling':
+                effect = (
+                    - base_numbers.loc['pkt_2030_baseline', mode]
+                    / numbers['mode_pkt_no_bike'] # Proportion of pkt by this mode in 2030 baseline
+                    * cycling_change
+                )
+
+                base_numbers.loc['pkt_2030_scenario', mode] += effect
+            else:
+                effect = cycling_change # Cycling vkt follows its own pkt change
+
+            base_numbers.loc['vkt_2030_scenario', mode] += effect / vkt_per_pkt(mode, numbers['car_occupancy'])
+
+    return base_numbers
+
+
+def bus_electric(numbers, base_numbers, bus_electrification_included):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on partial electrification of the bus fleet
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        bus_electrification_included - the year bus electrification will begin (should be 0 for no electrification)
+
+    Outputs:
+        updated base_numbers
+    '''
+    if bus_electrification_included > 2019:
+        # Calculate what % of the bus lifespan will be covered
+        prop = (2030-bus_electrification_included)/numbers['bus_lifespan']
+        # Replace that % of buses with electric buses for pkt and vkt
+        for row in ['vkt_2030_scenario', 'pkt_2030_scenario']:
+            shift = base_numbers.loc[row, 'diesel_bus']*prop
+            base_numbers.loc[row, 'diesel_bus'] += - shift
+            base_numbers.loc[row, 'electric_bus'] += shift
+
+    return base_numbers
+
+
+def car_electric(base_numbers, car_electrification_included):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on partial electrification of the light fleet
+
+    Inputs:
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        car_electrification_included - the proportion of the fleet to electrify
+
+    Outputs:
+        updated base_numbers
+    '''
+    if car_electrification_included > 0:
+        # Replace that % of cars with electric cars for pkt and vkt
+        for row in ['vkt_2030_scenario', 'pkt_2030_scenario']:
+            shift = base_numbers.loc[row, 'passenger_light']*car_electrification_included
+            base_numbers.loc[row, 'passenger_light'] += - shift
+            base_numbers.loc[row, 'electric_light'] += shift
+
+    return base_numbers
+
+
+def covid_trips(base_numbers, covid, numbers):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on trips not taken
+
+    Inputs:
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        covid - the % reduction in trips taken
+        numbers - dictionary with key values for calculations
+
+    Outputs:
+        updated base_numbers
+    '''
+    for mode in all_modes:
+        base_numbers.loc['pkt_2030_scenario', mode] = (1-(covid/100))*base_numbers.loc['pkt_2030_scenario', mode]
+        if mode in ['cycling', 'walking']:
+            base_numbers.loc['vkt_2030_scenario', mode] = base_numbers.loc['pkt_2030_scenario', mode]
+        # Only the electric car vkt is reset (the list named a 'light_fleet' mode, which does not exist). Every
+        # value the occupancy slider allows makes car_occupancy reset both car modes afterwards
+        elif mode in ['light_fleet', 'electric_light']:
+            base_numbers.loc['vkt_2030_scenario', mode] = base_numbers.loc['pkt_2030_scenario', mode]/numbers['car_occupancy']
+
+    return base_numbers
+
+
+def car_occupancy(base_numbers, occupancy_included):
+    '''
+    This function updates the 2030 scenario pkt and vkt based on changed car occupancy
+
+    Inputs:
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        occupancy_included - the average occupancy of a car (0 if no change from initial)
+
+    Outputs:
+        updated base_numbers
+    '''
+    if occupancy_included > 0:
+        for mode in car_modes:
+            base_numbers.loc['vkt_2030_scenario', mode] = base_numbers.loc['pkt_2030_scenario', mode]/occupancy_included
+
+    return base_numbers
+
+
+def calculate_emissions(base_numbers, emission_factors, car_emission_change):
+    '''
+    This function updates the 2030 scenario emissions based on the 2030 scenario vkt and emission_factors
+
+    Inputs:
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        emission_factors - the emissions factors for each mode (how much CO2-e is emitted for each km travelled)
+        car_emission_change - the % reduction in car emissions per km travelled from 2018 levels
+
+    Outputs:
+        updated base_numbers
+    '''
+    base_numbers.loc['emissions_2030_scenario'] = emission_factors.loc['values_2030_scenario'] * base_numbers.loc['vkt_2030_scenario']
+    base_numbers.loc['emissions_2030_scenario', 'passenger_light'] = base_numbers.loc['emissions_2030_scenario', 'passenger_light'] * (1-car_emission_change)
+
+    return base_numbers
+
+
+def run_scenario(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, scenario):
+    '''
+    This function runs one scenario through the reference functions, in the same order as update_graph
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        base_numbers - dataframe with pkt, vkt and emissions data (not changed)
+        emission_factors - the emissions factors for each mode
+        pt_effects_vkt, pt_effects_pkt - dataframes with the effect of each project on the vkt and pkt for each mode
+        scenario - dictionary of lever settings, with every lever of engine.lever_names
+
+    Outputs:
+        base_numbers with the 2030 scenario rows for the scenario
+    '''
+    base_numbers = base_numbers.copy()
+    base_numbers = pt_projects_apply(base_numbers, pt_effects_vkt, pt_effects_pkt, list(scenario['pt_included']))
+    base_numbers = bus_ridership_changes(numbers, base_numbers, scenario['bus_prop_increase'])
+    base_numbers = cycling_changes(numbers, base_numbers, scenario['cycling_included'])
+    base_numbers = bus_electric(numbers, base_numbers, scenario['bus_electrification_included'])
+    base_numbers = car_electric(base_numbers, scenario['car_electrification_included']/100)
+    base_numbers = covid_trips(base_numbers, scenario['covid'], numbers)
+    base_numbers = car_occupancy(base_numbers, scenario['occupancy_included']/100)
+    base_numbers = calculate_emissions(base_numbers, emission_factors, scenario['car_emission_change'])
+    return base_numbers
@@ -0,0 +1,179 @@
+'''
+Static images of the dashboard charts for many scenarios, for briefing packs.
+
+Each scenario is run through update_graph, so the charts are exactly the ones on the dashboard,
+and its emissions and pkt figures are written as images. Scenarios are shared out over a pool of
+processes (each loading the model once and keeping its own image renderer), so a report of
+hundreds of scenarios takes about as many times less as there are cores.
+
+Scenarios come from a JSON file of name: lever settings, in the same form as the dashboard's saved
+scenarios (levers left out take their default value), e.g.
+
+    {"Electric buses": {"bus_electrification_included": 2022}, "Light rail": {"pt_included": ["CRL", "AirportLightRail"]}}
+
+The report directory holds one folder per scenario with its images, and a manifest.json listing
+every scenario with its lever settings, headline numbers and image files.
+
+html (interactive, one file per chart) needs nothing extra, so it is the default; PNG, SVG and PDF
+need the kaleido package, which is not installed with the dashboard (pip install kaleido).
+
+Usage:
+    python reports.py scenarios.json report/                        # html of both charts
+    python reports.py scenarios.json report/ --formats png svg --workers 8
+'''
+import argparse
+import datetime
+import inspect
+import json
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+
+# The update_graph figures, by the file name they are saved as
+figures = {
+    'emissions': 0,
+    'pkt': 1,
+}
+
+formats = ['png', 'svg', 'pdf', 'html']
+
+
+def slug(name):
+    '''
+    Returns a name made safe for use as a file name
+    '''
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', name).strip('_') or 'scenario'
+
+
+def check_formats(image_formats):
+    '''
+    Raises a SystemExit if an image format cannot be written here
+    '''
+    unknown = [image_format for image_format in image_formats if image_format not in formats]
+    if unknown:
+        raise SystemExit('Unknown image formats: {} (choose from {})'.format(', '.join(unknown), ', '.join(formats)))
+    if any(image_format != 'html' for image_format in image_formats):
+        try:
+            import kaleido # noqa: F401
+        except ImportError:
+            raise SystemExit('PNG, SVG and PDF images need the kaleido package (pip install kaleido)')
+
+
+def render(position, name, levers, report_dir, image_formats, width, height, scale):
+    '''
+    This function runs one scenario through update_graph and writes its charts
+
+    Inputs:
+        position - position of the scenario in the report (used in its folder name, to keep the order)
+        name - scenario name
+        levers - dictionary of lever settings (missing levers take their default)
+        report_dir - directory of the report
+        image_formats - list of formats to write (see formats)
+        width, height - image size in pixels
+        scale - image scale factor (e.g. 2 for high resolution PNGs)
+
+    Outputs:
+        manifest entry for the scenario
+    '''
+    import plotly.graph_objects as go
+    import plotly.io as pio
+
+    import app
+    import engine
+
+    unknown = sorted(set(levers) - set(engine.lever_names))
+    if unknown:
+        raise ValueError('Unknown levers for scenario {}: {}'.format(name, ', '.join(unknown)))
+    settings = {lever: levers.get(lever, engine.lever_defaults[lever]) for lever in engine.lever_names}
+    outputs = inspect.unwrap(app.update_graph)(*[settings[lever] for lever in engine.lever_names])
+
+    folder = '{:03d}_{}'.format(position, slug(name))
+    (Path(report_dir) / folder).mkdir(parents=True, exist_ok=True)
+    files = {}
+    for figure_name, output in figures.items():
+        figure = go.Figure(outputs[output])
+        for image_format in image_formats:
+            path = '{}/{}.{}'.format(folder, figure_name, image_format)
+            if image_format == 'html':
+                pio.write_html(figure, str(Path(report_dir) / path), include_plotlyjs='cdn')
+            else:
+                pio.write_image(figure, str(Path(report_dir) / path), format=image_format, width=width, height=height, scale=scale)
+            files.setdefault(figure_name, {})[image_format] = path
+
+    return {
+        'name': name,
+        'levers': settings,
+        'emissions_2030_scenario': outputs[9],
+        'cars_2030_scenario': outputs[5].strip(),
+        'files': files,
+    }
+
+
+def _load_model():
+    # Each worker loads the model once, before its first scenario
+    import app # noqa: F401
+
+
+def build_report(scenarios, report_dir, image_formats=('html',), workers=None, width=1200, height=700, scale=1):
+    '''
+    This function writes the charts of every scenario, rendered in a pool of processes, and the manifest
+
+    Inputs:
+        scenarios - dictionary of scenario name: lever settings
+        report_dir - directory to write the report to
+        image_formats, width, height, scale - see render
+        workers - number of processes (default one per core)
+
+    Outputs:
+        the manifest (as saved to manifest.json)
+    '''
+    import app
+    import result_cache
+
+    check_formats(image_formats)
+    report_dir = Path(report_dir)
+    report_dir.mkdir(parents=True, exist_ok=True)
+    workers = min(workers or os.cpu_count(), max(len(scenarios), 1))
+
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=_load_model) as pool:
+        futures = [
+            pool.submit(render, position, name, levers, str(report_dir), list(image_formats), width, height, scale)
+            for position, (name, levers) in enumerate(scenarios.items(), 1)
+        ]
+        entries = [future.result() for future in futures]
+
+    manifest = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'data_version': result_cache.data_version(app.version_files),
+        'formats': list(image_formats),
+        'width': width,
+        'height': height,
+        'scale': scale,
+        'scenarios': entries,
+    }
+    (report_dir / 'manifest.json').write_text(json.dumps(manifest, indent=1))
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write the dashboard charts for many scenarios as images')
+    parser.add_argument('scenarios', help='JSON file of scenario name: lever settings')
+    parser.add_argument('report_dir', help='directory to write the report to')
+    parser.add_argument('--formats', nargs='+', default=['html'], help='any of {}'.format(', '.join(formats)))
+    parser.add_argument('--workers', type=int, default=None, help='number of processes (default one per core)')
+    parser.add_argument('--width', type=int, default=1200)
+    parser.add_argument('--height', type=int, default=700)
+    parser.add_argument('--scale', type=float, default=1)
+    args = parser.parse_args(argv)
+
+    scenarios = json.loads(Path(args.scenarios).read_text())
+    check_formats(args.formats)
+    manifest = build_report(scenarios, args.report_dir, args.formats, args.workers, args.width, args.height, args.scale)
+    print('Wrote {} scenarios to {}'.format(len(manifest['scenarios']), args.report_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+'''
+Persistent cache of update_graph results, shared by every worker process.
+
+Results are stored in a SQLite database (in WAL mode, so many processes can read while one writes),
+keyed by a hash of the canonical lever inputs and the version of the input data. The data version
+is a hash of the csv files and model code, so changing either starts a fresh set of results rather
+than serving stale ones. The database is kept under a size limit by dropping the least recently
+used results.
+
+Every request is also counted by its inputs (whatever the data version), so after a deploy the
+cache can be warmed up with the most requested scenarios. Only the max_requests most requested
+inputs are kept, so the counts do not grow without bound either. The counts and the last used times of
+cache hits are kept in memory and written in one transaction every flush_interval seconds, so
+reading the cache does not take SQLite's write lock.
+
+Usage:
+    RESULT_CACHE=cache/results.sqlite python app.py
+    RESULT_CACHE=cache/results.sqlite python result_cache.py --warm 500     # e.g. after a deploy
+'''
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import plotly
+
+import engine
+
+
+schema = '''
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+CREATE TABLE IF NOT EXISTS requests (
+    inputs TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+'''
+
+# Seconds between writes of the request counts and last used times
+flush_interval = 30
+
+
+def data_version(paths):
+    '''
+    Returns a hash of the contents of the input data (and code) files
+    '''
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(Path(path).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def canonical_levers(values):
+    '''
+    Returns lever values (in the order of engine.lever_names) with numbers as floats and the PT projects sorted
+    '''
+    return [
+        sorted(value or []) if lever == 'pt_included' else (None if value is None else float(value))
+        for lever, value in zip(engine.lever_names, values)
+    ]
+
+
+def canonical_inputs(inputs):
+    '''
+    This function gives one canonical form for a set of update_graph inputs
+
+    Inputs:
+        inputs - update_graph inputs, in argument order
+
+    Outputs:
+        JSON string of update_graph inputs with numbers as floats and the PT projects sorted, so that
+        the order projects were ticked in and 5 vs 5.0 do not make different entries. The compared
+        scenarios keep their order (the order of their bars), and only the saved scenarios being
+        compared are kept, so saving another scenario does not change the key
+    '''
+    levers = len(engine.lever_names)
+    compare_included, saved_scenarios = (list(inputs[levers:]) + [None, None])[:2]
+    saved_scenarios = saved_scenarios or {}
+    compared = [name for name in (compare_included or []) if name in saved_scenarios]
+    canonical = canonical_levers(inputs[:levers]) + [
+        compared,
+        {name: dict(zip(engine.lever_names, canonical_levers([saved_scenarios[name].get(lever) for lever in engine.lever_names])))
+         for name in compared},
+    ]
+    return json.dumps(canonical, sort_keys=True)
+
+
+class ResultCache:
+    '''
+    SQLite store of update_graph results
+    '''
+    def __init__(self, path, version, max_bytes=256 * 2**20, max_requests=20000):
+        '''
+        Inputs:
+            path - SQLite database file
+            version - input data version (see data_version)
+            max_bytes - size limit for the stored results
+            max_requests - number of the most requested inputs whose counts are kept
+        '''
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.version = version
+        self.max_bytes = max_bytes
+        self.max_requests = max_requests
+        self._local = threading.local()
+        self._writes = 0
+        # Request counts and last used times not yet written to the database
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._used = {}
+        self._flushed = time.time()
+        with self.connection() as connection:
+            connection.executescript(schema)
+        atexit.register(self.flush)
+
+    def connection(self):
+        '''
+        Returns this thread's connection to the database
+        '''
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def key(self, canonical):
+        return hashlib.sha256((self.version + canonical).encode()).hexdigest()
+
+    def get(self, inputs):
+        '''
+        Returns the cached outputs for these inputs (or None), and counts the request
+        '''
+        canonical = canonical_inputs(inputs)
+        key = self.key(canonical)
+        row = self.connection().execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        with self._lock:
+            self._counts[canonical] = self._counts.get(canonical, 0) + 1
+            if row is not None:
+                self._used[key] = now
+            due = now - self._flushed >= flush_interval
+        if due:
+            self.flush()
+        return None if row is None else json.loads(zlib.decompress(row[0]))
+
+    def flush(self):
+        '''
+        Writes the request counts and last used times kept since the last flush, in one transaction
+        '''
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            used, self._used = self._used, {}
+            self._flushed = time.time()
+        if not counts and not used:
+            return
+        connection = self.connection()
+        connection.execute('BEGIN')
+        try:
+            connection.executemany(
+                'INSERT INTO requests (inputs, count) VALUES (?, ?) ON CONFLICT (inputs) DO UPDATE SET count = count + excluded.count',
+                list(counts.items()))
+            connection.executemany('UPDATE results SET last_used = MAX(last_used, ?) WHERE key = ?',
+                                   [(when, key) for key, when in used.items()])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def put(self, inputs, outputs):
+        '''
+        Stores the outputs for these inputs
+        '''
+        value = zlib.compress(json.dumps(outputs, cls=plotly.utils.PlotlyJSONEncoder).encode())
+        connection = self.connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO results (key, version, value, size, last_used) VALUES (?, ?, ?, ?, ?)',
+            (self.key(canonical_inputs(inputs)), self.version, value, len(value), time.time()))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.evict()
+
+    def evict(self):
+        '''
+        Drops results from old data versions, then the least recently used results until under the size
+        limit, and the request counts of all but the max_requests most requested inputs
+        '''
+        self.flush()
+        connection = self.connection()
+        connection.execute('DELETE FROM results WHERE version != ?', (self.version,))
+        connection.execute(
+            'DELETE FROM requests WHERE inputs NOT IN (SELECT inputs FROM requests ORDER BY count DESC LIMIT ?)',
+            (self.max_requests,))
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop down to 90% of the limit so eviction does not run on every write
+        excess = total - 0.9 * self.max_bytes
+        dropped = 0
+        keys = []
+        for key, size in connection.execute('SELECT key, size FROM results ORDER BY last_used'):
+            keys.append((key,))
+            dropped += size
+            if dropped >= excess:
+                break
+        connection.executemany('DELETE FROM results WHERE key = ?', keys)
+
+    def most_requested(self, limit):
+        '''
+        Returns the inputs of the most requested scenarios that have no result for this data version
+        '''
+        self.flush()
+        rows = self.connection().execute('SELECT inputs FROM requests ORDER BY count DESC LIMIT ?', (limit,)).fetchall()
+        return [json.loads(inputs) for (inputs,) in rows
+                if self.connection().execute('SELECT 1 FROM results WHERE key = ?', (self.key(inputs),)).fetchone() is None]
+
+    def warm(self, compute, limit=200):
+        '''
+        Computes and stores the most requested scenarios that are missing, returning how many were added
+
+        Inputs:
+            compute - function taking update_graph inputs and returning its outputs
+            limit - how many of the most requested scenarios to consider
+        '''
+        missing = self.most_requested(limit)
+        for inputs in missing:
+            self.put(inputs, compute(*inputs))
+        return len(missing)
+
+
+def cached(cache):
+    '''
+    Decorator which serves update_graph results from the cache (does nothing if cache is None)
+    '''
+    def decorator(function):
+        if cache is None:
+            return function
+
+        def wrapper(*args):
+            outputs = cache.get(args)
+            if outputs is None:
+                outputs = function(*args)
+                cache.put(args, outputs)
+            return outputs
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        wrapper.__wrapped__ = function
+        return wrapper
+    return decorator
+
+
+def from_environment(version_files):
+    '''
+    Makes the cache set up by the RESULT_CACHE and RESULT_CACHE_MAX_MB environment variables (None if RESULT_CACHE is not set)
+    '''
+    path = os.environ.get('RESULT_CACHE')
+    if not path:
+        return None
+    max_bytes = float(os.environ.get('RESULT_CACHE_MAX_MB', 256)) * 2**20
+    return ResultCache(path, data_version(version_files), max_bytes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Warm up the update_graph result cache (set by RESULT_CACHE)')
+    parser.add_argument('--warm', type=int, default=200, help='number of most requested scenarios to make sure are cached')
+    args = parser.parse_args(argv)
+
+    import inspect
+    import app
+    if app.scenario_cache is None:
+        raise SystemExit('Set RESULT_CACHE to the cache database')
+    update_graph = inspect.unwrap(app.update_graph)
+    print('Added {} results'.format(app.scenario_cache.warm(update_graph, args.warm)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+'''
+Hourly service profiles for PT projects.
+
+pt_details.csv describes each project's service with a peak and off-peak frequency, and assumes
+every peak vehicle runs full. A project can instead be given a 24-hour profile in pt_profiles.csv
+(optional), with one row per project and hour:
+
+    proj_name    - project, as in pt_details.csv
+    hour         - 0 to 23
+    services     - vehicles per hour in each direction
+    load_factor  - expected passengers as a proportion of vehicle capacity (above 1 is more demand
+                   than the vehicles can carry)
+
+Ridership is limited by capacity, so each hour carries services x vehicle_capacity x min(load_factor, 1)
+passengers over the project distance. Annual figures are worked out on the same basis as pt_proj_effects:
+vkt from the whole weekday with vkt_annualisation, and pkt from the two AM peak hours (am_peak_hours)
+with pkt_annualisation, which is a peak hour to annual factor. Profiles are held as projects x hours arrays and every
+project and hour is calculated at once, so large project catalogues stay fast.
+'''
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+hours = 24
+am_peak_hours = [7, 8] # The peak hours pkt_annualisation scales up to a year
+
+
+def load_profiles(path, projects):
+    '''
+    This function reads hourly service profiles
+
+    Inputs:
+        path - csv file of profiles (see the module docstring)
+        projects - list of PT projects, in pt_details order
+
+    Outputs:
+        dictionary of projects x hours arrays of 'services' and 'load_factor' (NaN for projects
+        without a profile) and a 'has_profile' array, or None if the file does not exist
+    '''
+    if not Path(path).exists():
+        return None
+    profiles = pd.read_csv(path)
+    unknown = sorted(set(profiles.proj_name) - set(projects))
+    if unknown:
+        raise ValueError('Profiles for projects not in pt_details: {}'.format(', '.join(unknown)))
+
+    loaded = {}
+    for column in ['services', 'load_factor']:
+        table = profiles.pivot(index = 'proj_name', columns = 'hour', values = column)
+        loaded[column] = table.reindex(index = projects, columns = range(hours)).to_numpy(dtype=float)
+    loaded['has_profile'] = ~np.isnan(loaded['services']).all(axis=1)
+    # Hours left out of a profile have no service
+    for column in ['services', 'load_factor']:
+        loaded[column][loaded['has_profile']] = np.nan_to_num(loaded[column][loaded['has_profile']])
+    return loaded
+
+
+def from_frequencies(pt_details, peak_hours=(7, 8, 16, 17, 6, 9, 15, 18), first_hour=6):
+    '''
+    This function turns the peak and off-peak frequencies in pt_details into hourly profiles,
+    running full in the peak and empty otherwise (as pt_proj_effects assumes)
+
+    Inputs:
+        pt_details - dataframe of PT projects
+        peak_hours - hours to use as peak, in order, for each project's num_peak_hrs
+        first_hour - first hour of service
+
+    Outputs:
+        dictionary of profiles (see load_profiles), with the same annual vkt and pkt as pt_proj_effects
+        as long as the peak hours fall within each project's hours of service and the AM peak hours
+        are among each project's peak hours
+    '''
+    n = len(pt_details)
+    hour = np.arange(hours)
+    peak_hours = np.asarray(peak_hours)
+
+    # Service runs for num_hours from first_hour (or earlier, to finish by midnight), with the first
+    # num_peak_hrs of peak_hours as peak
+    num_hours = pt_details.num_hours.to_numpy()[:, np.newaxis]
+    start = np.minimum(first_hour, hours - num_hours)
+    in_service = (hour[np.newaxis, :] >= start) & (hour[np.newaxis, :] < start + num_hours)
+    peak_rank = np.full(hours, len(peak_hours))
+    peak_rank[peak_hours] = np.arange(len(peak_hours))
+    peak = peak_rank[np.newaxis, :] < pt_details.num_peak_hrs.to_numpy()[:, np.newaxis]
+    off_peak = in_service & ~peak
+
+    services = (
+        np.where(peak, 60 / pt_details.peak_freq.to_numpy()[:, np.newaxis], 0)
+        + np.where(off_peak, 60 / pt_details.off_peak_freq.to_numpy()[:, np.newaxis], 0)
+    )
+    return {
+        'services': services,
+        'load_factor': np.where(peak, 1.0, 0.0),
+        'has_profile': np.ones(n, dtype=bool),
+    }
+
+
+def profile_effects(numbers, pt_details, profiles):
+    '''
+    This function calculates the annual vkt and pkt of each project's primary mode from its profile
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        pt_details - dataframe of PT projects (for distance and vehicle_capacity)
+        profiles - dictionary of profiles (see load_profiles)
+
+    Outputs:
+        primary_vkt, primary_pkt - arrays with one value per project (NaN for projects without a profile)
+    '''
+    distance = pt_details.distance.to_numpy(dtype=float)[:, np.newaxis]
+    capacity = pt_details.vehicle_capacity.to_numpy(dtype=float)[:, np.newaxis]
+    services = profiles['services']
+
+    ridership = services * capacity * np.minimum(profiles['load_factor'], 1) # Passengers per hour, limited by capacity
+
+    daily_vkt = (services * distance).sum(axis=1) * 2 # For both directions
+    am_peak_pkt = (ridership[:, am_peak_hours] * distance).sum(axis=1) * 2 # For both directions
+
+    # vkt is annualised from the weekday and pkt from the AM peak, as in pt_proj_effects
+    return daily_vkt * numbers['vkt_annualisation'], am_peak_pkt * numbers['pkt_annualisation']
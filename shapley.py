@@ -0,0 +1,108 @@
+'''
+Shapley attribution of the change in 2030 emissions to the levers and PT projects of a scenario.
+
+The changes act on each other (car electrification acts on the pkt left after the PT projects and
+cycling changes, car occupancy on the car vkt left after car electrification, and so on), so the
+cut from a lever depends on what else is chosen, and there is no one answer to how much each
+lever contributed. The Shapley value answers it fairly: a component's share is its effect added
+on top of each subset of the other components, averaged over the orders the components could be
+added in. The shares add up exactly to the difference between the scenario and the 2030 baseline.
+
+The components are the levers moved from their default and each ticked PT project. With k of
+them, every one of the 2^k subsets is evaluated as one batch (16,384 scenarios for 14 components,
+a few tens of milliseconds), and the shares are weighted sums over the batch.
+'''
+import math
+
+import numpy as np
+
+import engine
+
+
+# Most components attributed at once (the batch grows as 2^components)
+max_components = 14
+
+
+def components(scenario, projects):
+    '''
+    This function lists the parts of a scenario that change it from the default
+
+    Inputs:
+        scenario - dictionary of lever settings (missing levers take their default)
+        projects - list of PT project names, in the order of the pt_effects dataframes
+
+    Outputs:
+        list of (lever, value) pairs: the levers away from their default, then ('pt_included', project) for each ticked project
+    '''
+    changed = [
+        (lever, scenario[lever]) for lever in engine.lever_names
+        if lever != 'pt_included' and lever in scenario and scenario[lever] != engine.lever_defaults[lever]
+    ]
+    included = scenario.get('pt_included') or []
+    return changed + [('pt_included', project) for project in projects if project in included]
+
+
+def subset_batch(parts, projects):
+    '''
+    This function makes a batch with one scenario per subset of the components, on top of the defaults
+
+    Inputs:
+        parts - list of (lever, value) pairs (see components)
+        projects - list of PT project names
+
+    Outputs:
+        batch - dictionary of lever arrays (see engine.make_batch); scenario s has component i if bit i of s is set
+    '''
+    n = 2**len(parts)
+    batch = engine.make_batch([{}], projects)
+    batch = {lever: np.repeat(column, n, axis=0) for lever, column in batch.items()}
+    bits = (np.arange(n)[:, None] >> np.arange(len(parts))) & 1 == 1
+    for i, (lever, value) in enumerate(parts):
+        if lever == 'pt_included':
+            batch['pt_included'][bits[:, i], projects.index(value)] = True
+        else:
+            batch[lever][bits[:, i]] = value
+    return batch
+
+
+def attribute(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, scenario, **options):
+    '''
+    This function shares the change in 2030 emissions between the levers and PT projects of a scenario
+
+    Inputs:
+        numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt - as for engine.evaluate_batch
+        scenario - dictionary of lever settings (missing levers take their default)
+        options - passed on to engine.evaluate_batch (mode_costs, od_effects)
+
+    Outputs:
+        dictionary of:
+            components - list of (lever, value) pairs (see components)
+            contributions - array of each component's share of the change, in Mt CO2-e (negative for a cut)
+            baseline - the 2030 emissions with every lever at its default, in Mt CO2-e
+            scenario - the 2030 emissions of the scenario, in Mt CO2-e
+    '''
+    projects = list(pt_effects_pkt.index)
+    parts = components(scenario, projects)
+    k = len(parts)
+    if k > max_components:
+        raise ValueError('Too many changes to attribute ({}, the most is {})'.format(k, max_components))
+
+    results = engine.evaluate_batch(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt,
+                                    subset_batch(parts, projects), **options)
+    value = engine.total_emissions(results)
+
+    # Weight of adding a component to a subset of s others: s! (k - s - 1)! / k!
+    masks = np.arange(2**k)
+    sizes = ((masks[:, None] >> np.arange(k)) & 1).sum(axis=1)
+    weights = np.array([math.factorial(s) * math.factorial(k - s - 1) / math.factorial(k) for s in range(k)])
+    contributions = np.empty(k)
+    for i in range(k):
+        without = masks[(masks >> i) & 1 == 0]
+        contributions[i] = np.dot(weights[sizes[without]], value[without | (1 << i)] - value[without])
+
+    return {
+        'components': parts,
+        'contributions': contributions,
+        'baseline': float(value[0]),
+        'scenario': float(value[-1]),
+    }
@@ -0,0 +1,461 @@
+'''
+Sharded sweeps, run by a pool of local processes or by workers on several machines.
+
+The scenarios of a sweep (see sweeps.py) are split into shards of consecutive scenario numbers, so
+shard k always holds the same scenarios. A run is a directory, shared by every worker:
+
+    run.json            - the sweep: the lever values, shard size, chunk size, threshold and data version
+    shards/<k>.claim    - the worker evaluating shard k (created atomically, so only one worker gets it)
+    shards/<k>.npz      - the partial results of shard k, written once it is finished
+
+Workers take the next shard no one has claimed, so any number of them can share a run, on this
+machine or on others that can see the directory. While a worker evaluates a shard, a thread
+rewrites its claim every heartbeat_interval seconds, however long a chunk takes. A worker with
+nothing left to claim waits for the shards other workers hold, and takes over a claim held by a
+process on this machine that has died, or one it has watched go unchanged for stale_after seconds.
+Only the waiting worker's own clock is used for that, so clocks on different machines (and the
+file times of the shared filesystem) do not need to agree. Each worker writes its results under
+its own temporary name and only removes its own claim, so a shard taken over by mistake is just
+evaluated twice, to the same results. A finished shard is never evaluated again, so a run that
+crashed carries on where it stopped by starting the workers again.
+
+For each shard the partial results are the lowest and highest emissions for every value of every
+control (sweeps.LeverExtremes), a histogram of the emissions and, with a threshold, every scenario
+below it. merge() combines the finished shards, in shard order, so the results do not depend on how
+many workers ran them.
+
+Usage:
+    python shards.py create runs/full --shard-size 100000000 --threshold 0.5
+    python shards.py run runs/full --workers 8       # a pool of processes on this machine
+    python shards.py work runs/full                  # one worker (e.g. on each machine sharing runs/)
+    python shards.py status runs/full
+    python shards.py merge runs/full
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import sweeps
+
+
+# Seconds a claim can go unchanged, as timed by a worker waiting for it, before that worker takes the shard over
+stale_after = 600
+
+# Seconds between rewrites of a claim while its shard is evaluated (and between checks of the claims waited for)
+heartbeat_interval = 30
+
+histogram_bins = 1000
+
+
+def _write_json(path, value):
+    temporary = path.with_name(path.name + '.tmp')
+    temporary.write_text(json.dumps(value, indent=1))
+    os.replace(str(temporary), str(path))
+
+
+def create(run_dir, levels=None, shard_size=10**8, chunk_size=10**5, dtype='float32', threshold=None, mode_choice=False):
+    '''
+    This function sets up a sharded sweep
+
+    Inputs:
+        run_dir - directory for the run (shared by every worker)
+        levels - optional values for some controls (see sweeps.lever_levels), e.g. {'covid': [0, 50]}
+        shard_size - scenarios per shard
+        chunk_size - scenarios evaluated at once within a shard
+        dtype - type the emissions are held as
+        threshold - optional emissions (Mt CO2-e) below which every scenario is kept
+        mode_choice - use logit mode choice (see mode_choice.py)
+
+    Outputs:
+        the run configuration (as saved to run.json)
+    '''
+    import app
+    import result_cache
+
+    run_dir = Path(run_dir)
+    (run_dir / 'shards').mkdir(parents=True, exist_ok=True)
+    if (run_dir / 'run.json').exists():
+        raise ValueError('{} already has a run'.format(run_dir))
+
+    projects = list(app.pt_details.index)
+    full_levels = sweeps.lever_levels(projects, levels)
+    total = sweeps.size(full_levels)
+    baseline = app.master_base_numbers.loc['emissions_2030_baseline'].sum() / (10**9)
+    config = {
+        'version': result_cache.data_version(app.version_files),
+        'projects': projects,
+        'levels': {lever: [list(value) if isinstance(value, (list, tuple)) else (int(value) if lever == 'pt_included' else float(value))
+                           for value in values] for lever, values in (levels or {}).items()},
+        'size': total,
+        'shard_size': int(shard_size),
+        'shards': -(-total // int(shard_size)),
+        'chunk_size': int(chunk_size),
+        'dtype': dtype,
+        'threshold': threshold,
+        'mode_choice': bool(mode_choice),
+        'histogram_max': 2 * baseline,
+        'created': time.time(),
+    }
+    _write_json(run_dir / 'run.json', config)
+    return config
+
+
+def load_config(run_dir):
+    '''
+    Returns the run configuration from run.json
+    '''
+    return json.loads((Path(run_dir) / 'run.json').read_text())
+
+
+# Claims this process has seen: claim file: (its content, time.monotonic() when the content last changed)
+_seen = {}
+
+
+def _claim_is_stale(path):
+    try:
+        content = path.read_text()
+        claim = json.loads(content)
+    except (FileNotFoundError, ValueError):
+        return False
+    if claim.get('host') == socket.gethostname():
+        try:
+            os.kill(claim['pid'], 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+    # The owner rewrites its claim with a new beat number, so an unchanged claim has not been refreshed
+    now = time.monotonic()
+    if _seen.get(str(path), (None,))[0] != content:
+        _seen[str(path)] = (content, now)
+    return now - _seen[str(path)][1] > stale_after
+
+
+def _claim_content(token, beat):
+    return json.dumps({'host': socket.gethostname(), 'pid': os.getpid(), 'token': token, 'beat': beat, 'time': time.time()})
+
+
+def _owns(path, token):
+    try:
+        return json.loads(path.read_text()).get('token') == token
+    except (FileNotFoundError, ValueError):
+        return False
+
+
+def refresh(path, token, beat):
+    '''
+    Rewrites a claim with a new beat number, returning False (and leaving it alone) if another worker has taken it over
+    '''
+    if not _owns(path, token):
+        return False
+    temporary = path.with_name('{}.{}.tmp'.format(path.name, token))
+    temporary.write_text(_claim_content(token, beat))
+    os.replace(str(temporary), str(path))
+    return True
+
+
+def release(path, token):
+    '''
+    Removes a claim, if it is still this worker's
+    '''
+    if _owns(path, token):
+        path.unlink(missing_ok=True)
+
+
+def claim(run_dir, shard):
+    '''
+    This function tries to claim a shard for this process
+
+    Outputs:
+        the claim file and this claim's token, or None if the shard is finished or another worker holds it
+    '''
+    shards_dir = Path(run_dir) / 'shards'
+    path = shards_dir / '{}.claim'.format(shard)
+    if (shards_dir / '{}.npz'.format(shard)).exists():
+        return None
+    if path.exists() and _claim_is_stale(path):
+        # Only one worker can move a stale claim out of the way
+        try:
+            os.replace(str(path), str(path.with_name('{}.stale.{}.{}'.format(path.name, socket.gethostname(), os.getpid()))))
+        except FileNotFoundError:
+            return None
+    try:
+        descriptor = os.open(str(path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None
+    token = uuid.uuid4().hex
+    with os.fdopen(descriptor, 'w') as f:
+        f.write(_claim_content(token, 0))
+    # Another worker may have finished the shard just before it was claimed
+    if (shards_dir / '{}.npz'.format(shard)).exists():
+        release(path, token)
+        return None
+    return path, token
+
+
+def shard_range(config, shard):
+    '''
+    Returns the first and one past the last scenario number of a shard
+    '''
+    start = shard * config['shard_size']
+    return start, min(start + config['shard_size'], config['size'])
+
+
+def run_shard(config, shard):
+    '''
+    This function evaluates one shard
+
+    Inputs:
+        config - run configuration
+        shard - shard number
+
+    Outputs:
+        dictionary of arrays of the partial results (as saved to shards/<k>.npz)
+    '''
+    import app
+    import mode_choice
+
+    levels = sweeps.lever_levels(config['projects'], config['levels'])
+    extremes = sweeps.LeverExtremes(levels)
+    edges = np.linspace(0, config['histogram_max'], histogram_bins + 1)
+    counts = np.zeros(histogram_bins, dtype=np.int64)
+    total = 0.0
+    kept = []
+
+    start, stop = shard_range(config, shard)
+    options = {'od_effects': app.od_effects}
+    if config['mode_choice']:
+        options['mode_costs'] = mode_choice.load_costs()
+    for chunk in sweeps.iterate(app.numbers, app.master_base_numbers, app.emission_factors, app.pt_effects_vkt, app.pt_effects_pkt,
+                                levels, start, stop, config['chunk_size'], np.dtype(config['dtype']), ('total_emissions',), **options):
+        emissions = chunk['total_emissions']
+        extremes(chunk)
+        counts += np.bincount(np.clip(np.searchsorted(edges, emissions, side='right') - 1, 0, histogram_bins - 1), minlength=histogram_bins)
+        total += float(emissions.sum(dtype=float))
+        if config['threshold'] is not None:
+            kept.append(sweeps.below(config['threshold'])(chunk))
+
+    kept = [chunk for chunk in kept if chunk is not None]
+    result = {
+        'count': np.int64(stop - start),
+        'total': np.float64(total),
+        'histogram': counts,
+        'below_index': np.concatenate([chunk['index'] for chunk in kept]) if kept else np.zeros(0, dtype=np.int64),
+        'below_emissions': np.concatenate([chunk['total_emissions'] for chunk in kept]) if kept else np.zeros(0),
+    }
+    for lever, found in extremes.result().items():
+        for name in ['min', 'max', 'argmin', 'argmax']:
+            result['{}.{}'.format(lever, name)] = found[name]
+    return result
+
+
+def work(run_dir, max_shards=None):
+    '''
+    This function runs one worker: it evaluates unclaimed shards, then waits for the shards other
+    workers hold (taking over any whose claim goes stale), until every shard is finished
+
+    Inputs:
+        run_dir - directory of the run
+        max_shards - optional most shards to evaluate
+
+    Outputs:
+        list of the shards this worker evaluated
+    '''
+    import app
+    import result_cache
+
+    run_dir = Path(run_dir)
+    config = load_config(run_dir)
+    version = result_cache.data_version(app.version_files)
+    if version != config['version']:
+        raise ValueError('The data or model has changed since the run was created ({} is not {})'.format(version, config['version']))
+
+    shards_dir = run_dir / 'shards'
+    done = []
+    pending = list(range(config['shards']))
+    while pending:
+        held = []
+        for shard in pending:
+            if max_shards is not None and len(done) >= max_shards:
+                return done
+            claimed = claim(run_dir, shard)
+            if claimed is None:
+                if not (shards_dir / '{}.npz'.format(shard)).exists():
+                    held.append(shard)
+                continue
+            path, token = claimed
+
+            # Keep the claim fresh from a thread, so a slow chunk does not let it go stale
+            stop = threading.Event()
+            def beat(path=path, token=token):
+                beats = 0
+                while not stop.wait(heartbeat_interval):
+                    beats += 1
+                    refresh(path, token, beats)
+            heartbeat = threading.Thread(target=beat, daemon=True)
+            heartbeat.start()
+            try:
+                result = run_shard(config, shard)
+            finally:
+                stop.set()
+                heartbeat.join()
+
+            temporary = shards_dir / '{}.{}.tmp.npz'.format(shard, token)
+            with open(temporary, 'wb') as f:
+                np.savez(f, **result)
+            os.replace(str(temporary), str(shards_dir / '{}.npz'.format(shard)))
+            release(path, token)
+            done.append(shard)
+
+        pending = held
+        if pending:
+            time.sleep(heartbeat_interval)
+    return done
+
+
+def run(run_dir, workers=None):
+    '''
+    This function runs workers in a pool of local processes until every shard is finished
+
+    Outputs:
+        the merged results (see merge)
+    '''
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        for future in [pool.submit(work, str(run_dir)) for _ in range(workers)]:
+            future.result()
+    return merge(run_dir)
+
+
+def status(run_dir):
+    '''
+    Returns a dictionary of the number of shards finished, claimed and in the run
+    '''
+    config = load_config(run_dir)
+    shards_dir = Path(run_dir) / 'shards'
+    finished = [shard for shard in range(config['shards']) if (shards_dir / '{}.npz'.format(shard)).exists()]
+    claimed = [shard for shard in range(config['shards']) if (shards_dir / '{}.claim'.format(shard)).exists()]
+    return {'finished': len(finished), 'claimed': len(claimed), 'shards': config['shards'], 'scenarios': config['size']}
+
+
+def merge(run_dir):
+    '''
+    This function combines the partial results of the finished shards
+
+    Outputs:
+        dictionary of:
+            shards, finished - number of shards in the run and finished
+            scenarios - number of scenarios in the finished shards
+            mean, min, max, percentiles (5, 50, 95; to the histogram bin) of the 2030 emissions
+            best, worst - lever settings of the lowest and highest emissions scenarios
+            extremes - lowest and highest emissions for every value of every control (see sweeps.LeverExtremes.result)
+            below_index, below_emissions - scenarios under the threshold, if the run has one
+    '''
+    config = load_config(run_dir)
+    shards_dir = Path(run_dir) / 'shards'
+    levels = sweeps.lever_levels(config['projects'], config['levels'])
+    extremes = sweeps.LeverExtremes(levels)
+    counts = np.zeros(histogram_bins, dtype=np.int64)
+    scenarios = 0
+    total = 0.0
+    below_index = []
+    below_emissions = []
+    finished = 0
+
+    for shard in range(config['shards']):
+        path = shards_dir / '{}.npz'.format(shard)
+        if not path.exists():
+            continue
+        with np.load(path) as data:
+            other = sweeps.LeverExtremes(levels)
+            for lever in levels:
+                other.minimum[lever] = data['{}.min'.format(lever)]
+                other.maximum[lever] = data['{}.max'.format(lever)]
+                other.argmin[lever] = data['{}.argmin'.format(lever)]
+                other.argmax[lever] = data['{}.argmax'.format(lever)]
+            extremes.merge(other)
+            counts += data['histogram']
+            scenarios += int(data['count'])
+            total += float(data['total'])
+            below_index.append(data['below_index'])
+            below_emissions.append(data['below_emissions'])
+        finished += 1
+
+    result = {'shards': config['shards'], 'finished': finished, 'scenarios': scenarios}
+    if scenarios == 0:
+        return result
+
+    found = extremes.result()
+    first = next(iter(levels))
+    lowest = int(found[first]['argmin'][np.nanargmin(found[first]['min'])])
+    highest = int(found[first]['argmax'][np.nanargmax(found[first]['max'])])
+    edges = np.linspace(0, config['histogram_max'], histogram_bins + 1)
+    cumulative = np.cumsum(counts) / scenarios
+    result.update({
+        'mean': total / scenarios,
+        'min': float(np.nanmin(found[first]['min'])),
+        'max': float(np.nanmax(found[first]['max'])),
+        'percentiles': {p: float(edges[np.searchsorted(cumulative, p / 100) + 1]) for p in [5, 50, 95]},
+        'best': describe(lowest, levels, config['projects']),
+        'worst': describe(highest, levels, config['projects']),
+        'extremes': found,
+        'below_index': np.concatenate(below_index),
+        'below_emissions': np.concatenate(below_emissions),
+    })
+    return result
+
+
+def describe(index, levels, projects):
+    '''
+    Returns the lever settings of one scenario number, as update_graph inputs
+    '''
+    batch = sweeps.decode(np.array([index]), levels, projects)
+    return {lever: ([project for project, included in zip(projects, batch[lever][0]) if included]
+                    if lever == 'pt_included' else float(batch[lever][0]))
+            for lever in levels}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sharded sweeps over every combination of the controls')
+    commands = parser.add_subparsers(dest='command', required=True)
+    create_parser = commands.add_parser('create', help='set up a run')
+    create_parser.add_argument('run_dir')
+    create_parser.add_argument('--levels', type=json.loads, default=None, help='JSON of values for some controls, e.g. \'{"covid": [0, 50]}\'')
+    create_parser.add_argument('--shard-size', type=int, default=10**8)
+    create_parser.add_argument('--chunk-size', type=int, default=10**5)
+    create_parser.add_argument('--dtype', default='float32')
+    create_parser.add_argument('--threshold', type=float, default=None, help='keep every scenario below these emissions (Mt CO2-e)')
+    create_parser.add_argument('--mode-choice', action='store_true')
+    for command in ['work', 'status', 'merge']:
+        commands.add_parser(command).add_argument('run_dir')
+    run_parser = commands.add_parser('run', help='run a pool of workers on this machine')
+    run_parser.add_argument('run_dir')
+    run_parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == 'create':
+        config = create(args.run_dir, args.levels, args.shard_size, args.chunk_size, args.dtype, args.threshold, args.mode_choice)
+        print('{:,} scenarios in {:,} shards'.format(config['size'], config['shards']))
+    elif args.command == 'work':
+        print('Evaluated shards {}'.format(work(args.run_dir)))
+    elif args.command == 'status':
+        print(json.dumps(status(args.run_dir)))
+    else:
+        result = run(args.run_dir, args.workers) if args.command == 'run' else merge(args.run_dir)
+        summary = {key: value for key, value in result.items() if key not in ['extremes', 'below_index', 'below_emissions']}
+        if 'below_index' in result:
+            summary['below_threshold'] = len(result['below_index'])
+        print(json.dumps(summary, indent=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,487 @@
+// Answers the dashboard's callback requests in the browser, so the site exported by
+// static_export.py needs no Python server.
+//
+// static_export.py stores the 2030 scenario vkt and pkt after the PT project, bus ridership and
+// cycling changes for every combination of those controls (states.bin). The remaining changes
+// (bus and car electrification, covid, car occupancy, emission standards) are simple enough to
+// apply here, in the same order and with the same arithmetic as update_graph, and the results are
+// put into the figures and text update_graph returned for the default inputs (model.json).
+// Saving scenarios to compare is answered here too, with the same results as the server.
+(function () {
+    'use strict';
+
+    // Sum in the same order as numpy (pandas Series.sum), so totals match to the last bit
+    function numpySum(values) {
+        var n = values.length, i, total;
+        if (n < 8) {
+            total = 0;
+            for (i = 0; i < n; i++) {
+                total += values[i];
+            }
+            return total;
+        }
+        if (n <= 128) {
+            var r = values.slice(0, 8);
+            for (i = 8; i < n - (n % 8); i += 8) {
+                for (var k = 0; k < 8; k++) {
+                    r[k] += values[i + k];
+                }
+            }
+            total = ((r[0] + r[1]) + (r[2] + r[3])) + ((r[4] + r[5]) + (r[6] + r[7]));
+            for (; i < n; i++) {
+                total += values[i];
+            }
+            return total;
+        }
+        var half = Math.floor(n / 2);
+        half -= half % 8;
+        return numpySum(values.slice(0, half)) + numpySum(values.slice(half));
+    }
+
+    function formatNumber(value, decimals) {
+        return value.toLocaleString('en-US', {minimumFractionDigits: decimals, maximumFractionDigits: decimals});
+    }
+
+    // Move a proportion of each [fuelled mode, electric version] pair to the electric version
+    function electrify(values, pairs, prop) {
+        var shifts = pairs.map(function (pair) {
+            return values[pair[0]] * prop;
+        });
+        pairs.forEach(function (pair, k) {
+            values[pair[0]] += -shifts[k];
+        });
+        pairs.forEach(function (pair, k) {
+            values[pair[1]] += shifts[k];
+        });
+    }
+
+    // The 2030 scenario vkt, pkt and emissions for one set of lever values
+    function scenario(model, values) {
+        var modes = model.modes;
+        var M = modes.length;
+        var registry = model.registry;
+
+        // PT projects, bus ridership and cycling: look up the stored state
+        var mask = 0;
+        (values.pt_included || []).forEach(function (project) {
+            mask |= 1 << model.projects.indexOf(project);
+        });
+        var i = model.options.cycling_included.indexOf(values.cycling_included);
+        var j = model.options.bus_prop_increase.indexOf(values.bus_prop_increase);
+        var offset = ((i * model.options.bus_prop_increase.length + j) * (1 << model.projects.length) + mask) * 2 * M;
+        var vkt = Array.prototype.slice.call(model.states, offset, offset + M);
+        var pkt = Array.prototype.slice.call(model.states, offset + M, offset + 2 * M);
+
+        // bus_electric
+        var year = values.bus_electrification_included;
+        if (year > 2019) {
+            var busProp = (2030 - year) / model.numbers.bus_lifespan;
+            [vkt, pkt].forEach(function (v) {
+                electrify(v, registry.electrification.pt, busProp);
+            });
+        }
+
+        // car_electric
+        var carProp = values.car_electrification_included / 100;
+        if (carProp > 0) {
+            [vkt, pkt].forEach(function (v) {
+                electrify(v, registry.electrification.private, carProp);
+            });
+        }
+
+        // covid_trips
+        model.numbers.all_modes.forEach(function (mode) {
+            var m = modes.indexOf(mode);
+            pkt[m] = (1 - (values.covid / 100)) * pkt[m];
+        });
+        model.numbers.private_modes.forEach(function (mode) {
+            var m = modes.indexOf(mode);
+            vkt[m] = pkt[m] / (registry.occupancy[m] === 'car' ? model.numbers.car_occupancy : 1);
+        });
+
+        // car_occupancy
+        var occupancy = values.occupancy_included / 100;
+        if (occupancy > 0) {
+            registry.car_modes.forEach(function (m) {
+                vkt[m] = pkt[m] / occupancy;
+            });
+        }
+
+        // calculate_emissions
+        var emissions = vkt.map(function (v, m) {
+            return model.emission_factors[m] * v;
+        });
+        registry.electrification.private.forEach(function (pair) {
+            emissions[pair[0]] = emissions[pair[0]] * (1 - values.car_emission_change);
+        });
+        return {vkt: vkt, pkt: pkt, emissions: emissions};
+    }
+
+    function evaluate(model, body) {
+        var values = {};
+        body.inputs.concat(body.state || []).forEach(function (input) {
+            values[input.id] = input.value;
+        });
+        var modes = model.modes;
+        var results = scenario(model, values);
+        var vkt = results.vkt, pkt = results.pkt, emissions = results.emissions;
+
+        // Totals and colours, as in update_graph
+        var colors = model.colors;
+        var emissionsNum = numpySum(emissions) / 1e9;
+        var emissionsColour;
+        if (emissionsNum > model.emissions_2030_baseline) {
+            emissionsColour = colors.electric_light;
+        } else if (emissionsNum > model.emissions_2018) {
+            emissionsColour = colors.passenger_light;
+        } else if (emissionsNum > model.emissions_2018 / 2) {
+            emissionsColour = colors.electric_bus;
+        } else {
+            emissionsColour = colors.walking;
+        }
+
+        var cars = model.car_rate * numpySum(model.registry.car_modes.map(function (m) { return vkt[m]; }));
+        var carColour;
+        if (cars > model.cars_2030_baseline) {
+            carColour = colors.electric_light;
+        } else if (cars > model.traffic_thresholds.high) {
+            carColour = colors.passenger_light;
+        } else if (cars > model.traffic_thresholds.moderate) {
+            carColour = colors.electric_bus;
+        } else {
+            carColour = colors.walking;
+        }
+
+        var result = JSON.parse(JSON.stringify(model.template));
+        var response = result.response;
+        model.trace_modes.forEach(function (mode, k) {
+            response.stacked_emissions.figure.data[k].y[2] = emissions[modes.indexOf(mode)];
+            response.stacked_emissions1.figure.data[k].y[2] = pkt[modes.indexOf(mode)];
+        });
+
+        // Saved scenarios to compare, as extra bars
+        var saved = values.saved_scenarios || {};
+        var names = (values.compare_included || []).filter(function (name) {
+            return saved.hasOwnProperty(name);
+        });
+        if (names.length > 0) {
+            var compared = names.map(function (name) {
+                return scenario(model, withDefaults(model, saved[name]));
+            });
+            model.trace_modes.forEach(function (mode, k) {
+                var m = modes.indexOf(mode);
+                [[response.stacked_emissions, 'emissions'], [response.stacked_emissions1, 'pkt']].forEach(function (figure) {
+                    var trace = figure[0].figure.data[k];
+                    trace.x = trace.x.slice(0, 3).concat(names);
+                    trace.y = trace.y.slice(0, 3).concat(compared.map(function (c) { return c[figure[1]][m]; }));
+                });
+            });
+        }
+        response.emissions_2030_scenario.style.color = emissionsColour;
+        response.emissions_2030_scenario.children = formatNumber(emissionsNum, 3) + ' Mt CO2-e';
+        response.cars_2030_scenario.style.color = carColour;
+        response.cars_2030_scenario.children = formatNumber(cars, 0) + ' cars ';
+        response.shapley_waterfall.figure = shapleyWaterfall(model, values, response.shapley_waterfall.figure);
+        return result;
+    }
+
+    function withDefaults(model, levers) {
+        var values = {};
+        Object.keys(model.lever_defaults).forEach(function (lever) {
+            values[lever] = levers.hasOwnProperty(lever) ? levers[lever] : model.lever_defaults[lever];
+        });
+        return values;
+    }
+
+    // save_scenario in app.py: null means no update
+    function saveScenario(model, body) {
+        var values = {};
+        body.state.forEach(function (input) {
+            values[input.id] = input.value;
+        });
+        var name = (values.scenario_name || '').trim();
+        if (!body.inputs[0].value || name === '') {
+            return null;
+        }
+        var saved = Object.assign({}, values.saved_scenarios || {});
+        var levers = {};
+        model.lever_names.forEach(function (lever) {
+            levers[lever] = values[lever];
+        });
+        saved[name] = levers;
+        return {response: {props: {data: saved}}};
+    }
+
+    // compare_options in app.py
+    function compareOptions(model, body) {
+        var saved = body.inputs[0].value || {};
+        return {response: {props: {options: Object.keys(saved).map(function (name) {
+            return {label: name, value: name};
+        })}}};
+    }
+
+    // sweep_status in app.py: there is no server to run background jobs on a static site
+    function sweepStatus(model, body) {
+        var clicked = body.inputs[0].value !== null && body.inputs[0].value !== undefined;
+        return {response: {
+            sweep_status: {children: clicked ? 'Exploring all choices needs the dashboard server.' : ''},
+            sweep_interval: {disabled: true},
+        }, multi: true};
+    }
+
+    // goal_seek.py: the outputs move in a straight line with each slider (with occupancy, in its reciprocal)
+    var goalTransforms = {
+        car_electrification_included: function (value) { return value; },
+        covid: function (value) { return value; },
+        occupancy_included: function (value) { return 1 / value; },
+    };
+    var goalOutputs = {
+        total_emissions: {name: '2030 emissions', decimals: 3, units: ' Mt CO2-e'},
+        cars: {name: 'cars on the road', decimals: 0, units: ' cars'},
+    };
+
+    function goalOutput(model, values, output) {
+        var results = scenario(model, values);
+        if (output === 'total_emissions') {
+            return numpySum(results.emissions) / 1e9;
+        }
+        return model.car_rate * numpySum(model.registry.car_modes.map(function (m) { return results.vkt[m]; }));
+    }
+
+    // lever_text in app.py
+    function leverText(lever, value) {
+        if (lever === 'occupancy_included') {
+            return (value / 100).toFixed(2) + ' people per car';
+        }
+        return String(Number(value.toPrecision(6))) + '%';
+    }
+
+    // goal_seek_solve in app.py, with the closed form of goal_seek.seek
+    function goalSeek(model, body) {
+        if (!body.inputs[0].value) {
+            return null;
+        }
+        var values = {};
+        body.state.forEach(function (input) {
+            values[input.id] = input.value;
+        });
+        var lever = values.goal_lever, output = values.goal_output, target = values.goal_target;
+        if (target === null || target === undefined || target === '') {
+            return {response: {goal_result: {children: 'Enter a target to reach.'}, goal_solution: {data: null}}, multi: true};
+        }
+        target = Number(target);
+
+        var transform = goalTransforms[lever];
+        var low = model.slider_ranges[lever][0], high = model.slider_ranges[lever][1];
+        var outputAt = function (value) {
+            var changed = Object.assign({}, values);
+            changed[lever] = value;
+            return goalOutput(model, changed, output);
+        };
+        var f0 = outputAt(low), f1 = outputAt(high), t0 = transform(low);
+        var slope = (f1 - f0) / (transform(high) - t0);
+        var line = function (value) {
+            return f0 + slope * (transform(value) - t0);
+        };
+        var value = slope === 0 ? (f0 === target ? low : null) : transform(t0 + (target - f0) / slope);
+        var reachable = value !== null && low - 1e-9 <= value && value <= high + 1e-9;
+        value = reachable ? Math.min(Math.max(value, low), high) : (Math.abs(f0 - target) <= Math.abs(f1 - target) ? low : high);
+
+        // Snap to a whole slider step, on the far side of the target from where the output is now
+        var candidates = [Math.floor(value), Math.ceil(value)].map(function (candidate) {
+            return Math.min(Math.max(candidate, low), high);
+        }).filter(function (candidate, k, all) {
+            return all.indexOf(candidate) === k;
+        });
+        var current = line(values[lever]);
+        var atCandidates = candidates.map(line);
+        var best = -1;
+        if (reachable) {
+            candidates.forEach(function (candidate, k) {
+                var reaches = current >= target ? atCandidates[k] <= target : atCandidates[k] >= target;
+                if (reaches && (best === -1 || Math.abs(candidate - value) < Math.abs(candidates[best] - value))) {
+                    best = k;
+                }
+            });
+        }
+        if (best === -1) {
+            best = 0;
+            atCandidates.forEach(function (found, k) {
+                if (Math.abs(found - target) < Math.abs(atCandidates[best] - target)) {
+                    best = k;
+                }
+            });
+        }
+
+        var format = function (found) {
+            return formatNumber(found, goalOutputs[output].decimals) + goalOutputs[output].units;
+        };
+        var text;
+        if (reachable) {
+            text = model.lever_titles[lever] + ': ' + leverText(lever, candidates[best]) + ' brings ' + goalOutputs[output].name +
+                ' to ' + format(atCandidates[best]) + ' (the target is reached at ' + leverText(lever, value) + ').';
+        } else {
+            text = format(target) + ' cannot be reached with this slider: ' + goalOutputs[output].name + ' range from ' +
+                format(Math.min(f0, f1)) + ' to ' + format(Math.max(f0, f1)) + '. The closest is ' + format(atCandidates[best]) +
+                ' at ' + leverText(lever, candidates[best]) + '.';
+        }
+        return {response: {
+            goal_result: {children: text},
+            goal_solution: {data: {
+                lever: lever, output: output, target: target, reachable: reachable, value: value,
+                snapped: candidates[best], achieved: atCandidates[best], current: current,
+                range: [Math.min(f0, f1), Math.max(f0, f1)], method: 'affine',
+            }},
+        }, multi: true};
+    }
+
+    // shapley_waterfall in app.py, with shapley.attribute: every subset of the changed levers and ticked projects.
+    // figure is the waterfall for the default inputs, which is filled in with these values
+    function shapleyWaterfall(model, values, figure) {
+        var parts = model.lever_names.filter(function (lever) {
+            return lever !== 'pt_included' && values[lever] !== model.lever_defaults[lever];
+        }).map(function (lever) {
+            return [lever, values[lever]];
+        }).concat(model.projects.filter(function (project) {
+            return (values.pt_included || []).indexOf(project) !== -1;
+        }).map(function (project) {
+            return ['pt_included', project];
+        }));
+        var k = parts.length;
+        if (k > model.max_components) {
+            return {data: [], layout: {title: {text: 'Too many changes to attribute (' + k + ', the most is ' + model.max_components + ')'}}};
+        }
+
+        var totals = [], sizes = [], mask, i;
+        for (mask = 0; mask < (1 << k); mask++) {
+            var subset = withDefaults(model, {});
+            subset.pt_included = [];
+            sizes.push(0);
+            for (i = 0; i < k; i++) {
+                if (mask >> i & 1) {
+                    sizes[mask] += 1;
+                    if (parts[i][0] === 'pt_included') {
+                        subset.pt_included.push(parts[i][1]);
+                    } else {
+                        subset[parts[i][0]] = parts[i][1];
+                    }
+                }
+            }
+            totals.push(numpySum(scenario(model, subset).emissions) / 1e9);
+        }
+
+        // Weight of adding a component to a subset of s others: s! (k - s - 1)! / k!
+        var factorial = function (n) {
+            return n <= 1 ? 1 : n * factorial(n - 1);
+        };
+        var contributions = parts.map(function (part, i) {
+            var contribution = 0;
+            for (mask = 0; mask < (1 << k); mask++) {
+                if (!(mask >> i & 1)) {
+                    contribution += factorial(sizes[mask]) * factorial(k - sizes[mask] - 1) / factorial(k) * (totals[mask | 1 << i] - totals[mask]);
+                }
+            }
+            return contribution;
+        });
+
+        // component_text in app.py
+        var texts = parts.map(function (part) {
+            if (part[0] === 'pt_included') {
+                return [model.option_labels.pt_included[part[1]], 'Included'];
+            }
+            if (model.option_labels.hasOwnProperty(part[0])) {
+                return [model.lever_titles[part[0]], model.option_labels[part[0]][String(part[1])]];
+            }
+            return [model.lever_titles[part[0]], leverText(part[0], part[1])];
+        });
+        var trace = figure.data[0];
+        trace.x = ['2030 Baseline'].concat(texts.map(function (text) { return text[0]; }), ['2030 Scenario']);
+        trace.y = [totals[0]].concat(contributions, [totals[totals.length - 1]]);
+        trace.measure = ['absolute'].concat(parts.map(function () { return 'relative'; }), ['total']);
+        trace.hovertext = [''].concat(texts.map(function (text) { return text[1]; }), ['']);
+        return figure;
+    }
+
+    // goal_seek_snap in app.py
+    function goalSnap(model, body) {
+        var solution = body.state[0].value;
+        if (!body.inputs[0].value || !solution) {
+            return null;
+        }
+        var response = {};
+        response[solution.lever] = {value: solution.snapped};
+        return {response: response, multi: true};
+    }
+
+    // show_info in app.py: the texts of the information sections are in model.json
+    function showInfo(model, body) {
+        var changed = body.changedPropIds || [];
+        var response = {};
+        body.inputs.forEach(function (input) {
+            if (changed.indexOf(input.id + '.n_clicks') !== -1 && input.value) {
+                var opened = input.value % 2 === 1;
+                response[input.id.replace(/_more$/, '_info')] = {children: opened ? model.info[input.id.replace(/_more$/, '')] : []};
+                response[input.id] = {children: opened ? 'Hide' : 'Read more'};
+            }
+        });
+        return Object.keys(response).length > 0 ? {response: response, multi: true} : null;
+    }
+
+    function respond(model, body) {
+        if (body.output === 'sweep_job.data') {
+            var clicked = body.inputs.some(function (input) { return input.value; });
+            return clicked ? {response: {props: {data: 'static'}}} : null;
+        }
+        if (body.output.indexOf('sweep_status.children') !== -1) {
+            return sweepStatus(model, body);
+        }
+        if (body.output.indexOf('goal_result.children') !== -1) {
+            return goalSeek(model, body);
+        }
+        if (body.output.indexOf('car_electrification_included.value') !== -1) {
+            return goalSnap(model, body);
+        }
+        if (body.output.indexOf('_info.children') !== -1) {
+            return showInfo(model, body);
+        }
+        if (body.output === 'saved_scenarios.data') {
+            return saveScenario(model, body);
+        }
+        if (body.output === 'compare_included.options') {
+            return compareOptions(model, body);
+        }
+        return evaluate(model, body);
+    }
+
+    function loadModel(model, buffer) {
+        model.states = new Float64Array(buffer);
+        return model;
+    }
+
+    if (typeof window !== 'undefined') {
+        var modelPromise = Promise.all([
+            window.fetch('model.json').then(function (response) { return response.json(); }),
+            window.fetch('states.bin').then(function (response) { return response.arrayBuffer(); }),
+        ]).then(function (loaded) {
+            return loadModel(loaded[0], loaded[1]);
+        });
+
+        var originalFetch = window.fetch;
+        window.fetch = function (url, options) {
+            if (typeof url === 'string' && url.indexOf('_dash-update-component') !== -1) {
+                return modelPromise.then(function (model) {
+                    var result = respond(model, JSON.parse(options.body));
+                    if (result === null) {
+                        return new Response(null, {status: 204});
+                    }
+                    return new Response(JSON.stringify(result), {status: 200, headers: {'Content-Type': 'application/json'}});
+                });
+            }
+            return originalFetch.apply(this, arguments);
+        };
+    }
+
+    if (typeof module !== 'undefined') {
+        module.exports = {evaluate: evaluate, respond: respond, loadModel: loadModel, numpySum: numpySum, shapleyWaterfall: shapleyWaterfall};
+    }
+})();
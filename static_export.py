@@ -0,0 +1,280 @@
+'''
+Export the whole dashboard as a static site, for hosting on a CDN with no Python at serve time.
+
+The export saves the page, its layout and callback definitions and the local component scripts,
+as Dash would serve them. The callback is answered in the browser by static_export.js, which
+replaces the request to the server with a calculation from a compact bundle:
+
+    states.bin  - the 2030 scenario vkt and pkt after the PT project, bus ridership and cycling changes,
+                  for every combination of those controls (float64)
+    model.json  - everything else update_graph needs: emission factors, constants, colours, the
+                  2018 and 2030 baseline numbers and the figures for the default inputs, and the
+                  text of the information sections
+
+The other controls are applied in the browser with the same arithmetic as update_graph, so the
+responses match what the server would send. The one difference is that ticked PT projects are
+always added up in the same order, which can change the last digit of a float. The Shapley
+waterfall is worked out from the same scenarios, one for each subset of the changed levers and
+projects, and matches shapley_waterfall to rounding.
+
+Usage:
+    python static_export.py static_site            # write the site to static_site/
+    python static_export.py static_site --check 500  # and compare 500 random scenarios with update_graph (needs node)
+'''
+import argparse
+import inspect
+import json
+import random
+import re
+import shutil
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import plotly
+
+import app
+import engine
+import fleet_size
+import goal_seek
+import mode_registry
+import shapley
+
+
+# Most PT projects the bundle can hold (it grows as 2^projects)
+max_projects = 16
+
+
+def discrete_states(numbers, base_numbers, pt_effects_vkt, pt_effects_pkt, projects, od_effects=None):
+    '''
+    This function runs the PT project, bus ridership and cycling changes for every combination of those controls
+
+    Inputs:
+        numbers - dictionary with key values for calculations
+        base_numbers - dataframe with pkt, vkt and emissions data for 2018, 2030 baseline and 2030 scenario
+        pt_effects_vkt, pt_effects_pkt - dataframes with the effect of each project on each mode
+        projects - list of PT projects, bit k of the project mask is projects[k]
+        od_effects - optional zone to zone effects (see od_demand.prepare)
+
+    Outputs:
+        cycling options x bus options x project masks x (vkt, pkt) x modes array
+    '''
+    modes = list(base_numbers.columns)
+    cycling_options = engine.lever_options['cycling_included']
+    bus_options = engine.lever_options['bus_prop_increase']
+    states = np.empty((len(cycling_options), len(bus_options), 2**len(projects), 2, len(modes)))
+
+    for i, cycling_included in enumerate(cycling_options):
+        for j, bus_prop_increase in enumerate(bus_options):
+            for mask in range(2**len(projects)):
+                pt_included = [project for k, project in enumerate(projects) if mask >> k & 1]
+                state = base_numbers.copy()
+                state = app.pt_projects_apply(state, pt_effects_vkt, pt_effects_pkt, pt_included, od_effects)
+                state = app.bus_ridership_changes(numbers, state, bus_prop_increase)
+                state = app.cycling_changes(numbers, state, cycling_included)
+                states[i, j, mask, 0] = state.loc['vkt_2030_scenario', modes].to_numpy(dtype=float)
+                states[i, j, mask, 1] = state.loc['pkt_2030_scenario', modes].to_numpy(dtype=float)
+    return states
+
+
+def bundle_model(projects):
+    '''
+    This function collects everything static_export.js needs besides the states
+
+    Inputs:
+        projects - list of PT projects, in project mask order
+
+    Outputs:
+        dictionary to save as model.json
+    '''
+    base_numbers = app.master_base_numbers
+    modes = list(base_numbers.columns)
+    defaults = [engine.lever_defaults[lever] for lever in engine.lever_names]
+    car_rate, cars_2018, cars_2030_baseline = fleet_size.base_counts(app.numbers, base_numbers)
+
+    return {
+        'modes': modes,
+        'trace_modes': list(mode_registry.registry.index),
+        'registry': {
+            'occupancy': mode_registry.registry.occupancy.reindex(modes).tolist(),
+            'car_modes': mode_registry.indices(modes, mode_registry.car_modes()).tolist(),
+            'electrification': {
+                category: [[modes.index(mode), modes.index(electric)] for mode, electric in zip(*mode_registry.electrification(category))]
+                for category in ['private', 'pt']
+            },
+        },
+        'projects': projects,
+        'options': {lever: engine.lever_options[lever] for lever in ['cycling_included', 'bus_prop_increase']},
+        'lever_names': engine.lever_names,
+        'lever_defaults': engine.lever_defaults,
+        'numbers': {key: app.numbers[key] for key in ['car_occupancy', 'bus_lifespan', 'all_modes', 'private_modes']},
+        'emission_factors': app.emission_factors.loc['values_2030_scenario', modes].tolist(),
+        'emissions_2018': base_numbers.loc['emissions_2018'].sum()/(10**9),
+        'emissions_2030_baseline': base_numbers.loc['emissions_2030_baseline'].sum()/(10**9),
+        'car_rate': float(car_rate),
+        'cars_2030_baseline': float(cars_2030_baseline),
+        'traffic_thresholds': fleet_size.traffic_thresholds,
+        'colors': app.colors,
+        'template': json.loads(app.update_graph(*defaults)),
+        'info': {section['id']: app.info_text(section) for section in app.info_sections},
+        'lever_titles': app.lever_titles,
+        'slider_ranges': {lever: engine.lever_options[lever] for lever in goal_seek.continuous_levers},
+        'option_labels': app.option_labels,
+        'max_components': shapley.max_components,
+    }
+
+
+def save_served_files(output_dir):
+    '''
+    This function saves the page, layout, callback definitions and local scripts as the server would serve them
+    '''
+    client = app.app.server.test_client()
+
+    page = client.get('/').get_data(as_text=True)
+    # Relative paths, so the site works from any directory on the host
+    page = page.replace('"requests_pathname_prefix": "/"', '"requests_pathname_prefix": "./"')
+    for path in re.findall(r'(?:src|href)="/([^"]+)"', page):
+        local = path.split('?')[0]
+        target = output_dir / local
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(client.get('/' + path).get_data())
+        page = page.replace('"/{}"'.format(path), '"{}"'.format(local))
+    # The callback shim has to be in place before the Dash renderer starts
+    page = page.replace('<footer>', '<footer>\n            <script src="static_export.js"></script>', 1)
+    (output_dir / 'index.html').write_text(page)
+
+    for route in ['_dash-layout', '_dash-dependencies']:
+        (output_dir / route).write_bytes(client.get('/' + route).get_data())
+    shutil.copy(Path(__file__).with_suffix('.js'), output_dir / 'static_export.js')
+
+
+def export(output_dir):
+    '''
+    Writes the static site to output_dir
+    '''
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    projects = list(app.pt_details.index)
+    if len(projects) > max_projects:
+        raise ValueError('Too many PT projects for a static export ({}, the most is {})'.format(len(projects), max_projects))
+
+    states = discrete_states(app.numbers, app.master_base_numbers, app.pt_effects_vkt, app.pt_effects_pkt, projects, app.od_effects)
+    states.astype('<f8').tofile(str(output_dir / 'states.bin'))
+    with open(output_dir / 'model.json', 'w') as f:
+        json.dump(bundle_model(projects), f, cls=plotly.utils.PlotlyJSONEncoder)
+    save_served_files(output_dir)
+
+
+def random_inputs(rng, projects):
+    '''
+    Random update_graph inputs from the values the controls allow, with projects in bundle order
+    '''
+    inputs = []
+    for lever in engine.lever_names:
+        if lever == 'pt_included':
+            inputs.append([project for project in projects if rng.random() < 0.5])
+        elif isinstance(engine.lever_options[lever], tuple):
+            inputs.append(rng.randint(*engine.lever_options[lever]))
+        else:
+            inputs.append(rng.choice(engine.lever_options[lever]))
+    return inputs
+
+
+def rounded(value, digits=12):
+    '''
+    Rounds every float in a response to the given significant digits, for comparing responses
+    that can differ in the last digit (see the module docstring)
+    '''
+    if isinstance(value, float):
+        return float('{:.{}g}'.format(value, digits))
+    if isinstance(value, list):
+        return [rounded(item, digits) for item in value]
+    if isinstance(value, dict):
+        return {key: rounded(item, digits) for key, item in value.items()}
+    return value
+
+
+def respond_with_node(output_dir, bodies):
+    '''
+    This function answers callback requests with the exported static_export.js, using node
+
+    Inputs:
+        output_dir - directory of an exported site
+        bodies - list of callback request bodies, as the Dash renderer sends them
+
+    Outputs:
+        list of the responses (None where the callback does not update)
+    '''
+    if shutil.which('node') is None:
+        raise SystemExit('Answering callbacks with static_export.js needs node')
+    script = '''
+        const fs = require('fs');
+        const shim = require(process.argv[1] + '/static_export.js');
+        const model = shim.loadModel(JSON.parse(fs.readFileSync(process.argv[1] + '/model.json')),
+                                     new Uint8Array(fs.readFileSync(process.argv[1] + '/states.bin')).buffer);
+        const bodies = JSON.parse(fs.readFileSync(0));
+        process.stdout.write(JSON.stringify(bodies.map(body => shim.respond(model, body))));
+    '''
+    result = subprocess.run(['node', '-e', script, str(Path(output_dir).resolve())], input=json.dumps(bodies),
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+
+def check(output_dir, n, seed=0):
+    '''
+    This function compares static_export.js with update_graph for n random scenarios, using node
+
+    Outputs:
+        number of scenarios where the responses differ
+    '''
+    output_dir = Path(output_dir).resolve()
+    rng = random.Random(seed)
+    projects = list(app.pt_details.index)
+    dependencies = json.loads((output_dir / '_dash-dependencies').read_text())
+    dependency = [item for item in dependencies if 'stacked_emissions.figure' in item['output']][0]
+    scenarios = []
+    for _ in range(n):
+        # Compare with up to two saved scenarios, some of the time
+        saved = {'saved {}'.format(k): dict(zip(engine.lever_names, random_inputs(rng, projects))) for k in range(rng.randint(0, 2))}
+        scenarios.append(random_inputs(rng, projects) + [list(saved), saved])
+    bodies = [
+        {'output': dependency['output'],
+         'inputs': [dict(item, value=value) for item, value in zip(dependency['inputs'], inputs)],
+         'state': [dict(item, value=value) for item, value in zip(dependency['state'], inputs[len(dependency['inputs']):])]}
+        for inputs in scenarios
+    ]
+
+    static_responses = respond_with_node(output_dir, bodies)
+
+    update_graph = inspect.unwrap(app.update_graph)
+    differences = 0
+    for inputs, static_response in zip(scenarios, static_responses):
+        *outputs, figure = json.loads(json.dumps(update_graph(*inputs), cls=plotly.utils.PlotlyJSONEncoder))
+        *expected, static_figure = [static_response['response'][id][prop] for id, prop in
+                                    (item.split('.') for item in dependency['output'].strip('.').split('...'))]
+        # The Shapley values are weighted sums over thousands of scenarios, added up in a different order
+        if rounded(outputs) != rounded(expected) or rounded(figure, 9) != rounded(static_figure, 9):
+            differences += 1
+            print('Differs for', inputs)
+    return differences
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the dashboard as a static site')
+    parser.add_argument('output_dir', help='directory to write the site to')
+    parser.add_argument('--check', type=int, default=0, metavar='N',
+                        help='compare N random scenarios against update_graph (needs node)')
+    args = parser.parse_args(argv)
+
+    export(args.output_dir)
+    print('Exported to', args.output_dir)
+    if args.check:
+        differences = check(args.output_dir, args.check)
+        print('{} of {} scenarios differ from update_graph'.format(differences, args.check))
+        if differences:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+'''
+Sweeps over every combination of the dashboard controls, in bounded memory.
+
+A full factorial sweep (every option of every control, every position of every slider and every
+combination of PT projects) is billions of scenarios, far too many to hold at once. Here every
+scenario has a number: the controls are the digits of a mixed radix number, in engine.lever_names
+order with the last control changing fastest (as itertools.product), and the PT projects a
+bitmask. Any range of scenario numbers can then be built straight from the numbers, so a sweep is
+evaluated as a stream of fixed size chunks:
+
+    levels = sweeps.lever_levels(projects)
+    for chunk in sweeps.iterate(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, levels):
+        ...
+
+Each chunk is a dictionary of the scenario numbers ('index') and the outputs asked for, which
+can be stored as float32 to halve their size (the calculations are still done in float64). The
+lever values for any chunk are decode(chunk['index'], levels, projects).
+
+A reduce hook applied to every chunk keeps only what is needed: below() keeps the scenarios under
+an emissions threshold, LeverExtremes keeps the lowest and highest emissions for every value of
+every control. save_chunks streams chunks to disk.
+'''
+from pathlib import Path
+
+import numpy as np
+
+import engine
+
+
+# Outputs a chunk can hold, from engine.evaluate_batch
+output_names = ['vkt', 'pkt', 'emissions', 'total_emissions', 'cars']
+
+# Scenario numbers are int64, so a sweep can have at most this many scenarios
+max_scenarios = 2**63 - 1
+
+
+def check_size(total):
+    '''
+    Raises ValueError if a sweep of total scenarios cannot be numbered as int64
+    '''
+    if total > max_scenarios:
+        raise ValueError('Too many scenarios to sweep ({:.3g}, the most is 2**63 - 1); sweep fewer values of '
+                         'some controls or fewer PT projects'.format(total))
+
+
+def lever_levels(projects, levels=None):
+    '''
+    This function lists the values of each control to sweep over
+
+    Inputs:
+        projects - list of PT projects, bit k of the project mask is projects[k]
+        levels - optional dictionary of values to use for some controls instead of all of them
+                 (e.g. {'car_electrification_included': range(0, 101, 10)}); for pt_included,
+                 a list of lists of projects
+
+    Outputs:
+        dictionary with an array of values for each control, in engine.lever_names order;
+        pt_included holds project bitmasks (raises ValueError if there are too many scenarios to number)
+    '''
+    levels = dict(levels or {})
+    result = {}
+    for lever in engine.lever_names:
+        if lever == 'pt_included':
+            if len(projects) > 62:
+                raise ValueError('Too many PT projects to sweep every combination ({}, the most is 62)'.format(len(projects)))
+            if lever not in levels:
+                values = None # Every combination, listed once the size of the sweep is checked
+            elif all(isinstance(value, (int, np.integer)) for value in levels[lever]):
+                values = np.asarray(levels[lever], dtype=np.int64)
+            else:
+                values = np.array([sum(1 << projects.index(project) for project in included) for included in levels[lever]], dtype=np.int64)
+        elif lever in levels:
+            values = np.asarray(levels[lever], dtype=float)
+        elif isinstance(engine.lever_options[lever], tuple):
+            values = np.arange(engine.lever_options[lever][0], engine.lever_options[lever][1] + 1, dtype=float)
+        else:
+            values = np.asarray(engine.lever_options[lever], dtype=float)
+        result[lever] = values
+
+    combinations = 2**len(projects) if result['pt_included'] is None else 1
+    check_size(size({lever: values for lever, values in result.items() if values is not None}) * combinations)
+    if result['pt_included'] is None:
+        result['pt_included'] = np.arange(combinations, dtype=np.int64)
+    return result
+
+
+def size(levels):
+    '''
+    Returns the number of scenarios in a sweep, as a Python int
+    '''
+    total = 1
+    for values in levels.values():
+        total *= len(values)
+    return total
+
+
+def digits(index, levels):
+    '''
+    This function finds the position of each control's value for scenario numbers
+
+    Inputs:
+        index - array of scenario numbers
+        levels - dictionary from lever_levels
+
+    Outputs:
+        dictionary with an array of value positions for each control
+    '''
+    index = np.asarray(index, dtype=np.int64)
+    positions = {}
+    for lever in reversed(list(levels)):
+        positions[lever] = index % len(levels[lever])
+        index = index // len(levels[lever])
+    return {lever: positions[lever] for lever in levels}
+
+
+def decode(index, levels, projects):
+    '''
+    This function builds the lever settings for scenario numbers
+
+    Inputs:
+        index - array of scenario numbers
+        levels - dictionary from lever_levels
+        projects - list of PT projects
+
+    Outputs:
+        batch - dictionary of lever arrays (see engine.make_batch)
+    '''
+    batch = {lever: levels[lever][position] for lever, position in digits(index, levels).items()}
+    bitmasks = batch['pt_included']
+    batch['pt_included'] = (bitmasks[:, np.newaxis] >> np.arange(len(projects), dtype=np.int64)) & 1 == 1
+    return batch
+
+
+def iterate(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt, levels, start=0, stop=None,
+            chunk_size=100000, dtype=np.float64, outputs=('total_emissions', 'cars'), reduce=None, **options):
+    '''
+    This function evaluates a sweep a chunk at a time
+
+    Inputs:
+        numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt - as for engine.evaluate_batch
+        levels - dictionary from lever_levels
+        start, stop - range of scenario numbers to evaluate (default the whole sweep)
+        chunk_size - scenarios per chunk
+        dtype - type to store the outputs as (e.g. np.float32)
+        outputs - names of the outputs to keep (see output_names)
+        reduce - optional function applied to each chunk, whose result is yielded instead of the chunk
+                 (nothing is yielded when it returns None)
+        options - passed on to engine.evaluate_batch (mode_costs, od_effects)
+
+    Outputs:
+        generator of chunks: dictionaries of 'index' (scenario numbers) and each output, as dtype
+    '''
+    projects = list(pt_effects_pkt.index)
+    check_size(size(levels))
+    stop = size(levels) if stop is None else stop
+    for begin in range(start, stop, chunk_size):
+        index = np.arange(begin, min(begin + chunk_size, stop), dtype=np.int64)
+        results = engine.evaluate_batch(numbers, base_numbers, emission_factors, pt_effects_vkt, pt_effects_pkt,
+                                        decode(index, levels, projects), **options)
+        results['total_emissions'] = engine.total_emissions(results)
+        chunk = {'index': index}
+        for name in outputs:
+            chunk[name] = results[name].astype(dtype, copy=False)
+        del results
+
+        if reduce is None:
+            yield chunk
+        else:
+            reduced = reduce(chunk)
+            if reduced is not None:
+                yield reduced
+
+
+def below(limit, output='total_emissions'):
+    '''
+    Returns a reduce hook that keeps only the scenarios with output below limit
+    '''
+    def keep(chunk):
+        selected = chunk[output] < limit
+        if not selected.any():
+            return None
+        return {name: values[selected] for name, values in chunk.items()}
+    return keep
+
+
+class LeverExtremes:
+    '''
+    Reduce hook keeping the lowest and highest output (and the scenarios giving them) for every
+    value of every control. Nothing is yielded; the extremes are read from result() at the end
+    '''
+    def __init__(self, levels, output='total_emissions'):
+        self.levels = levels
+        self.output = output
+        self.minimum = {lever: np.full(len(values), np.inf) for lever, values in levels.items()}
+        self.maximum = {lever: np.full(len(values), -np.inf) for lever, values in levels.items()}
+        self.argmin = {lever: np.full(len(values), -1, dtype=np.int64) for lever, values in levels.items()}
+        self.argmax = {lever: np.full(len(values), -1, dtype=np.int64) for lever, values in levels.items()}
+
+    def __call__(self, chunk):
+        values = np.asarray(chunk[self.output], dtype=float)
+        for lever, position in digits(chunk['index'], self.levels).items():
+            # Sorted by position then value, the first and last scenario of each position are its lowest and highest
+            order = np.lexsort((values, position))
+            sorted_position = position[order]
+            first = np.flatnonzero(np.r_[True, sorted_position[1:] != sorted_position[:-1]])
+            last = np.r_[first[1:] - 1, len(order) - 1]
+            for lowest, ends in [(True, first), (False, last)]:
+                found = np.full(len(self.levels[lever]), np.nan)
+                found_index = np.full(len(self.levels[lever]), -1, dtype=np.int64)
+                found[sorted_position[ends]] = values[order[ends]]
+                found_index[sorted_position[ends]] = chunk['index'][order[ends]]
+                self._update(lowest, lever, found, found_index)
+        return None
+
+    def _update(self, lowest, lever, found, found_index):
+        extreme, best = (self.minimum, self.argmin) if lowest else (self.maximum, self.argmax)
+        with np.errstate(invalid='ignore'):
+            better = (found < extreme[lever]) if lowest else (found > extreme[lever])
+        extreme[lever] = np.where(better, found, extreme[lever])
+        best[lever] = np.where(better, found_index, best[lever])
+
+    def merge(self, other):
+        '''
+        Adds the extremes found by another LeverExtremes over other scenarios (e.g. another shard)
+        '''
+        for lever in self.levels:
+            self._update(True, lever, other.minimum[lever], other.argmin[lever])
+            self._update(False, lever, other.maximum[lever], other.argmax[lever])
+        return self
+
+    def result(self):
+        '''
+        Returns a dictionary with, for each control, a dictionary of its 'values' and the
+        'min' and 'max' output for each value, and the scenario numbers giving them
+        '''
+        return {lever: {
+            'values': values,
+            'min': self.minimum[lever],
+            'max': self.maximum[lever],
+            'argmin': self.argmin[lever],
+            'argmax': self.argmax[lever],
+        } for lever, values in self.levels.items()}
+
+
+def save_chunks(chunks, directory):
+    '''
+    This function writes each chunk to its own .npz file, named by its first scenario number
+
+    Outputs:
+        number of chunks written
+    '''
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    count = 0
+    for chunk in chunks:
+        if len(chunk['index']) == 0:
+            continue
+        np.savez(directory / '{:020d}.npz'.format(int(chunk['index'][0])), **chunk)
+        count += 1
+    return count
+
+
+def load_chunks(directory):
+    '''
+    Generator of the chunks written by save_chunks, in scenario number order
+    '''
+    for path in sorted(Path(directory).glob('*.npz')):
+        with np.load(path) as data:
+            yield {name: data[name] for name in data.files}
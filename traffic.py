@@ -0,0 +1,277 @@
+'''
+Recording and replaying update_graph traffic, for load testing with real interaction patterns.
+
+Recording: when the app is started with TRAFFIC_LOG set to a file path, every update_graph call
+is added to a bounded in-memory buffer with its inputs, session id (the X-Session-Id header, see
+coalescing.py), start time and duration. A background thread drains the buffer into a JSON lines
+file, rotating it when it gets too large. The callback never waits on the file: if the writer falls
+behind, the oldest unwritten records are dropped. Each process writes its own file, named with its
+process id (traffic_logs/update_graph.<pid>.jsonl for TRAFFIC_LOG=traffic_logs/update_graph.jsonl),
+so gunicorn workers never append to or rotate each other's files.
+
+Replaying: fires the recorded calls of every process's file at a running server, keeping their
+original spacing (optionally sped up) and session ids, and reports latency percentiles and throughput.
+
+Usage:
+    TRAFFIC_LOG=traffic_logs/update_graph.jsonl python app.py
+    python traffic.py traffic_logs/update_graph.jsonl --url http://127.0.0.1:8050 --speed 4 --concurrency 8
+'''
+import argparse
+import atexit
+import collections
+import json
+import math
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import coalescing
+
+
+class Recorder:
+    '''
+    Buffers update_graph calls in memory and writes them to a rotating JSON lines file from a background thread
+    '''
+    def __init__(self, path, buffer_size=10000, max_bytes=50 * 2**20, backup_count=5, flush_interval=1.0):
+        '''
+        Inputs:
+            path - file to write the records to, with the process id added before the suffix
+            buffer_size - the most records held in memory waiting to be written
+            max_bytes - size at which the file is rotated (path -> path.1 -> path.2 ...)
+            backup_count - number of rotated files to keep
+            flush_interval - seconds between writes
+        '''
+        path = Path(path)
+        self.path = path.with_name('{}.{}{}'.format(path.stem, os.getpid(), path.suffix))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.buffer = collections.deque(maxlen=buffer_size)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._write_lock = threading.Lock()
+
+        threading.Thread(target=self._write_loop, daemon=True).start()
+        atexit.register(self.flush)
+
+    def record(self, inputs, start, duration, session=None):
+        '''
+        Adds one call to the buffer. This only appends to a deque, so it is safe to call from the callback
+        '''
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append((start, duration, inputs, session))
+
+    def flush(self):
+        '''
+        Writes everything in the buffer to the file
+        '''
+        with self._write_lock:
+            lines = []
+            while True:
+                try:
+                    start, duration, inputs, session = self.buffer.popleft()
+                except IndexError:
+                    break
+                lines.append(json.dumps({'time': start, 'duration': duration, 'inputs': list(inputs), 'session': session}) + '\n')
+            if not lines:
+                return
+            if self.path.exists() and self.path.stat().st_size >= self.max_bytes:
+                self._rotate()
+            with open(self.path, 'a') as f:
+                f.writelines(lines)
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            older = self.path.with_name('{}.{}'.format(self.path.name, i))
+            if older.exists():
+                older.replace(self.path.with_name('{}.{}'.format(self.path.name, i + 1)))
+        if self.backup_count > 0:
+            self.path.replace(self.path.with_name(self.path.name + '.1'))
+        else:
+            self.path.unlink()
+
+    def _write_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+def recorded(recorder):
+    '''
+    Decorator which records every call of the callback to the recorder (does nothing if recorder is None)
+    '''
+    def decorator(function):
+        if recorder is None:
+            return function
+
+        def wrapper(*args):
+            start = time.time()
+            started = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                recorder.record(args, start, time.perf_counter() - started, coalescing.current_session())
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        wrapper.__wrapped__ = function
+        return wrapper
+    return decorator
+
+
+def read_records(path):
+    '''
+    Reads a recorded log (the TRAFFIC_LOG path): every process's file and their rotated files, oldest
+    record first
+    '''
+    path = Path(path)
+    files = sorted(path.parent.glob('{}.*{}*'.format(path.stem, path.suffix))) + sorted(path.parent.glob(path.name + '*'))
+    records = []
+    for file in sorted(set(files)):
+        with open(file) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda record: record['time'])
+    return records
+
+
+class CallbackClient:
+    '''
+    Sends update_graph inputs to a running server the same way the browser does
+    '''
+    def __init__(self, url, headers=None, timeout=60):
+        self.url = url.rstrip('/')
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+        # The update_graph output id, input and state properties, as the browser gets them
+        with urllib.request.urlopen(self.url + '/_dash-dependencies', timeout=timeout) as response:
+            dependency = [item for item in json.loads(response.read()) if 'stacked_emissions.figure' in item['output']][0]
+        self.output = dependency['output']
+        self.inputs = [(item['id'], item['property']) for item in dependency['inputs']]
+        self.state = [(item['id'], item['property']) for item in dependency['state']]
+
+    def payload(self, inputs, changed=None):
+        '''
+        Builds the request body for one set of inputs (in update_graph argument order, inputs then
+        state). Any left off the end are sent as None
+        '''
+        values = list(inputs) + [None] * (len(self.inputs) + len(self.state) - len(inputs))
+        body = {
+            'output': self.output,
+            'inputs': [{'id': id, 'property': prop, 'value': value} for (id, prop), value in zip(self.inputs, values)],
+            'state': [{'id': id, 'property': prop, 'value': value} for (id, prop), value in zip(self.state, values[len(self.inputs):])],
+        }
+        if changed is not None:
+            body['changedPropIds'] = ['{}.{}'.format(*self.inputs[changed])]
+        return json.dumps(body).encode()
+
+    def post(self, inputs, changed=None, headers=None):
+        '''
+        Sends one callback request, returning (status code, seconds taken)
+        '''
+        request = urllib.request.Request(
+            self.url + '/_dash-update-component',
+            data=self.payload(inputs, changed),
+            headers=dict(self.headers, **(headers or {}), **{'Content-Type': 'application/json'}),
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        except OSError:
+            status = 0
+        return status, time.perf_counter() - start
+
+
+def percentile(values, p):
+    '''
+    Nearest-rank percentile of a list of values
+    '''
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+
+def latency_report(results, elapsed):
+    '''
+    This function summarises a load test
+
+    Inputs:
+        results - list of (status code, seconds) for each request
+        elapsed - wall-clock seconds for the whole test
+
+    Outputs:
+        dictionary of request counts, throughput and latency percentiles (in ms)
+    '''
+    latencies = [seconds for status, seconds in results if status == 200]
+    # 204 is a request dropped because a newer one from the same session superseded it
+    superseded = sum(1 for status, seconds in results if status == 204)
+    return {
+        'requests': len(results),
+        'superseded': superseded,
+        'errors': len(results) - len(latencies) - superseded,
+        'elapsed_s': elapsed,
+        'throughput_rps': len(results) / elapsed if elapsed > 0 else float('nan'),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def print_report(report):
+    for key, value in report.items():
+        print('{:<16}{:>12.2f}'.format(key, value) if isinstance(value, float) else '{:<16}{:>12}'.format(key, value))
+
+
+def replay(records, client, speed=1.0, concurrency=4):
+    '''
+    This function fires recorded calls at the server, keeping their original spacing
+
+    Inputs:
+        records - list of recorded calls (see read_records)
+        client - CallbackClient for the server
+        speed - speed multiplier for the gaps between calls (0 sends them as fast as possible)
+        concurrency - the most requests in flight at once
+
+    Outputs:
+        latency report (see latency_report)
+    '''
+    futures = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            if speed > 0:
+                delay = (record['time'] - records[0]['time']) / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            # Each recorded tab sends its own session id again, so coalescing sees the same sessions
+            headers = {coalescing.header_name: record['session']} if record.get('session') else None
+            futures.append(pool.submit(client.post, record['inputs'], None, headers))
+        results = [future.result() for future in futures]
+    return latency_report(results, time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay recorded update_graph traffic against a running server')
+    parser.add_argument('log', help='recorded traffic log (TRAFFIC_LOG from the app)')
+    parser.add_argument('--url', default='http://127.0.0.1:8050', help='address of the server')
+    parser.add_argument('--speed', type=float, default=1.0, help='speed multiplier, 0 for as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=4, help='most requests in flight at once')
+    args = parser.parse_args(argv)
+
+    records = read_records(args.log)
+    recorded_durations = [record['duration'] for record in records]
+    print('Replaying {} calls (recorded p50 {:.1f} ms, p95 {:.1f} ms)'.format(
+        len(records), percentile(recorded_durations, 50) * 1000, percentile(recorded_durations, 95) * 1000))
+    print_report(replay(records, CallbackClient(args.url), args.speed, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
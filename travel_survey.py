@@ -0,0 +1,340 @@
+'''
+Builds the 2018 and 2030 vkt and pkt of base_numbers.csv from household travel survey trip records.
+
+The trip records are CSV files with one row per person trip, and these columns:
+
+    wave        - survey wave the trip was recorded in (optional; the file name otherwise)
+    mode        - mode of the trip, as in modes.csv, or a survey code mapped to one with --mode-map
+    distance    - km travelled
+    weight      - expansion factor: the trips on an average day the record stands for
+    occupancy   - people in the vehicle, driver included (optional; used for the car modes)
+
+Other columns are ignored. The files can be tens of millions of rows, so they are read a chunk at
+a time and only sums are kept: for every file, wave and mode, the number of trips, their weight,
+their weighted km (pkt) and, for trips with an occupancy, their weighted km shared between the
+people in the car (vkt). Memory use is set by the chunk size, not by the size of the survey.
+
+The sums are kept in a state file, so that when a new wave is added (as a new file, or as rows
+appended to the end of a file) only the new rows are read. A file whose earlier rows have changed
+is read again from the start. Files must be appended whole lines at a time.
+
+Each wave is expanded to a year on its own (weight x distance x annualisation), and the 2018
+numbers are the mean over the waves. From them:
+
+    pkt_2018            - the survey pkt of every mode
+    vkt_2018            - car modes: the survey vkt (trips without an occupancy at numbers['car_occupancy']);
+                          person modes: their pkt; PT: unchanged, since it is set by the services run
+    2030 baseline       - private and active modes grown by the population growth of the current
+                          table; PT pkt held at 2018 and PT vkt unchanged (as in the current table)
+    2030 scenario       - the same as the 2030 baseline
+    emissions           - placeholders, worked out by app.data_load
+
+Usage:
+    python travel_survey.py trips/*.csv                                   # write survey_base_numbers.csv
+    python travel_survey.py trips/*.csv --state survey_state.json         # and keep the sums for the next wave
+    python travel_survey.py trips/wave_*.csv --mode-map survey_modes.csv --waves 2018a 2018b --output base_numbers.csv
+'''
+import argparse
+import hashlib
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import mode_registry
+
+
+# Sums kept for every file, wave and mode
+sums = ['trips', 'weight', 'pkt', 'occupancy_pkt', 'occupancy_vkt']
+
+# Trip records read at a time
+default_chunk_size = 10**6
+
+# Days in a year, as the weights expand a record to the trips of an average day
+default_annualisation = 365.0
+
+# Columns read from the trip records (any others are skipped)
+columns = ['wave', 'mode', 'distance', 'weight', 'occupancy']
+
+# Bytes hashed at the start of a file and before the end of what was read, to tell appended rows from changed ones
+check_bytes = 2**16
+
+
+def load_mode_map(path):
+    '''
+    This function reads a mapping of survey mode codes to model modes
+
+    Inputs:
+        path - CSV file with survey_mode and mode columns; a blank mode leaves the trips out
+               (e.g. ferry and air travel, which the model does not cover)
+
+    Outputs:
+        dictionary of survey mode: mode ('' to leave out)
+    '''
+    mapping = pd.read_csv(path, dtype = str, keep_default_na = False)
+    unknown = sorted(set(mapping['mode']) - set(mode_registry.registry.index) - {''})
+    if unknown:
+        raise ValueError('Modes in {} not in modes.csv: {}'.format(path, ', '.join(unknown)))
+    return dict(zip(mapping.survey_mode, mapping['mode']))
+
+
+def file_check(path, end):
+    '''
+    Returns a hash of the start of a file and of the bytes before end, to check that what was read up to end is unchanged
+    '''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        digest.update(f.read(min(check_bytes, end)))
+        f.seek(max(end - check_bytes, 0))
+        digest.update(f.read(min(check_bytes, end)))
+    return digest.hexdigest()
+
+
+def aggregate_chunk(chunk, wave, mode_map=None):
+    '''
+    This function sums a chunk of trip records by wave and mode
+
+    Inputs:
+        chunk - dataframe of trip records, with mode (and wave, if there is one) as categories
+        wave - wave for records without a wave column
+        mode_map - optional dictionary of survey mode: mode (see load_mode_map)
+
+    Outputs:
+        dataframe of sums (columns) by wave and mode, number of invalid records, number of records left out
+    '''
+    # Modes are looked up once per category rather than once per record
+    modes = list(mode_registry.registry.index)
+    categories = chunk['mode'].cat.categories.astype(str)
+    mapped = categories.map(mode_map) if mode_map is not None else categories
+    unknown = ~(mapped.isin(modes) | (mapped == ''))
+    if unknown.any():
+        raise ValueError('Unknown modes in the trip records: {} (map them with a mode map)'.format(', '.join(categories[unknown][:10])))
+    codes = chunk['mode'].cat.codes.to_numpy()
+    mode_index = np.array([modes.index(mode) if mode in modes else -1 for mode in mapped] + [-1], dtype = int)[codes]
+
+    if 'wave' in chunk:
+        waves = list(chunk['wave'].cat.categories.astype(str))
+        wave_index = chunk['wave'].cat.codes.to_numpy()
+    else:
+        waves = [wave]
+        wave_index = np.zeros(len(chunk), dtype = int)
+
+    distance = pd.to_numeric(chunk['distance'], errors = 'coerce').to_numpy(dtype = float)
+    weight = pd.to_numeric(chunk['weight'], errors = 'coerce').to_numpy(dtype = float)
+    occupancy = (pd.to_numeric(chunk['occupancy'], errors = 'coerce').to_numpy(dtype = float)
+                 if 'occupancy' in chunk else np.full(len(chunk), np.nan))
+    invalid = ~(np.isfinite(distance) & np.isfinite(weight) & (distance >= 0) & (weight >= 0)) | (codes < 0) | (wave_index < 0)
+    dropped = ~invalid & (mode_index < 0)
+    keep = ~invalid & ~dropped
+
+    # One bin for every wave and mode
+    key = wave_index[keep] * len(modes) + mode_index[keep]
+    pkt = (weight * distance)[keep]
+    has_occupancy = np.isfinite(occupancy[keep]) & (occupancy[keep] >= 1)
+    values = {
+        'trips': None,
+        'weight': weight[keep],
+        'pkt': pkt,
+        'occupancy_pkt': np.where(has_occupancy, pkt, 0.0),
+        'occupancy_vkt': np.where(has_occupancy, pkt / np.where(has_occupancy, occupancy[keep], 1.0), 0.0),
+    }
+    bins = len(waves) * len(modes)
+    found = pd.DataFrame({name: np.bincount(key, weights = value, minlength = bins) for name, value in values.items()})
+    found.index = pd.MultiIndex.from_product([waves, modes], names = ['wave', 'mode'])
+    return found[found.trips > 0], int(invalid.sum()), int(dropped.sum())
+
+
+def read_file(path, entry=None, chunk_size=default_chunk_size, mode_map=None):
+    '''
+    This function reads the trip records of a file not yet read, or only the rows appended since it was
+
+    Inputs:
+        path - CSV file of trip records
+        entry - the file's entry in the state from the last time it was read (None to read it all)
+        chunk_size - records read at a time
+        mode_map - optional dictionary of survey mode: mode
+
+    Outputs:
+        the file's new entry for the state, and the number of records and bytes read
+    '''
+    size = Path(path).stat().st_size
+    if entry is not None and entry['bytes'] <= size and entry['check'] == file_check(path, entry['bytes']):
+        start, partials = entry['bytes'], pd.DataFrame(entry['partials'], columns = ['wave', 'mode'] + sums).set_index(['wave', 'mode'])
+        invalid, dropped, header = entry['invalid'], entry['dropped'], entry['header']
+    else:
+        start, partials, invalid, dropped, header = 0, None, 0, 0, None
+
+    rows = 0
+    if start < size:
+        if header is None:
+            header = list(pd.read_csv(path, nrows = 0).columns)
+            missing = [column for column in ['mode', 'distance', 'weight'] if column not in header]
+            if missing:
+                raise ValueError('Trip records {} have no {} column'.format(path, ', '.join(missing)))
+        with open(path, 'rb') as f:
+            f.seek(start)
+            # Past the header, appended rows are read with the header from the start of the file
+            options = {'header': None, 'names': header} if start > 0 else {}
+            for chunk in pd.read_csv(f, chunksize = chunk_size, usecols = lambda column: column in columns,
+                                     dtype = {'mode': 'category', 'wave': 'category'}, **options):
+                found, chunk_invalid, chunk_dropped = aggregate_chunk(chunk, Path(path).stem, mode_map)
+                partials = found if partials is None else partials.add(found, fill_value = 0)
+                invalid += chunk_invalid
+                dropped += chunk_dropped
+                rows += len(chunk)
+
+    if partials is None:
+        partials = pd.DataFrame(columns = sums, index = pd.MultiIndex.from_arrays([[], []], names = ['wave', 'mode']))
+    entry = {
+        'bytes': size,
+        'check': file_check(path, size),
+        'header': header,
+        'invalid': invalid,
+        'dropped': dropped,
+        'partials': partials.reset_index().values.tolist(),
+    }
+    return entry, rows, size - start
+
+
+def ingest(paths, state=None, chunk_size=default_chunk_size, mode_map=None):
+    '''
+    This function brings the sums of the trip records up to date, reading only the rows not read before
+
+    Inputs:
+        paths - list of CSV files of trip records
+        state - the state from the last ingest (see load_state), or None to read every file from the start
+        chunk_size - records read at a time
+        mode_map - optional dictionary of survey mode: mode
+
+    Outputs:
+        the updated state, and a report of the records, bytes and seconds taken
+    '''
+    state = {'files': {}} if state is None else state
+    report = {'files': 0, 'records': 0, 'bytes': 0, 'seconds': 0.0}
+    start = time.perf_counter()
+    for path in paths:
+        key = str(Path(path).resolve())
+        entry, rows, read = read_file(path, state['files'].get(key), chunk_size, mode_map)
+        state['files'][key] = entry
+        report['files'] += read > 0
+        report['records'] += rows
+        report['bytes'] += read
+    report['seconds'] = time.perf_counter() - start
+    report['invalid'] = sum(entry['invalid'] for entry in state['files'].values())
+    report['dropped'] = sum(entry['dropped'] for entry in state['files'].values())
+    return state, report
+
+
+def load_state(path):
+    '''
+    Returns the state saved by save_state, or None if there is none
+    '''
+    path = Path(path)
+    return json.loads(path.read_text()) if path.exists() else None
+
+
+def save_state(state, path):
+    '''
+    Saves the state, so the next ingest only reads new rows
+    '''
+    Path(path).write_text(json.dumps(state))
+
+
+def wave_totals(state, waves=None):
+    '''
+    This function adds up the sums of every file by wave and mode
+
+    Inputs:
+        state - from ingest
+        waves - optional list of the waves to keep
+
+    Outputs:
+        dataframe of sums (columns) by wave and mode
+    '''
+    partials = [row for entry in state['files'].values() for row in entry['partials']]
+    totals = pd.DataFrame(partials, columns = ['wave', 'mode'] + sums).groupby(['wave', 'mode'])[sums].sum()
+    if waves is not None:
+        missing = sorted(set(map(str, waves)) - set(totals.index.get_level_values('wave')))
+        if missing:
+            raise ValueError('No trip records for waves: {}'.format(', '.join(missing)))
+        totals = totals[totals.index.get_level_values('wave').isin([str(wave) for wave in waves])]
+    return totals
+
+
+def build_base_numbers(totals, template, car_occupancy, annualisation=default_annualisation):
+    '''
+    This function makes the base_numbers table from the survey sums (see the module docstring)
+
+    Inputs:
+        totals - sums by wave and mode, from wave_totals
+        template - the current base_numbers table, for the PT vkt and the population growth to 2030
+        car_occupancy - people per car for car trips without an occupancy
+        annualisation - days in a year (the weights expand to an average day)
+
+    Outputs:
+        base_numbers dataframe, in the layout of base_numbers.csv
+    '''
+    modes = list(template.columns)
+    n_waves = totals.index.get_level_values('wave').nunique()
+    if n_waves == 0:
+        raise ValueError('No trip records to build base_numbers from')
+    # Mean over the waves, each expanded to a year
+    by_mode = totals.groupby(level = 'mode').sum().reindex(modes, fill_value = 0.0) * annualisation / n_waves
+
+    rules = mode_registry.registry.occupancy.reindex(modes)
+    pkt_2018 = by_mode.pkt
+    vkt_2018 = pkt_2018.where(rules == 'person', template.loc['vkt_2018', modes])
+    cars = rules == 'car'
+    vkt_2018[cars] = by_mode.occupancy_vkt[cars] + (by_mode.pkt[cars] - by_mode.occupancy_pkt[cars]) / car_occupancy
+
+    # Private and active modes grow with the population, as in the current table; PT stays at 2018
+    growing = mode_registry.registry.category.reindex(modes) != 'pt'
+    growth = template.loc['pkt_2030_baseline', growing].sum() / template.loc['pkt_2018', growing].sum()
+    pkt_2030 = pkt_2018.where(~growing, pkt_2018 * growth)
+    vkt_2030 = (vkt_2018 * growth).where(growing, template.loc['vkt_2030_baseline', modes])
+
+    base_numbers = pd.DataFrame(0.0, index = template.index, columns = modes)
+    base_numbers.loc['vkt_2018'] = vkt_2018
+    base_numbers.loc['pkt_2018'] = pkt_2018
+    for scenario in ['2030_baseline', '2030_scenario']:
+        base_numbers.loc['vkt_' + scenario] = vkt_2030
+        base_numbers.loc['pkt_' + scenario] = pkt_2030
+    return base_numbers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build base_numbers from travel survey trip records')
+    parser.add_argument('trips', nargs='+', help='CSV files of trip records')
+    parser.add_argument('--state', help='file keeping the sums between runs, so only new rows are read')
+    parser.add_argument('--mode-map', help='CSV of survey_mode, mode')
+    parser.add_argument('--waves', nargs='+', help='waves to use (default all)')
+    parser.add_argument('--chunk-size', type=int, default=default_chunk_size, help='records read at a time')
+    parser.add_argument('--annualisation', type=float, default=default_annualisation, help='days in a year')
+    parser.add_argument('--template', default='base_numbers.csv', help='current base_numbers, for PT vkt and growth')
+    parser.add_argument('--output', default='survey_base_numbers.csv', help='file to write the table to')
+    args = parser.parse_args(argv)
+
+    import app
+
+    state = load_state(args.state) if args.state else None
+    mode_map = load_mode_map(args.mode_map) if args.mode_map else None
+    state, report = ingest(args.trips, state, args.chunk_size, mode_map)
+    if args.state:
+        save_state(state, args.state)
+    seconds = max(report['seconds'], 1e-9)
+    print('Read {:,} records ({:,.1f} MB) from {} files in {:.1f} s: {:,.0f} records/s, {:,.1f} MB/s'.format(
+        report['records'], report['bytes'] / 2**20, report['files'], report['seconds'],
+        report['records'] / seconds, report['bytes'] / 2**20 / seconds))
+    print('Across all files: {:,} records left out by the mode map, {:,} invalid (missing or negative distance or weight)'.format(
+        report['dropped'], report['invalid']))
+
+    template = pd.read_csv(args.template, index_col = 0)
+    base_numbers = build_base_numbers(wave_totals(state, args.waves), template, app.numbers['car_occupancy'], args.annualisation)
+    base_numbers.to_csv(args.output)
+    print('Wrote', args.output)
+
+
+if __name__ == '__main__':
+    main()